@@ -13,7 +13,13 @@ import pickle
 import time
 import shutil
 import glob
+import threading
+from copy import deepcopy
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+import simplejson as json
 
+from .. import config
+from ..external import portalocker
 from ..interfaces.base import BaseInterface
 from ..pipeline.engine import Node
 from ..pipeline.engine.utils import modify_paths
@@ -30,9 +36,18 @@ class PipeFunc(object):
 
             fsl_merge = PipeFunc(fsl.Merge, base_dir='.')
             out = fsl_merge(in_files=files, dimension='t')
+
+        or asynchronously, with :meth:`submit`::
+
+            with PipeFunc(fsl.Merge, base_dir='.') as fsl_merge:
+                future = fsl_merge.submit(in_files=files, dimension='t')
+                out = future.result()
+
+        The default process pool of :meth:`submit` is stopped by
+        :meth:`shutdown`, or when leaving the with block.
     """
 
-    def __init__(self, interface, base_dir, callback=None):
+    def __init__(self, interface, base_dir, callback=None, executor=None):
         """
 
             Parameters
@@ -45,6 +60,11 @@ class PipeFunc(object):
             callback: a callable
                 An optional callable called each time after the function
                 is called.
+            executor: a concurrent.futures.Executor, or a callable
+                An optional executor running the calls made with submit,
+                or a callable returning it (called on each submit that
+                needs it). By default, a process pool is created on the
+                first call, and stopped by shutdown.
         """
         if not (isinstance(interface, type)
                 and issubclass(interface, BaseInterface)):
@@ -60,8 +80,10 @@ class PipeFunc(object):
                           self.interface.help(returnhelp=True))
         self.__doc__ = doc
         self.callback = callback
+        self.executor = executor
+        self._pool = None
 
-    def __call__(self, **kwargs):
+    def _make_node(self, kwargs):
         kwargs = modify_paths(kwargs, relative=False)
         interface = self.interface()
         # Set the inputs early to get some argument checking
@@ -75,24 +97,82 @@ class PipeFunc(object):
         job_name = hasher.hexdigest()
         node = Node(interface, name=job_name)
         node.base_dir = os.path.join(self.base_dir, dir_name)
+        return node, dir_name, job_name
 
-        cwd = os.getcwd()
-        try:
-            out = node.run()
-        finally:
-            # node.run() changes to the node directory - if something goes
-            # wrong before it cds back you would end up in strange places
-            os.chdir(cwd)
+    def __call__(self, **kwargs):
+        node, dir_name, job_name = self._make_node(kwargs)
+        out = _run_node(node)
         if self.callback is not None:
             self.callback(dir_name, job_name)
         return out
 
+    def submit(self, **kwargs):
+        """ Call the function asynchronously
+
+            Returns a concurrent.futures.Future of the results. Calls
+            found in the cache are resolved immediately, the others are
+            run by the executor.
+        """
+        node, dir_name, job_name = self._make_node(kwargs)
+        node.config = deepcopy(config._sections)
+        _, updated = node.is_cached()
+        if updated and not (node.overwrite or node.interface.always_run):
+            future = Future()
+            try:
+                future.set_result(_run_node(node))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future = self._get_executor().submit(_run_node, node)
+        if self.callback is not None:
+            future.add_done_callback(
+                lambda future: future.exception() is None and
+                self.callback(dir_name, job_name))
+        return future
+
+    def _get_executor(self):
+        if self.executor is None:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor()
+            return self._pool
+        if isinstance(self.executor, Executor):
+            return self.executor
+        return self.executor()
+
+    def shutdown(self, wait=True):
+        """ Stop the worker processes of the default pool
+
+            Executors given to the constructor (e.g., the pool of a
+            Memory) are left to their owner.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
     def __repr__(self):
         return '{}({}.{}), base_dir={})'.format(
             self.__class__.__name__, self.interface.__module__,
             self.interface.__name__, self.base_dir)
 
 
+def _run_node(node):
+    """ Run a node, in the caller or in a worker process
+    """
+    cwd = os.getcwd()
+    try:
+        return node.run()
+    finally:
+        # node.run() changes to the node directory - if something goes
+        # wrong before it cds back you would end up in strange places
+        os.chdir(cwd)
+
+
 ###############################################################################
 # Memory manager: provide some tracking about what is computed when, to
 # be able to flush the disk
@@ -136,6 +216,20 @@ def rm_all_but(base_dir, dirs_to_keep, warn=False):
             shutil.rmtree(dir_name)
 
 
+def dir_size(path):
+    """ Return the size in bytes of the files under path
+    """
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                # File has been deleted
+                pass
+    return size
+
+
 class _MemoryCallback(object):
     "An object to avoid closures and have everything pickle"
 
@@ -146,6 +240,16 @@ class _MemoryCallback(object):
         self.memory._log_name(dir_name, job_name)
 
 
+class _MemoryExecutor(object):
+    "Gives the executor of a memory, created on first use"
+
+    def __init__(self, memory):
+        self.memory = memory
+
+    def __call__(self):
+        return self.memory.executor
+
+
 class Memory(object):
     """ Memory context to provide caching for interfaces
 
@@ -158,23 +262,95 @@ class Memory(object):
         =======
         cache
             Creates a cacheable function from an nipype Interface class
+        map
+            Calls a cached interface on several sets of inputs, in parallel
         clear_previous_runs
             Removes from the disk all the runs that where not used after
             the creation time of the specific Memory instance
         clear_previous_runs
             Removes from the disk all the runs that where not used after
             the given time
+        shutdown
+            Stops the worker processes of map and PipeFunc.submit
+
+        max_bytes: integer, optional
+            If given, the runs used the least recently (or frequently)
+            are removed whenever the cache grows larger than max_bytes
+        policy: 'lru' or 'lfu', optional
+            Which runs are removed first: the least recently used (the
+            default) or the least frequently used ones
+        n_procs: integer, optional
+            Number of worker processes running the calls submitted with
+            map or PipeFunc.submit (default: the number of CPUs)
+
+        Every call is recorded, with the size of the run, in a ledger
+        (log.usage) shared by all the processes using the same cache
+        directory. Sizes are measured once, when a run is first recorded.
+
+        The worker processes are only started by the first asynchronous
+        call, and stopped by shutdown, or when leaving a with block::
+
+            with Memory('.', n_procs=4) as mem:
+                futures = mem.map(fsl.BET, inputs)
     """
 
-    def __init__(self, base_dir):
+    ledger_name = 'log.usage'
+
+    def __init__(self, base_dir, max_bytes=None, policy='lru',
+                 n_procs=None):
         base_dir = os.path.join(os.path.abspath(base_dir), 'nipype_mem')
         if not os.path.exists(base_dir):
             os.mkdir(base_dir)
         elif not os.path.isdir(base_dir):
             raise ValueError('base_dir should be a directory')
+        if policy not in ('lru', 'lfu'):
+            raise ValueError('policy should be "lru" or "lfu"')
         self.base_dir = base_dir
+        self.max_bytes = max_bytes
+        self.policy = policy
+        # Usage of each run: [size, time of last access, number of accesses]
+        self._usage = dict()
+        self._ledger_ino = None
+        self._ledger_offset = 0
+        self._ledger_lines = 0
+        self._lock = threading.Lock()
+        self.n_procs = n_procs
+        self._executor = None
         open(os.path.join(base_dir, 'log.current'), 'a').close()
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock'], state['_executor']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def executor(self):
+        """ The process pool running the calls submitted asynchronously
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.n_procs)
+        return self._executor
+
+    def shutdown(self, wait=True):
+        """ Stop the worker processes, once the submitted calls are done
+
+            A new pool is started by later asynchronous calls.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
     def cache(self, interface):
         """ Returns a callable that caches the output of an interface
 
@@ -214,7 +390,37 @@ class Memory(object):
             >>> results.outputs.merged_file # doctest: +SKIP
             '...'
         """
-        return PipeFunc(interface, self.base_dir, _MemoryCallback(self))
+        return PipeFunc(interface, self.base_dir, _MemoryCallback(self),
+                        executor=_MemoryExecutor(self))
+
+    def map(self, interface, inputs):
+        """ Call a cached interface on several sets of inputs, in parallel
+
+            Parameters
+            ==========
+            interface: nipype interface
+                The nipype interface class to be wrapped and cached
+            inputs: iterable of dictionaries
+                The keyword arguments of each call
+
+            Returns
+            =======
+            futures: list of concurrent.futures.Future
+                The results of each call. Calls found in the cache are
+                resolved immediately, the others are run on a pool of
+                n_procs processes.
+
+            Examples
+            ========
+
+            >>> futures = mem.map(fsl.BET, [{'in_file': 'a.nii'},
+            ...                             {'in_file': 'b.nii'}]
+            ...                   ) # doctest: +SKIP
+            >>> results = [future.result() for future in futures
+            ...            ] # doctest: +SKIP
+        """
+        pipe_func = self.cache(interface)
+        return [pipe_func.submit(**kwargs) for kwargs in inputs]
 
     def _log_name(self, dir_name, job_name):
         """ Increment counters tracking which cached function get executed.
@@ -242,6 +448,119 @@ class Memory(object):
                   'a') as rotatefile:
             rotatefile.write('%s/%s\n' % (dir_name, job_name))
 
+        self._record_usage(dir_name, job_name)
+
+    def _open_ledger(self):
+        """ Open the ledger for appending, with an exclusive lock
+        """
+        ledger = os.path.join(self.base_dir, self.ledger_name)
+        while True:
+            fp = open(ledger, 'ab')
+            portalocker.lock(fp, portalocker.LOCK_EX)
+            # The ledger may have been compacted while waiting for the lock
+            if os.path.exists(ledger) and \
+                    os.fstat(fp.fileno()).st_ino == os.stat(ledger).st_ino:
+                return fp
+            portalocker.unlock(fp)
+            fp.close()
+
+    def _read_ledger(self, fp):
+        """ Update the usage of the runs with the records appended by
+            this or other processes, since the last read
+        """
+        ino = os.fstat(fp.fileno()).st_ino
+        if ino != self._ledger_ino:
+            self._usage = dict()
+            self._ledger_ino = ino
+            self._ledger_offset = self._ledger_lines = 0
+        with open(os.path.join(self.base_dir, self.ledger_name),
+                  'rb') as ledger:
+            ledger.seek(self._ledger_offset)
+            data = ledger.read()
+        end = data.rfind(b'\n') + 1
+        self._ledger_offset += end
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line.decode())
+            except ValueError:
+                continue
+            self._ledger_lines += 1
+            job = record['job']
+            if record.get('removed'):
+                self._usage.pop(job, None)
+                continue
+            usage = self._usage.setdefault(job, [record['size'], 0, 0])
+            usage[0] = record['size']
+            usage[1] = max(usage[1], record['time'])
+            usage[2] += record.get('count', 1)
+
+    def _append_ledger(self, fp, record):
+        fp.write((json.dumps(record) + '\n').encode())
+        fp.flush()
+
+    def _record_usage(self, dir_name, job_name):
+        """ Record an access to a run, and evict runs if the cache is
+            larger than max_bytes
+        """
+        # Submitted calls are recorded from the threads of the executor
+        with self._lock:
+            self._record_usage_locked(dir_name, job_name)
+
+    def _record_usage_locked(self, dir_name, job_name):
+        job = '%s/%s' % (dir_name, job_name)
+        fp = self._open_ledger()
+        try:
+            self._read_ledger(fp)
+            if job in self._usage:
+                size = self._usage[job][0]
+            else:
+                size = dir_size(os.path.join(self.base_dir, dir_name,
+                                             job_name))
+            self._append_ledger(fp, {'job': job, 'size': size,
+                                     'time': time.time()})
+            if self.max_bytes is not None:
+                self._evict(fp, keep=job)
+            if self._ledger_lines > 4 * len(self._usage) + 1000:
+                self._compact_ledger()
+        finally:
+            portalocker.unlock(fp)
+            fp.close()
+
+    def _evict(self, fp, keep):
+        """ Remove runs, least recently (or frequently) used first, until
+            the cache fits in max_bytes
+        """
+        self._read_ledger(fp)
+        total = sum(usage[0] for usage in self._usage.values())
+        if total <= self.max_bytes:
+            return
+        if self.policy == 'lru':
+            order = lambda job: self._usage[job][1]
+        else:
+            order = lambda job: (self._usage[job][2], self._usage[job][1])
+        for job in sorted(self._usage, key=order):
+            if total <= self.max_bytes:
+                break
+            if job == keep:
+                continue
+            total -= self._usage.pop(job)[0]
+            shutil.rmtree(os.path.join(self.base_dir, job),
+                          ignore_errors=True)
+            self._append_ledger(fp, {'job': job, 'removed': True})
+        self._ledger_offset = os.fstat(fp.fileno()).st_size
+
+    def _compact_ledger(self):
+        """ Replace the ledger with one record per run (lock held)
+        """
+        ledger = os.path.join(self.base_dir, self.ledger_name)
+        with open(ledger + '.tmp', 'wb') as compacted:
+            for job, (size, last, count) in sorted(self._usage.items()):
+                compacted.write((json.dumps(
+                    {'job': job, 'size': size, 'time': last,
+                     'count': count}) + '\n').encode())
+        os.rename(ledger + '.tmp', ledger)
+        self._ledger_ino = None
+
     def clear_previous_runs(self, warn=True):
         """ Remove all the cache that where not used in the latest run of
             the memory object: i.e. since the corresponding Python object
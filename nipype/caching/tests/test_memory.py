@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """ Test the nipype interface caching mechanism
 """
+import pytest
 
 from .. import Memory
 from ...pipeline.engine.tests.test_engine import EngineTestInterface
@@ -39,3 +40,78 @@ def test_caching(tmpdir):
         assert results.outputs.output1 == [1, 1]
     finally:
         config.set('execution', 'stop_on_first_rerun', old_rerun)
+
+
+def test_caching_max_bytes(tmpdir):
+    from ..memory import dir_size
+    mem = Memory(tmpdir.strpath)
+    mem.cache(SideEffectInterface)(input1=1, input2=1)
+    func_dir = tmpdir.join('nipype_mem',
+                           'nipype-caching-tests-test_memory-'
+                           'SideEffectInterface')
+    job_size = dir_size(func_dir.strpath)
+
+    mem = Memory(tmpdir.strpath, max_bytes=int(2.5 * job_size))
+    pipe_func = mem.cache(SideEffectInterface)
+    pipe_func(input1=2, input2=1)
+    pipe_func(input1=1, input2=1)
+    pipe_func(input1=3, input2=1)
+    # The least recently used run was removed
+    assert len(func_dir.listdir()) == 2
+    before = nb_runs
+    pipe_func(input1=1, input2=1)
+    pipe_func(input1=3, input2=1)
+    assert nb_runs == before
+
+    # Usage is shared with other processes, through the ledger
+    other = Memory(tmpdir.strpath, max_bytes=int(2.5 * job_size),
+                   policy='lfu')
+    other.cache(SideEffectInterface)(input1=2, input2=1)
+    assert nb_runs == before + 1
+    assert len(func_dir.listdir()) == 2
+    # Run 3 was used less often than run 1
+    pipe_func(input1=1, input2=1)
+    assert nb_runs == before + 1
+    pipe_func(input1=3, input2=1)
+    assert nb_runs == before + 2
+    assert sorted(other._usage.values())[0][0] > 0
+
+
+def test_caching_map(tmpdir):
+    mem = Memory(tmpdir.strpath, n_procs=2)
+    # Synchronous calls do not start worker processes
+    mem.cache(SideEffectInterface)(input1=-1, input2=1)
+    assert mem._executor is None
+
+    inputs = [{'input1': i, 'input2': 1} for i in range(4)]
+    futures = mem.map(SideEffectInterface, inputs)
+    assert [future.result().outputs.output1 for future in futures] == \
+        [[1, i] for i in range(4)]
+    assert mem._executor is not None
+
+    # Cached calls are resolved without going through the pool
+    before = nb_runs
+    futures = mem.map(SideEffectInterface, inputs[:2])
+    assert all(future.done() for future in futures)
+    assert futures[1].result().outputs.output1 == [1, 1]
+    assert nb_runs == before
+
+    mem.shutdown()
+    assert mem._executor is None
+    with mem:
+        future = mem.map(SideEffectInterface, [{'input1': 5, 'input2': 1}])[0]
+        assert future.result().outputs.output1 == [1, 5]
+    assert mem._executor is None
+
+
+def test_pipefunc_shutdown(tmpdir):
+    from ..memory import PipeFunc
+    with PipeFunc(SideEffectInterface, tmpdir.strpath) as pipe_func:
+        future = pipe_func.submit(input1=7, input2=1)
+        assert future.result().outputs.output1 == [1, 7]
+        pool = pipe_func._pool
+        assert pool is not None
+    # The default pool is stopped when leaving the block
+    assert pipe_func._pool is None
+    with pytest.raises(RuntimeError):
+        pool.submit(int)
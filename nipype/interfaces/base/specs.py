@@ -19,7 +19,8 @@ from warnings import warn
 from builtins import str, bytes
 from packaging.version import Version
 
-from ...utils.filemanip import md5, hash_infile, hash_timestamp, to_str
+from ...utils.filemanip import (md5, hash_infile, hash_timestamp, to_str,
+                                file_hash_known)
 from .traits_extension import (
     traits,
     Undefined,
@@ -33,6 +34,8 @@ from .traits_extension import (
 from ... import config, __version__
 
 FLOAT_FORMAT = '{:.10f}'.format
+# Bytes hashed at each end of files with hash_method = sampled
+SAMPLED_HASH_LEN = 1048576
 nipype_version = Version(__version__)
 
 
@@ -215,7 +218,8 @@ class BaseTraitedSpec(traits.HasTraits):
         return has_metadata(
             self.trait(name).trait_type, metadata, value, recursive)
 
-    def get_hashval(self, hash_method=None):
+    def get_hashval(self, hash_method=None, hash_algorithm=None,
+                    hash_threads=None):
         """Return a dictionary of our items with hashes for each file.
 
         Searches through dictionary items and if an item is a file, it
@@ -226,6 +230,22 @@ class BaseTraitedSpec(traits.HasTraits):
         value of a file. The path and name of the file are not used in
         the overall hash calculation.
 
+        Parameters
+        ----------
+        hash_method : str
+            ``'timestamp'`` (size and modification time), ``'content'``
+            or ``'sampled'`` (size, first and last MB of the contents)
+        hash_algorithm : str
+            algorithm of the file digests, e.g. ``'md5'`` (default),
+            ``'sha256'``, ``'blake2b'`` or ``'xxhash'`` (see
+            :func:`~nipype.utils.filemanip.get_hash_function`). It is
+            recorded in the hashed inputs unless files are hashed with the
+            default (full contents, md5).
+        hash_threads : int
+            number of threads hashing the contents of files in parallel
+
+        Defaults are read from the ``execution`` section of the config.
+
         Returns
         -------
         list_withhash : dict
@@ -235,8 +255,13 @@ class BaseTraitedSpec(traits.HasTraits):
             The md5 hash value of the traited spec
 
         """
-        list_withhash = []
-        list_nofilename = []
+        if hash_method is None:
+            hash_method = config.get('execution', 'hash_method')
+        hash_method = hash_method.lower()
+        if hash_algorithm is None:
+            hash_algorithm = config.get('execution', 'hash_algorithm')
+
+        hashed_traits = []
         for name, val in sorted(self.trait_get().items()):
             if not isdefined(val) or self.has_metadata(name, "nohash", True):
                 # skip undefined traits and traits with nohash=True
@@ -244,70 +269,124 @@ class BaseTraitedSpec(traits.HasTraits):
 
             hash_files = (not self.has_metadata(name, "hash_files", False) and
                           not self.has_metadata(name, "name_source"))
-            list_nofilename.append((name,
-                                    self._get_sorteddict(
-                                        val,
-                                        hash_method=hash_method,
-                                        hash_files=hash_files)))
-            list_withhash.append((name,
-                                  self._get_sorteddict(
-                                      val,
-                                      True,
-                                      hash_method=hash_method,
-                                      hash_files=hash_files)))
+            hashed_traits.append((name, val, hash_files))
+
+        files = []
+        if hash_method in ('content', 'sampled'):
+            for _, val, hash_files in hashed_traits:
+                if hash_files:
+                    self._find_files(val, files)
+            if hash_threads is None:
+                hash_threads = config.get('execution', 'hash_threads')
+            self._prehash_files(files, hash_method, hash_algorithm,
+                                int(hash_threads or 1))
+
+        list_withhash = []
+        list_nofilename = []
+        for name, val, hash_files in hashed_traits:
+            # Both views are built in a single pass, hashing files once
+            nofilename, withhash = self._get_sorteddicts(
+                val, hash_method=hash_method, hash_files=hash_files,
+                hash_algorithm=hash_algorithm)
+            list_nofilename.append((name, nofilename))
+            list_withhash.append((name, withhash))
+        if files and (hash_method, hash_algorithm) != ('content', 'md5'):
+            list_withhash.append(('hash_algorithm', hash_algorithm if
+                                  hash_method == 'content' else
+                                  '%s:%s' % (hash_algorithm, hash_method)))
         return list_withhash, md5(to_str(list_nofilename).encode()).hexdigest()
 
+    def _find_files(self, objekt, files):
+        """Collect the paths of existing files in a trait value"""
+        if isinstance(objekt, dict):
+            objekt = list(objekt.values())
+        if isinstance(objekt, (list, tuple)):
+            for val in objekt:
+                self._find_files(val, files)
+        elif isinstance(objekt, (str, bytes)) and os.path.isfile(objekt):
+            files.append(objekt)
+
+    @staticmethod
+    def _prehash_files(files, hash_method, hash_algorithm, hash_threads):
+        """Hash the contents of files on a thread pool
+
+        Digests are memoized by :func:`~nipype.utils.filemanip.hash_infile`,
+        and simply looked up later on. The pool is only used when more than
+        one file needs to be read.
+        """
+        if len(files) < 2 or hash_threads < 2:
+            return
+        sample_len = SAMPLED_HASH_LEN if hash_method == 'sampled' else None
+        files = [path for path in sorted(set(files)) if not file_hash_known(
+            path, crypto=hash_algorithm, sample_len=sample_len)]
+        if len(files) < 2:
+            return
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(
+                max_workers=min(hash_threads, len(files))) as pool:
+            list(pool.map(lambda path: hash_infile(
+                path, crypto=hash_algorithm, sample_len=sample_len), files))
+
     def _get_sorteddict(self,
                         objekt,
                         dictwithhash=False,
                         hash_method=None,
                         hash_files=True):
+        return self._get_sorteddicts(
+            objekt, hash_method=hash_method,
+            hash_files=hash_files)[1 if dictwithhash else 0]
+
+    def _get_sorteddicts(self, objekt, hash_method=None, hash_files=True,
+                         hash_algorithm=None):
+        """Return the hashable representations of ``objekt`` without
+        (first) and with (second) the names of the files it contains"""
         if isinstance(objekt, dict):
-            out = []
+            nofilename, withhash = [], []
             for key, val in sorted(objekt.items()):
                 if isdefined(val):
-                    out.append((key,
-                                self._get_sorteddict(
-                                    val,
-                                    dictwithhash,
-                                    hash_method=hash_method,
-                                    hash_files=hash_files)))
+                    outs = self._get_sorteddicts(
+                        val, hash_method=hash_method, hash_files=hash_files,
+                        hash_algorithm=hash_algorithm)
+                    nofilename.append((key, outs[0]))
+                    withhash.append((key, outs[1]))
         elif isinstance(objekt, (list, tuple)):
-            out = []
+            nofilename, withhash = [], []
             for val in objekt:
                 if isdefined(val):
-                    out.append(
-                        self._get_sorteddict(
-                            val,
-                            dictwithhash,
-                            hash_method=hash_method,
-                            hash_files=hash_files))
+                    outs = self._get_sorteddicts(
+                        val, hash_method=hash_method, hash_files=hash_files,
+                        hash_algorithm=hash_algorithm)
+                    nofilename.append(outs[0])
+                    withhash.append(outs[1])
             if isinstance(objekt, tuple):
-                out = tuple(out)
+                nofilename, withhash = tuple(nofilename), tuple(withhash)
         else:
-            out = None
+            nofilename = withhash = None
             if isdefined(objekt):
                 if (hash_files and isinstance(objekt, (str, bytes)) and
                         os.path.isfile(objekt)):
                     if hash_method is None:
                         hash_method = config.get('execution', 'hash_method')
+                    if hash_algorithm is None:
+                        hash_algorithm = config.get('execution',
+                                                    'hash_algorithm')
 
                     if hash_method.lower() == 'timestamp':
                         hash = hash_timestamp(objekt)
                     elif hash_method.lower() == 'content':
-                        hash = hash_infile(objekt)
+                        hash = hash_infile(objekt, crypto=hash_algorithm)
+                    elif hash_method.lower() == 'sampled':
+                        hash = hash_infile(objekt, crypto=hash_algorithm,
+                                           sample_len=SAMPLED_HASH_LEN)
                     else:
                         raise Exception(
                             "Unknown hash method: %s" % hash_method)
-                    if dictwithhash:
-                        out = (objekt, hash)
-                    else:
-                        out = hash
+                    nofilename, withhash = hash, (objekt, hash)
                 elif isinstance(objekt, float):
-                    out = FLOAT_FORMAT(objekt)
+                    nofilename = withhash = FLOAT_FORMAT(objekt)
                 else:
-                    out = objekt
-        return out
+                    nofilename = withhash = objekt
+        return nofilename, withhash
 
     @property
     def __all__(self):
@@ -385,6 +385,62 @@ def test_TraitedSpec_withFile(setup_file):
     assert hashval[1] == 'a00e9ee24f5bfa9545a515b7a759886b'
 
 
+def test_TraitedSpec_hashes_files_once(setup_file):
+    import mock
+    tmp_infile = setup_file
+
+    class spec2(nib.TraitedSpec):
+        moo = nib.File(exists=True)
+        doo = nib.traits.List(nib.File(exists=True))
+
+    infields = spec2(moo=tmp_infile, doo=[tmp_infile])
+    with mock.patch('nipype.interfaces.base.specs.hash_infile',
+                    return_value='abc') as hash_infile:
+        hashed_inputs, _ = infields.get_hashval(hash_method='content')
+    # One call per file reference, not per view
+    assert hash_infile.call_count == 2
+    assert hashed_inputs == [('doo', [(tmp_infile, 'abc')]),
+                             ('moo', (tmp_infile, 'abc'))]
+
+
+def test_TraitedSpec_hash_algorithm(tmpdir):
+    import mock
+    from ....utils.filemanip import clear_file_hashes
+    files = []
+    for i in range(3):
+        afile = tmpdir.join('file%d.txt' % i)
+        afile.write('data %d' % i)
+        files.append(afile.strpath)
+
+    class spec2(nib.TraitedSpec):
+        moo = nib.traits.List(nib.File(exists=True))
+
+    infields = spec2(moo=files)
+    clear_file_hashes()
+    default = infields.get_hashval(hash_method='content')
+    # Digests computed on a thread pool match the serial ones
+    clear_file_hashes()
+    assert infields.get_hashval(hash_method='content',
+                                hash_threads=3) == default
+    assert infields.get_hashval(hash_method='content', hash_algorithm='md5',
+                                hash_threads=1) == default
+    # Memoized digests do not need a thread pool
+    with mock.patch('concurrent.futures.ThreadPoolExecutor') as pool:
+        assert infields.get_hashval(hash_method='content',
+                                    hash_threads=3) == default
+    assert not pool.called
+    assert 'hash_algorithm' not in dict(default[0])
+
+    hashed_inputs, hashvalue = infields.get_hashval(
+        hash_method='content', hash_algorithm='sha1', hash_threads=3)
+    assert hashvalue != default[1]
+    assert dict(hashed_inputs)['hash_algorithm'] == 'sha1'
+    hashed_inputs, _ = infields.get_hashval(
+        hash_method='sampled', hash_algorithm='sha1')
+    assert dict(hashed_inputs)['hash_algorithm'] == 'sha1:sampled'
+    clear_file_hashes()
+
+
 def test_TraitedSpec_withNoFileHashing(setup_file):
     tmp_infile = setup_file
     tmpd, nme = os.path.split(tmp_infile)
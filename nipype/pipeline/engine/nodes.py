@@ -27,7 +27,8 @@ from ...utils.misc import flatten, unflatten, str2bool, dict_diff
 from ...utils.filemanip import (md5, FileNotFoundError, ensure_list,
                                 simplify_list, copyfiles, fnames_presuffix,
                                 loadpkl, split_filename, load_json, makedirs,
-                                emptydirs, savepkl, to_str, indirectory, silentrm)
+                                emptydirs, savepkl, to_str, indirectory, silentrm,
+                                hash_index)
 
 from ...interfaces.base import (traits, InputMultiPath, CommandLine, Undefined,
                                 DynamicTraitedSpec, Bunch, InterfaceResult,
@@ -37,9 +38,12 @@ from ...interfaces.base.specs import get_filecopy_info
 from .utils import (
     _parameterization_dir, save_hashfile as _save_hashfile, load_resultfile as
     _load_resultfile, save_resultfile as _save_resultfile, nodelist_runner as
-    _node_runner, strip_temp as _strip_temp, write_report,
-    clean_working_directory, merge_dict, evaluate_connect_function)
+    _node_runner, strip_temp as _strip_temp, load_outputs as _load_outputs,
+    SubnodeResults as _SubnodeResults, _protect_collapses, write_report,
+    clean_working_directory, LayeredConfig, evaluate_connect_function,
+    get_cache_status_index)
 from .base import EngineBase
+from .store import ResultStore
 
 standard_library.install_aliases()
 
@@ -279,7 +283,10 @@ class Node(EngineBase):
 
     def get_output(self, parameter):
         """Retrieve a particular output of the node"""
-        return getattr(self.result.outputs, parameter, None)
+        value = getattr(self.result.outputs, parameter, None)
+        if isinstance(value, _SubnodeResults):
+            return value.tolist()
+        return value
 
     def help(self):
         """Print interface help"""
@@ -294,17 +301,19 @@ class Node(EngineBase):
 
         # Update hash
         hashed_inputs, hashvalue = self._get_hashval()
-
-        # The output folder does not exist: not cached
-        if not op.exists(outdir):
-            logger.debug('[Node] Directory not found "%s".', outdir)
-            return False, False
-
         hashfile = op.join(outdir, '_0x%s.json' % hashvalue)
-        cached = op.exists(hashfile)
+
+        index = get_cache_status_index()
+        globhashes = index.hashfiles(outdir) if index is not None else None
+        if globhashes is None:
+            # The output folder does not exist: not cached
+            if not op.exists(outdir):
+                logger.debug('[Node] Directory not found "%s".', outdir)
+                return False, False
+            globhashes = glob(op.join(outdir, '_0x*.json'))
+        cached = hashfile in globhashes
 
         # Check if updated
-        globhashes = glob(op.join(outdir, '_0x*.json'))
         unfinished = [
             path for path in globhashes
             if path.endswith('_unfinished.json')
@@ -327,6 +336,8 @@ class Node(EngineBase):
                            len(hashfiles), self.fullname)
             for rmfile in hashfiles:
                 os.remove(rmfile)
+            if index is not None:
+                index.forget(outdir)
 
             hashfiles = [hashfile] if cached else []
 
@@ -397,9 +408,10 @@ class Node(EngineBase):
             updates the hash without re-running.
         """
 
-        if self.config is None:
-            self.config = {}
-        self.config = merge_dict(deepcopy(config._sections), self.config)
+        if not isinstance(self.config, LayeredConfig):
+            # nodes run by a workflow are already layered on its config
+            self.config = LayeredConfig(
+                deepcopy(config._sections), self.config)
 
         outdir = self.output_dir()
         force_run = self.overwrite or (self.overwrite is None and
@@ -408,6 +420,10 @@ class Node(EngineBase):
         # Check hash, check whether run should be enforced
         logger.info('[Node] Setting-up "%s" in "%s".', self.fullname, outdir)
         cached, updated = self.is_cached()
+        index = get_cache_status_index()
+        if index is not None:
+            # Hashfiles are about to change
+            index.forget(outdir)
 
         # If the node is cached, check on pklz files and finish
         if not force_run and (updated or (not updated and updatehash)):
@@ -492,8 +508,12 @@ directory. Please ensure no other concurrent workflows are racing""", hashfile_u
         """Return a hash of the input state"""
         self._get_inputs()
         if self._hashvalue is None and self._hashed_inputs is None:
-            self._hashed_inputs, self._hashvalue = self.inputs.get_hashval(
-                hash_method=self.config['execution']['hash_method'])
+            with hash_index(self._hash_cache_dir()):
+                self._hashed_inputs, self._hashvalue = self.inputs.get_hashval(
+                    hash_method=self.config['execution']['hash_method'],
+                    hash_algorithm=self.config['execution'].get(
+                        'hash_algorithm'),
+                    hash_threads=self.config['execution'].get('hash_threads'))
             rm_extra = self.config['execution']['remove_unnecessary_outputs']
             if str2bool(rm_extra) and self.needed_outputs:
                 hashobject = md5()
@@ -503,6 +523,31 @@ directory. Please ensure no other concurrent workflows are racing""", hashfile_u
                 self._hashed_inputs.append(('needed_outputs', self.needed_outputs))
         return self._hashed_inputs, self._hashvalue
 
+    def _hash_cache_dir(self):
+        """Directory of the persistent index of file hashes, if enabled"""
+        execution = self.config['execution']
+        if not str2bool(execution.get('persistent_hashes', False)):
+            return None
+        return execution.get('hash_cache_dir') or op.join(
+            self.base_dir or os.getcwd(), '.nipype_hashes')
+
+    def _result_store(self):
+        """Shared store of outputs, if enabled (see ``shared_cache_dir``)
+
+        The store is keyed on the hash of the inputs, so it is only used
+        when files are hashed by their contents.
+        """
+        execution = (self.config or {}).get('execution', {})
+        directory = execution.get('shared_cache_dir')
+        if directory and execution.get('hash_method', '').lower() == 'content':
+            return ResultStore(directory)
+        return None
+
+    def _result_compression(self):
+        """Compression of the results file (see ``result_compression``)"""
+        return (self.config or {}).get('execution', {}).get(
+            'result_compression')
+
     def _get_inputs(self):
         """Retrieve inputs from pointers to results file
 
@@ -517,7 +562,7 @@ directory. Please ensure no other concurrent workflows are racing""", hashfile_u
             logger.debug('input: %s', key)
             results_file = info[0]
             logger.debug('results file: %s', results_file)
-            outputs = loadpkl(results_file).outputs
+            outputs = _load_outputs(results_file)
             if outputs is None:
                 raise RuntimeError("""\
 Error populating the input "%s" of node "%s": the results file of the source node \
@@ -525,16 +570,19 @@ Error populating the input "%s" of node "%s": the results file of the source nod
             output_value = Undefined
             if isinstance(info[1], tuple):
                 output_name = info[1][0]
-                value = getattr(outputs, output_name)
+                value = outputs[output_name]
+                if isinstance(value, _SubnodeResults):
+                    value = value.tolist()
                 if isdefined(value):
+                    # Values may be cached (see load_outputs)
                     output_value = evaluate_connect_function(
-                        info[1][1], info[1][2], value)
+                        info[1][1], info[1][2], deepcopy(value))
             else:
                 output_name = info[1]
-                try:
-                    output_value = outputs.trait_get()[output_name]
-                except AttributeError:
-                    output_value = outputs.dictcopy()[output_name]
+                output_value = outputs[output_name]
+                if isinstance(output_value, _SubnodeResults):
+                    # Only the connected output of the subnodes is read
+                    output_value = output_value.tolist()
             logger.debug('output: %s', output_name)
             try:
                 self.set_input(key, deepcopy(output_value))
@@ -585,7 +633,8 @@ Error populating the input "%s" of node "%s": the results file of the source nod
                     runtime=runtime,
                     inputs=self._interface.inputs.get_traitsfree(),
                     outputs=aggouts)
-                _save_resultfile(result, cwd, self.name)
+                _save_resultfile(result, cwd, self.name,
+                                 compression=self._result_compression())
             else:
                 logger.debug('aggregating mapnode results')
                 result = self._run_interface()
@@ -618,6 +667,21 @@ Error populating the input "%s" of node "%s": the results file of the source nod
             ),
             inputs=self._interface.inputs.get_traitsfree())
 
+        store = self._result_store()
+        if store is not None and not (self.overwrite or
+                                      self._interface.always_run):
+            outputs = store.get(self, outdir)
+            if outputs is not None:
+                logger.info('[Node] Outputs of "%s" found in the shared '
+                            'cache.', self.fullname)
+                result.outputs = self._interface._outputs()
+                result.outputs.trait_set(**outputs)
+                result.runtime.returncode = 0
+                result.runtime.duration = 0.0
+                _save_resultfile(result, outdir, self.name,
+                                 compression=self._result_compression())
+                return result
+
         if copyfiles:
             self._originputs = deepcopy(self._interface.inputs)
             self._copyfiles_to_wd(execute=execute)
@@ -632,7 +696,8 @@ Error populating the input "%s" of node "%s": the results file of the source nod
             except Exception as msg:
                 result.runtime.stderr = '{}\n\n{}'.format(
                     getattr(result.runtime, 'stderr', ''), msg)
-                _save_resultfile(result, outdir, self.name)
+                _save_resultfile(result, outdir, self.name,
+                                 compression=self._result_compression())
                 raise
             cmdfile = op.join(outdir, 'command.txt')
             with open(cmdfile, 'wt') as fd:
@@ -644,7 +709,8 @@ Error populating the input "%s" of node "%s": the results file of the source nod
         except Exception as msg:
             result.runtime.stderr = '%s\n\n%s'.format(
                 getattr(result.runtime, 'stderr', ''), msg)
-            _save_resultfile(result, outdir, self.name)
+            _save_resultfile(result, outdir, self.name,
+                             compression=self._result_compression())
             raise
 
         dirs2keep = None
@@ -658,8 +724,16 @@ Error populating the input "%s" of node "%s": the results file of the source nod
             self.needed_outputs,
             self.config,
             dirs2keep=dirs2keep)
-        _save_resultfile(result, outdir, self.name)
+        _save_resultfile(result, outdir, self.name,
+                         compression=self._result_compression())
 
+        if store is not None and hasattr(result.outputs, 'trait_get') and \
+                not self._interface.always_run:
+            try:
+                store.put(self, outdir, _protect_collapses(result.outputs))
+            except Exception as e:
+                logger.warning('[Node] Could not store the outputs of "%s" '
+                               'in the shared cache: %s', self.fullname, e)
         return result
 
     def _copyfiles_to_wd(self, execute=True, linksonly=False):
@@ -1065,8 +1139,11 @@ class MapNode(Node):
                 setattr(hashinputs, name, flatten(getattr(self._inputs, name)))
             else:
                 setattr(hashinputs, name, getattr(self._inputs, name))
-        hashed_inputs, hashvalue = hashinputs.get_hashval(
-            hash_method=self.config['execution']['hash_method'])
+        with hash_index(self._hash_cache_dir()):
+            hashed_inputs, hashvalue = hashinputs.get_hashval(
+                hash_method=self.config['execution']['hash_method'],
+                hash_algorithm=self.config['execution'].get('hash_algorithm'),
+                hash_threads=self.config['execution'].get('hash_threads'))
         rm_extra = self.config['execution']['remove_unnecessary_outputs']
         if str2bool(rm_extra) and self.needed_outputs:
             hashobject = md5()
@@ -1123,7 +1200,7 @@ class MapNode(Node):
             node.config = self.config
             yield i, node
 
-    def _collate_results(self, nodes):
+    def _collate_results(self, nodes, lazy=False):
         finalresult = InterfaceResult(
             interface=[],
             runtime=[],
@@ -1131,9 +1208,15 @@ class MapNode(Node):
             inputs=[],
             outputs=self.outputs)
         returncode = []
+        subnodes = []
         for i, nresult, err in nodes:
-            finalresult.runtime.insert(i, None)
             returncode.insert(i, err)
+            if lazy:
+                # Results are only read from the subnodes when accessed
+                subnodes.insert(
+                    i, op.join('mapflow', '_%s%d' % (self.name, i)))
+                continue
+            finalresult.runtime.insert(i, None)
 
             if nresult:
                 if hasattr(nresult, 'runtime'):
@@ -1161,6 +1244,20 @@ class MapNode(Node):
                     if any(defined_vals) and finalresult.outputs:
                         setattr(finalresult.outputs, key, values)
 
+        if lazy:
+            cwd = self.output_dir()
+            for attr in _SubnodeResults.attributes:
+                setattr(finalresult, attr,
+                        _SubnodeResults(subnodes, attr, base_dir=cwd))
+            rm_extra = str2bool(
+                self.config['execution']['remove_unnecessary_outputs'])
+            for key, _ in list((self.outputs or {}).items()):
+                if rm_extra and self.needed_outputs and \
+                        key not in self.needed_outputs:
+                    continue
+                setattr(finalresult.outputs, key, _SubnodeResults(
+                    subnodes, field=key, base_dir=cwd))
+
         if self.nested:
             for key, _ in list(self.outputs.items()):
                 values = getattr(finalresult.outputs, key)
@@ -1250,15 +1347,20 @@ class MapNode(Node):
         nnametpl = '_%s{}' % self.name
         nodenames = [nnametpl.format(i) for i in range(nitems)]
 
-        # Run mapnode
+        # Run mapnode (nested outputs are unflattened, hence collated)
+        lazy = not self.nested and str2bool(self.config['execution'].get(
+            'lazy_mapnode_results', False))
         result = self._collate_results(
             _node_runner(
                 self._make_nodes(cwd),
                 updatehash=updatehash,
                 stop_first=str2bool(
-                    self.config['execution']['stop_on_first_crash'])))
+                    self.config['execution']['stop_on_first_crash']),
+                skip_cached=lazy),
+            lazy=lazy)
         # And store results
-        _save_resultfile(result, cwd, self.name)
+        _save_resultfile(result, cwd, self.name,
+                         compression=self._result_compression())
         # remove any node directories no longer required
         dirs2remove = []
         for path in glob(op.join(cwd, 'mapflow', '*')):
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Content-addressed store of node outputs, shared across workflows
+
+Enabled by setting the ``shared_cache_dir`` option of the ``execution``
+section. Outputs of nodes that ran successfully are linked into the store,
+keyed by the interface (class and version) and the hash of the inputs of
+the node. Nodes with the same key, in any workflow, then link the outputs
+from the store into their working directory instead of running.
+
+The store is only used with ``hash_method = content``: timestamp hashes
+do not identify the contents of the input files, and different files with
+the same path, size and modification time would share outputs.
+"""
+from __future__ import (print_function, division, unicode_literals,
+                        absolute_import)
+from builtins import str, bytes, object
+
+import os
+import os.path as op
+import shutil
+from hashlib import sha256
+from uuid import uuid4
+
+from ... import logging
+from ...utils.filemanip import makedirs, savepkl, loadpkl, to_str
+
+logger = logging.getLogger('nipype.workflow')
+
+
+def _relocate(value, src, dst):
+    """Replace the ``src`` prefix of the paths found in ``value``"""
+    if isinstance(value, dict):
+        return {key: _relocate(val, src, dst) for key, val in value.items()}
+    if isinstance(value, (list, tuple)):
+        out = [_relocate(val, src, dst) for val in value]
+        return tuple(out) if isinstance(value, tuple) else out
+    if isinstance(value, (str, bytes)) and (
+            value == src or value.startswith(src + os.sep)):
+        return dst + value[len(src):]
+    return value
+
+
+def _paths(value):
+    """Yield the strings found in ``value``"""
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        for val in value:
+            for path in _paths(val):
+                yield path
+    elif isinstance(value, (str, bytes)):
+        yield value
+
+
+def _link(src, dst):
+    """Hard link a file, or copy it across filesystems"""
+    makedirs(op.dirname(dst), exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _link_tree(src, dst):
+    """Link the files at (or under) ``src`` to ``dst``"""
+    if not op.isdir(src):
+        _link(src, dst)
+        return
+    for root, dirs, files in os.walk(src):
+        target = op.join(dst, op.relpath(root, src))
+        makedirs(target, exist_ok=True)
+        for name in files:
+            _link(op.join(root, name), op.join(target, name))
+
+
+class ResultStore(object):
+    """Content-addressed store of node outputs
+
+    Each entry is a directory named after the key of the node, with the
+    (relocatable) outputs in ``outputs.pklz`` and the files they
+    reference under ``files/``, at their path relative to the working
+    directory of the node. Files are hard-linked when possible, so they
+    should not be modified in place.
+    """
+
+    def __init__(self, directory):
+        self.directory = op.abspath(directory)
+
+    def key(self, node):
+        """Return the key of a node in the store"""
+        interface = node.interface
+        try:
+            version = interface.version
+        except Exception:
+            version = None
+        _, hashvalue = node._get_hashval()
+        ident = [
+            '%s.%s' % (interface.__module__, interface.__class__.__name__),
+            version, hashvalue
+        ]
+        return sha256(to_str(ident).encode()).hexdigest()
+
+    def _entry(self, key):
+        return op.join(self.directory, key[:2], key)
+
+    def get(self, node, outdir):
+        """Link the stored outputs of ``node`` into ``outdir``
+
+        Returns the outputs (as a dictionary), or None if not stored.
+        """
+        entry = self._entry(self.key(node))
+        outputs_file = op.join(entry, 'outputs.pklz')
+        if not op.exists(outputs_file):
+            return None
+        try:
+            stored = loadpkl(outputs_file)
+            for relpath in stored['files']:
+                _link_tree(op.join(entry, 'files', relpath),
+                           op.join(outdir, relpath))
+        except Exception as e:
+            logger.warning('Could not restore outputs from %s: %s', entry, e)
+            return None
+        logger.debug('Outputs of "%s" linked from %s', node.fullname, entry)
+        return _relocate(stored['outputs'], op.join(entry, 'files'), outdir)
+
+    def put(self, node, outdir, outputs):
+        """Store the outputs (a dictionary) of ``node``, run in ``outdir``
+
+        Outputs referencing files outside ``outdir`` are not stored.
+        Returns whether the outputs were stored.
+        """
+        entry = self._entry(self.key(node))
+        if op.exists(entry):
+            return True
+        files = set()
+        for path in _paths(outputs):
+            if not op.isabs(path) or not op.exists(path):
+                continue
+            if not path.startswith(outdir + os.sep):
+                logger.debug('Outputs of "%s" reference %s, outside of its '
+                             'working directory: not stored.',
+                             node.fullname, path)
+                return False
+            files.add(op.relpath(path, outdir))
+
+        tmpdir = op.join(self.directory, 'tmp-%s' % uuid4().hex)
+        try:
+            for relpath in files:
+                _link_tree(op.join(outdir, relpath),
+                           op.join(tmpdir, 'files', relpath))
+            makedirs(tmpdir, exist_ok=True)
+            savepkl(op.join(tmpdir, 'outputs.pklz'), {
+                'node': node.fullname,
+                'files': sorted(files),
+                'outputs': _relocate(outputs, outdir,
+                                     op.join(entry, 'files')),
+            })
+            makedirs(op.dirname(entry), exist_ok=True)
+            os.rename(tmpdir, entry)
+        except OSError as e:
+            # Most likely stored concurrently by another process
+            logger.debug('Could not store outputs of "%s": %s',
+                         node.fullname, e)
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            return op.exists(entry)
+        logger.debug('Outputs of "%s" stored in %s', node.fullname, entry)
+        return True
@@ -10,7 +10,7 @@ import pytest
 from .... import config
 from ....interfaces import utility as niu
 from ... import engine as pe
-from ..utils import merge_dict
+from ..utils import merge_dict, load_outputs
 from .test_base import EngineTestInterface
 from .test_utils import UtilsTestInterface
 
@@ -161,6 +161,84 @@ def test_mapnode_nested(tmpdir):
     assert "can only concatenate list" in str(excinfo.value)
 
 
+def test_mapnode_lazy_results(tmpdir):
+    import mock
+    import shutil
+    from nipype import MapNode, Function
+    from .. import utils
+    from ..utils import SubnodeResults, load_resultfile
+
+    def func1(in1):
+        return in1 + 1, in1 * 2
+
+    def mapnode(base_dir, in1):
+        node = MapNode(
+            Function(input_names=['in1'], output_names=['out1', 'out2'],
+                     function=func1),
+            iterfield=['in1'],
+            name='n1',
+            base_dir=tmpdir.join(base_dir).strpath)
+        node.config = {'execution': {'lazy_mapnode_results': True}}
+        node.inputs.in1 = in1
+        return node
+
+    n1 = mapnode('a', [1, 2, 3])
+    n1.run()
+
+    result = n1.result
+    assert isinstance(result.outputs.out1, SubnodeResults)
+    assert isinstance(result.runtime, SubnodeResults)
+    assert len(result.outputs.out1) == 3
+
+    # Outputs of a subnode are only read when accessed
+    with mock.patch.object(utils, 'load_outputs',
+                           wraps=utils.load_outputs) as load:
+        assert result.outputs.out2[1] == 4
+        load.assert_called_once_with(os.path.join(
+            n1.output_dir(), 'mapflow', '_n11', 'result__n11.pklz'))
+    assert n1.get_output('out1') == [2, 3, 4]
+    assert [rt.cwd for rt in result.runtime] == [
+        os.path.join(n1.output_dir(), 'mapflow', '_n1%d' % i)
+        for i in range(3)]
+    assert result.inputs[2]['in1'] == 3
+
+    # Subnodes are referred to relative to the MapNode directory
+    shutil.move(tmpdir.join('a').strpath, tmpdir.join('b').strpath)
+    result = load_resultfile(tmpdir.join('b', 'n1').strpath, 'n1')[0]
+    assert result.outputs.out1.tolist() == [2, 3, 4]
+    assert result.outputs.out1.base_dir == tmpdir.join('b', 'n1').strpath
+
+    # Up-to-date subnodes are not run again, nor their results loaded
+    n1 = mapnode('b', [1, 2, 3, 4])
+    with mock.patch.object(pe.Node, 'run', autospec=True,
+                           side_effect=pe.Node.run) as run:
+        n1.run()
+    assert [call[0][0].name for call in run.call_args_list] == ['n1', '_n13']
+    assert n1.get_output('out2') == [2, 4, 6, 8]
+
+
+def test_mapnode_lazy_results_workflow(tmpdir):
+    from nipype import MapNode, Function
+    from ..utils import SubnodeResults
+
+    def func1(in1):
+        return in1 + 1
+
+    def func2(in1):
+        return sum(in1)
+
+    wf = pe.Workflow(name='wf', base_dir=tmpdir.strpath)
+    wf.config['execution']['lazy_mapnode_results'] = True
+    n1 = MapNode(Function(function=func1), iterfield=['in1'], name='n1')
+    n1.inputs.in1 = [1, 2, 3]
+    n2 = pe.Node(Function(function=func2), name='n2')
+    wf.connect(n1, 'out', n2, 'in1')
+    execgraph = wf.run()
+    nodes = {node.name: node for node in execgraph.nodes()}
+    assert isinstance(nodes['n1'].result.outputs.out, SubnodeResults)
+    assert nodes['n2'].get_output('out') == 9
+
+
 def test_mapnode_expansion(tmpdir):
     tmpdir.chdir()
     from nipype import MapNode, Function
@@ -305,3 +383,49 @@ def test_outputmultipath_collapse(tmpdir):
     assert ifres.outputs.out == [4]
     assert ndres.outputs.out == [4]
     assert select_nd.result.outputs.out == [4]
+
+
+def test_outputs_sidecar(tmpdir):
+    import mock
+    tmpdir.chdir()
+
+    def tuple_output(arg1):
+        return (arg1, 'b')
+
+    node = pe.Node(niu.Select(inlist=[[1, 2, 3], [4]], index=1),
+                   name='select_nd', base_dir=tmpdir.strpath)
+    node.config = {'execution': {'result_compression': 'none'}}
+    node.run()
+    resultsfile = os.path.join(node.output_dir(), 'result_select_nd.pklz')
+    assert tmpdir.join('select_nd', 'result_select_nd.json').check()
+    # Outputs are read back as from the results file, without unpickling
+    with mock.patch('nipype.pipeline.engine.utils.loadpkl') as mock_loadpkl:
+        assert load_outputs(resultsfile) == {'out': [4]}
+    assert not mock_loadpkl.called
+
+    # Outputs that JSON cannot represent are read from the results file
+    node = pe.Node(niu.Function(input_names=['arg1'], output_names=['out'],
+                                function=tuple_output),
+                   name='tuple_nd', base_dir=tmpdir.strpath)
+    node.inputs.arg1 = 1
+    node.run()
+    assert not tmpdir.join('tuple_nd', 'result_tuple_nd.json').check()
+    assert load_outputs(os.path.join(
+        node.output_dir(), 'result_tuple_nd.pklz')) == {'out': (1, 'b')}
+
+
+def test_node_config_snapshot(tmpdir):
+    tmpdir.chdir()
+    node = pe.Node(niu.Merge(1), name='merge', base_dir=tmpdir.strpath)
+    node.config = {'execution': {'remove_unnecessary_outputs': False}}
+    node.inputs.in1 = [1]
+    node.run()
+
+    # Later changes of the global config do not reach the run node
+    old = config.get('execution', 'crashfile_format')
+    try:
+        config.set('execution', 'crashfile_format', 'txt')
+        assert node.config['execution']['crashfile_format'] == old
+    finally:
+        config.set('execution', 'crashfile_format', old)
+    assert node.config['execution']['remove_unnecessary_outputs'] is False
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Tests for the shared store of node outputs
+"""
+from __future__ import (print_function, division, unicode_literals,
+                        absolute_import)
+import os
+
+from ... import engine as pe
+from ....interfaces import utility as niu
+
+
+def write_file(content, logdir):
+    import os
+    with open(os.path.join(logdir, 'runs.log'), 'a') as fp:
+        fp.write('run\n')
+    os.mkdir('subdir')
+    out_file = os.path.abspath(os.path.join('subdir', 'out.txt'))
+    with open(out_file, 'w') as fp:
+        fp.write(content)
+    return out_file
+
+
+def test_shared_cache(tmpdir):
+    tmpdir.chdir()
+    log = tmpdir.join('runs.log')
+    store = tmpdir.join('store')
+
+    outputs = []
+    for name in ('wf1', 'wf2'):
+        wf = pe.Workflow(name=name, base_dir=tmpdir.strpath)
+        wf.config['execution'] = {'shared_cache_dir': store.strpath,
+                                  'hash_method': 'content'}
+        writer = pe.Node(niu.Function(input_names=['content', 'logdir'],
+                                      output_names=['out_file'],
+                                      function=write_file),
+                         name='writer_%s' % name)
+        writer.inputs.content = 'some data'
+        writer.inputs.logdir = tmpdir.strpath
+        wf.add_nodes([writer])
+        execgraph = wf.run()
+        outputs.append(list(execgraph.nodes())[0].get_output('out_file'))
+
+    # The second workflow linked the outputs of the first one
+    assert log.readlines() == ['run\n']
+    assert outputs[1] == tmpdir.join(
+        'wf2', 'writer_wf2', 'subdir', 'out.txt').strpath
+    with open(outputs[1]) as fp:
+        assert fp.read() == 'some data'
+    assert os.stat(outputs[0]).st_ino == os.stat(outputs[1]).st_ino
+    assert len(store.listdir()) == 1
+
+
+def read_file(in_file, logdir):
+    import os
+    with open(os.path.join(logdir, 'runs.log'), 'a') as fp:
+        fp.write('run\n')
+    with open(in_file) as fp:
+        return fp.read()
+
+
+def test_shared_cache_timestamps(tmpdir):
+    tmpdir.chdir()
+    log = tmpdir.join('runs.log')
+    store = tmpdir.join('store')
+
+    outputs = []
+    for name, content in (('wf1', 'AAAA'), ('wf2', 'BBBB')):
+        # Same path, size and modification time, different contents
+        in_file = tmpdir.join('data.txt')
+        in_file.write(content)
+        os.utime(in_file.strpath, (1000000000, 1000000000))
+        wf = pe.Workflow(name=name, base_dir=tmpdir.strpath)
+        wf.config['execution'] = {'shared_cache_dir': store.strpath,
+                                  'hash_method': 'timestamp'}
+        reader = pe.Node(niu.Function(input_names=['in_file', 'logdir'],
+                                      output_names=['content'],
+                                      function=read_file),
+                         name='reader')
+        reader.inputs.in_file = in_file.strpath
+        reader.inputs.logdir = tmpdir.strpath
+        wf.add_nodes([reader])
+        execgraph = wf.run()
+        outputs.append(list(execgraph.nodes())[0].get_output('content'))
+
+    # Timestamp hashes do not identify the contents: the store is not used
+    assert outputs == ['AAAA', 'BBBB']
+    assert log.readlines() == ['run\n', 'run\n']
+    assert not store.check()
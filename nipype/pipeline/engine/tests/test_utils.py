@@ -11,12 +11,15 @@ import os
 import sys
 from copy import deepcopy
 import pytest
+import mock
 
 from ... import engine as pe
 from ....interfaces import base as nib
 from ....interfaces import utility as niu
 from .... import config
-from ..utils import clean_working_directory, write_workflow_prov
+from ..utils import (clean_working_directory, write_workflow_prov,
+                     cache_status_index, OutputsCache, get_outputs_cache,
+                     load_outputs, save_resultfile)
 
 
 class InputSpec(nib.TraitedSpec):
@@ -76,6 +79,51 @@ def test_identitynode_removal(tmpdir):
     assert len(eg.nodes()) == 8
 
 
+def test_expansion_copies():
+    wf = pe.Workflow(name='expansion')
+    subject = pe.Node(niu.IdentityInterface(['subject']), name='subject')
+    subject.iterables = ('subject', [1, 2, 3])
+    run = pe.Node(niu.IdentityInterface(['subject', 'run']), name='run')
+    run.itersource = ('subject', 'subject')
+    run.iterables = [('run', {1: [1], 2: [1, 2], 3: [1, 2, 3]})]
+    merge = pe.Node(niu.Merge(2), name='merge')
+    merge.plugin_args = {'qsub_args': '-l nodes=1'}
+    wf.connect(subject, 'subject', run, 'subject')
+    wf.connect([(run, merge, [('subject', 'in1'), ('run', 'in2')])])
+
+    eg = pe.generate_expanded_graph(wf._create_flat_graph())
+    merges = [node for node in eg.nodes() if node.name == 'merge']
+    assert sorted([node.inputs.in1, node.inputs.in2] for node in merges) == [
+        [1, 1], [2, 1], [2, 2], [3, 1], [3, 2], [3, 3]]
+    assert len(set(node.itername for node in merges)) == 6
+    # The interfaces are copied, the read-only attributes are shared
+    assert len(set(id(node.interface) for node in merges)) == 6
+    assert all(node.plugin_args is merges[0].plugin_args for node in merges)
+
+
+def test_topological_sort_depth_first():
+    import networkx as nx
+    from ..utils import topological_sort
+
+    graph = nx.DiGraph()
+    graph.add_edges_from([('a1', 'a2'), ('b1', 'b2'), ('a2', 'a3'),
+                          ('b2', 'b3'), ('c1', 'a3')])
+    graph.add_node('d1')
+    nodes, groups = topological_sort(graph, depth_first=True)
+    assert sorted(nodes) == sorted(graph.nodes())
+    assert sorted(set(groups)) == [1, 2, 3]
+    # the nodes of each group are contiguous and topologically sorted
+    components = {}
+    for node, group in zip(nodes, groups):
+        components.setdefault(group, []).append(node)
+    assert sorted(sorted(c) for c in components.values()) == [
+        ['a1', 'a2', 'a3', 'c1'], ['b1', 'b2', 'b3'], ['d1']]
+    assert groups == sorted(groups)
+    for component in components.values():
+        for u, v in graph.subgraph(component).edges():
+            assert component.index(u) < component.index(v)
+
+
 def test_clean_working_directory(tmpdir):
     class OutputSpec(nib.TraitedSpec):
         files = nib.traits.List(nib.File)
@@ -224,3 +272,105 @@ def test_mapnode_crash3(tmpdir):
     wf.config["execution"]["crashdump_dir"] = os.getcwd()
     with pytest.raises(RuntimeError):
         wf.run(plugin='Linear')
+
+
+@pytest.mark.skipif(not hasattr(os, 'scandir'), reason='needs os.scandir')
+def test_cache_status_index(tmpdir):
+    tmpdir.chdir()
+    wf = pe.Workflow(name='wf', base_dir=tmpdir.strpath)
+    mod1 = pe.MapNode(niu.Merge(1), iterfield=['in1'],
+                      name='mod1')
+    mod1.inputs.in1 = [1, 2]
+    mod2 = pe.Node(niu.Merge(1), name='mod2')
+    wf.connect(mod1, 'out', mod2, 'in1')
+    wf.run()
+
+    with cache_status_index(tmpdir.join('wf').strpath) as index:
+        outdir = tmpdir.join('wf', 'mod2').strpath
+        hashfiles = index.hashfiles(outdir)
+        assert len(hashfiles) == 1 and hashfiles[0].endswith('.json')
+        assert len(index.hashfiles(tmpdir.join(
+            'wf', 'mod1', 'mapflow', '_mod10').strpath)) == 1
+        assert index.hashfiles(tmpdir.join('wf', 'missing').strpath) == []
+        assert index.hashfiles(tmpdir.join('elsewhere', 'n').strpath) is None
+
+        # Cached nodes are found without querying the disk
+        node = pe.Node(niu.Merge(1), name='mod2',
+                       base_dir=tmpdir.join('wf').strpath)
+        node.config = deepcopy(config._sections)
+        node.inputs.in1 = [[1], [2]]
+        with mock.patch('nipype.pipeline.engine.nodes.glob') as mock_glob:
+            assert node.is_cached() == (True, True)
+        assert not mock_glob.called
+        node.inputs.in1 = [3]
+        node._hashvalue = node._hashed_inputs = None
+        assert node.is_cached() == (True, False)
+
+        index.forget(outdir)
+        assert index.hashfiles(outdir) is None
+        index.update(outdir)
+        assert index.hashfiles(outdir) == hashfiles
+
+
+@pytest.mark.skipif(not hasattr(os, 'scandir'), reason='needs os.scandir')
+def test_cache_status_index_symlink(tmpdir):
+    tmpdir.mkdir('real')
+    tmpdir.join('link').mksymlinkto(tmpdir.join('real'))
+    base_dir = tmpdir.join('link').strpath
+    wf = pe.Workflow(name='wf', base_dir=base_dir)
+    wf.config['execution'] = {'cache_status_index': True}
+    wf.add_nodes([pe.Node(niu.Merge(1), name='mod1')])
+    wf.run()
+
+    # Directories are found through the link, and by their real path
+    outdir = os.path.join(base_dir, 'wf', 'mod1')
+    for root in (os.path.join(base_dir, 'wf'), tmpdir.join('real', 'wf')):
+        with cache_status_index(str(root)) as index:
+            hashfiles = index.hashfiles(outdir)
+            assert len(hashfiles) == 1
+            assert hashfiles[0].startswith(outdir + os.sep)
+            assert index.hashfiles(os.path.realpath(outdir)) == [
+                os.path.realpath(hashfiles[0])]
+
+
+def test_outputs_cache(tmpdir):
+    cache = OutputsCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)  # Evicts the least recently used
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert (cache.hits, cache.misses) == (3, 1)
+    cache.resize(1)
+    assert len(cache) == 1 and cache.hits == 0
+
+    # Results files are read once, and again when rewritten
+    result = nib.InterfaceResult(
+        interface=None, runtime=None, inputs={},
+        outputs=nib.Bunch(out=(1, 2)))
+    save_resultfile(result, tmpdir.strpath, 'node')
+    resultsfile = tmpdir.join('result_node.pklz').strpath
+    get_outputs_cache().clear()
+    assert load_outputs(resultsfile) == {'out': (1, 2)}
+    with mock.patch('nipype.pipeline.engine.utils.loadpkl') as mock_loadpkl:
+        outputs = load_outputs(resultsfile)
+        outputs['out'] = None
+        assert load_outputs(resultsfile) == {'out': (1, 2)}
+    assert not mock_loadpkl.called
+    assert get_outputs_cache().hits == 2
+
+    result.outputs = nib.Bunch(out=(3, 4))
+    save_resultfile(result, tmpdir.strpath, 'node')
+    os.utime(resultsfile, (0, 0))
+    assert load_outputs(resultsfile) == {'out': (3, 4)}
+
+    # Nested values are not shared with the cache
+    result.outputs = nib.Bunch(out=[[1, 2], {'a': [3]}])
+    save_resultfile(result, tmpdir.strpath, 'node')
+    os.utime(resultsfile, (1, 1))
+    outputs = load_outputs(resultsfile)
+    outputs['out'][0].append(5)
+    outputs['out'][1]['a'].append(6)
+    assert load_outputs(resultsfile) == {'out': [[1, 2], {'a': [3]}]}
+    get_outputs_cache().clear()
@@ -273,3 +273,146 @@ def test_config_setting(tmpdir):
     assert len(fl) == 1
     fl = glob(os.path.join(crashdir3, 'crash*'))
     assert len(fl) == 0
+
+
+def _test_function5(in_file):
+    return in_file
+
+
+def test_persistent_hashes(tmpdir):
+    from ....utils.filemanip import FileHashIndex
+    tmpdir.chdir()
+    tmpdir.join('data.txt').write('some data')
+
+    wf = pe.Workflow('hashes', base_dir=tmpdir.strpath)
+    wf.config = {'execution': {'hash_method': 'content',
+                               'persistent_hashes': True}}
+    n1 = pe.MapNode(niu.Function(function=_test_function5,
+                                 input_names=['in_file'],
+                                 output_names=['out']),
+                    iterfield=['in_file'], name='n1')
+    n1.inputs.in_file = [tmpdir.join('data.txt').strpath] * 2
+    wf.add_nodes([n1])
+    wf.run()
+
+    # One index for the whole workflow, and the file is indexed only once
+    index = [os.path.join(root, FileHashIndex.filename)
+             for root, _, files in os.walk(tmpdir.strpath)
+             if FileHashIndex.filename in files]
+    assert index == [os.path.join(tmpdir.strpath, '.nipype_hashes',
+                                  FileHashIndex.filename)]
+    with open(index[0]) as fp:
+        assert len(fp.readlines()) == 1
+    # The location of the index is not stored in the workflow config
+    assert not wf.config['execution']['hash_cache_dir']
+
+
+def _sum_function(values, offset):
+    return sum(sum(value) for value in values) + offset
+
+
+def test_stream_execution(tmpdir):
+    import mock
+    tmpdir.chdir()
+    wf = pe.Workflow('stream', base_dir=tmpdir.strpath)
+    wf.config = {'execution': {'stream_chunk_size': 2}}
+    subject = pe.Node(niu.IdentityInterface(['subject']), name='subject')
+    subject.iterables = ('subject', [10, 20, 30, 40, 50])
+    session = pe.Node(niu.IdentityInterface(['session']), name='session')
+    session.iterables = ('session', [1, 2])
+    offset = pe.Node(niu.Function(function=_test_function5,
+                                  input_names=['in_file'],
+                                  output_names=['out']), name='offset')
+    offset.inputs.in_file = 100
+    merge = pe.Node(niu.Merge(2), name='merge')
+    join = pe.JoinNode(niu.Function(function=_sum_function,
+                                    input_names=['values', 'offset'],
+                                    output_names=['out']),
+                       joinsource='session', joinfield='values', name='join')
+    wf.connect([(subject, merge, [('subject', 'in1')]),
+                (session, merge, [('session', 'in2')]),
+                (merge, join, [('out', 'values')]),
+                (offset, join, [('out', 'offset')])])
+    with mock.patch.object(pe.Node, 'run', autospec=True,
+                           side_effect=pe.Node.run) as run:
+        execgraph = wf.run()
+
+    # The session is joined, so the subjects are streamed in 3 chunks
+    for value in [10, 20, 30, 40, 50]:
+        outdir = tmpdir.join('stream', '_subject_%d' % value, 'join')
+        result = pe.utils.load_resultfile(outdir.strpath, 'join')[0]
+        assert result.outputs.out == 2 * value + 3 + 100
+    # The nodes that do not depend on the subjects are run once
+    names = sorted(call[0][0].name for call in run.call_args_list)
+    assert names == ['join'] * 5 + ['merge'] * 10 + ['offset']
+    # The execution graphs of all the chunks are returned
+    assert sorted(node.name for node in execgraph.nodes()) == names
+    offset = [node for node in execgraph.nodes() if node.name == 'offset'][0]
+    assert len(execgraph.out_edges(offset)) == 5
+    assert len(execgraph.in_edges(offset)) == 0
+
+
+def _wrap_list(value):
+    return [[value]]
+
+
+def test_graph_cache(tmpdir):
+    tmpdir.chdir()
+
+    def build(offset_value, subjects):
+        wf = pe.Workflow('cached', base_dir=tmpdir.strpath)
+        wf.config = {'execution': {'graph_cache': True}}
+        subject = pe.Node(niu.IdentityInterface(['subject']), name='subject')
+        subject.iterables = ('subject', subjects)
+        offset = pe.Node(niu.Function(function=_sum_function,
+                                      input_names=['values', 'offset'],
+                                      output_names=['out']), name='offset')
+        offset.inputs.offset = offset_value
+        wf.connect(subject, ('subject', _wrap_list), offset, 'values')
+        return wf
+
+    def outputs():
+        return [pe.utils.load_resultfile(
+            tmpdir.join('cached', '_subject_%d' % value,
+                        'offset').strpath, 'offset')[0].outputs.out
+                for value in (1, 2)]
+
+    cachefile = tmpdir.join('cached', '_graph_cache.pklz')
+    build(100, [1, 2]).run()
+    assert outputs() == [101, 102]
+    mtime = cachefile.mtime()
+
+    # A new input value is patched into the cached graph
+    build(200, [1, 2]).run()
+    assert cachefile.mtime() == mtime
+    assert outputs() == [201, 202]
+
+    # Changing the iterables recompiles the graph
+    execgraph = build(200, [1, 2, 3]).run()
+    assert len(execgraph.nodes()) == 3
+
+
+def test_layered_node_config(tmpdir):
+    tmpdir.chdir()
+    wf = pe.Workflow('layered', base_dir=tmpdir.strpath)
+    wf.config = {'execution': {'stop_on_first_crash': True}}
+    nodes = [pe.Node(niu.Function(function=_test_function5,
+                                  input_names=['in_file'],
+                                  output_names=['out']), name='n%d' % i)
+             for i in range(3)]
+    for node in nodes:
+        node.inputs.in_file = 1
+    nodes[2].config = {'execution': {'remove_unnecessary_outputs': False}}
+    wf.add_nodes(nodes)
+    execgraph = wf.run()
+
+    configs = dict((node.name, node.config) for node in execgraph.nodes())
+    # Nodes without overrides share their configuration
+    assert configs['n0'] is configs['n1']
+    assert configs['n2'] is not configs['n0']
+    for node_config in configs.values():
+        assert node_config['execution']['stop_on_first_crash'] is True
+        assert node_config['execution']['hash_method'] == 'timestamp'
+    assert configs['n2']['execution']['remove_unnecessary_outputs'] is False
+    with pytest.raises(TypeError):
+        configs['n0']['execution']['hash_method'] = 'content'
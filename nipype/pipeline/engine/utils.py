@@ -7,20 +7,24 @@ from __future__ import (print_function, division, unicode_literals,
 from builtins import str, open, next, zip, range
 
 import os
+import os.path as op
 import sys
 import pickle
-from collections import defaultdict
+import contextlib
+from collections import defaultdict, OrderedDict
 import re
-from copy import deepcopy
+from copy import copy, deepcopy
 from glob import glob
 
 from traceback import format_exception
 from hashlib import sha1
-import gzip
 
 from functools import reduce
+from heapq import heappop, heappush
+from numbers import Number
 
 import numpy as np
+import simplejson as json
 from future import standard_library
 
 from ... import logging, config, LooseVersion
@@ -33,7 +37,9 @@ from ...utils.filemanip import (
     get_related_files,
     FileNotFoundError,
     save_json,
+    load_json,
     savepkl,
+    loadpkl,
     write_rst_header,
     write_rst_dict,
     write_rst_list,
@@ -50,9 +56,16 @@ try:
 except ImportError:
     from funcsigs import signature
 
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
 standard_library.install_aliases()
 logger = logging.getLogger('nipype.workflow')
 PY3 = sys.version_info[0] > 2
+# Cache status of the working directory (see cache_status_index)
+_CACHE_STATUS = None
 
 
 def _parameterization_dir(param):
@@ -86,13 +99,141 @@ def save_hashfile(hashfile, hashed_inputs):
                             hashfile)
 
 
-def nodelist_runner(nodes, updatehash=False, stop_first=False):
+class CacheStatusIndex(object):
+    """Hashfiles found in the node directories of a working directory
+
+    The tree under ``root`` is scanned once (with :func:`os.scandir`), so
+    that :meth:`Node.is_cached` does not query the filesystem for each
+    node. Node directories (those with hashfiles, reports or pickled
+    nodes) are not descended into, except for the ``mapflow`` directories
+    of MapNodes. Directories changed during the run are re-scanned with
+    :meth:`update`, or dropped with :meth:`forget` (their status is then
+    read from the disk). The index is only valid in the process that
+    created it (not in forked workers).
+
+    Directories are identified by their real path, so that they are found
+    through symbolic links (e.g., to the base directory of the workflow).
+    """
+
+    markers = ('_report', '_node.pklz', '_inputs.pklz')
+
+    def __init__(self, root):
+        self.root = op.realpath(root)
+        self._pid = os.getpid()
+        self._hashfiles = {}
+        self._listed = set()
+        self._forgotten = set()
+        if os.path.isdir(self.root):
+            self._scan(self.root)
+
+    def _scandir(self, path):
+        """Return the hashfiles and subdirectories (not symlinks) of path"""
+        hashfiles, subdirs = [], []
+        for entry in os.scandir(path):
+            if entry.name.startswith('_0x') and entry.name.endswith('.json'):
+                hashfiles.append(entry.name)
+            elif entry.name in self.markers or entry.name.startswith(
+                    'result_'):
+                hashfiles.append(None)
+            elif (not entry.name.startswith('.') and
+                  entry.is_dir(follow_symlinks=False)):
+                subdirs.append(entry.name)
+        return hashfiles, subdirs
+
+    def _scan(self, root):
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            try:
+                hashfiles, subdirs = self._scandir(path)
+            except OSError:
+                continue
+            if hashfiles:
+                self._hashfiles[path] = [
+                    name for name in hashfiles if name is not None]
+                subdirs = [name for name in subdirs if name == 'mapflow']
+                if not subdirs:
+                    continue
+            self._listed.add(path)
+            stack.extend(op.join(path, name) for name in subdirs)
+
+    def __len__(self):
+        return len(self._hashfiles)
+
+    def hashfiles(self, outdir):
+        """Return the paths of the hashfiles in a node directory
+
+        None is returned when the status of the directory is not known.
+        """
+        if os.getpid() != self._pid:
+            return None
+        realdir = op.realpath(outdir)
+        if realdir in self._forgotten:
+            return None
+        if realdir in self._hashfiles:
+            return [op.join(outdir, name) for name in self._hashfiles[realdir]]
+        if realdir in self._listed or op.dirname(realdir) in self._listed:
+            # The directory does not exist, or is not a node directory
+            return []
+        return None
+
+    def update(self, outdir):
+        """Re-scan a node directory"""
+        if os.getpid() != self._pid:
+            return
+        realdir = op.realpath(outdir)
+        self._forgotten.discard(realdir)
+        try:
+            hashfiles, _ = self._scandir(realdir)
+        except OSError:
+            hashfiles = []
+        self._hashfiles[realdir] = [
+            name for name in hashfiles if name is not None]
+
+    def forget(self, outdir):
+        """Read the status of a node directory from the disk from now on"""
+        if os.getpid() == self._pid:
+            self._forgotten.add(op.realpath(outdir))
+
+
+@contextlib.contextmanager
+def cache_status_index(root):
+    """Index the cache status of the nodes under ``root`` while in context
+
+    Does nothing where :func:`os.scandir` is not available (Python 2).
+    """
+    global _CACHE_STATUS
+    if not hasattr(os, 'scandir'):
+        yield None
+        return
+    previous = _CACHE_STATUS
+    _CACHE_STATUS = CacheStatusIndex(root)
+    logger.debug('Indexed the cache status of %d node directories in %s',
+                 len(_CACHE_STATUS), root)
+    try:
+        yield _CACHE_STATUS
+    finally:
+        _CACHE_STATUS = previous
+
+
+def get_cache_status_index():
+    """Return the active :class:`CacheStatusIndex`, if any"""
+    return _CACHE_STATUS
+
+
+def nodelist_runner(nodes, updatehash=False, stop_first=False,
+                    skip_cached=False):
     """
     A generator that iterates and over a list of ``nodes`` and
     executes them.
 
+    With ``skip_cached``, nodes with up-to-date results are not run, and
+    their results are not loaded (None is yielded instead).
     """
     for i, node in nodes:
+        if skip_cached and not updatehash and _has_cached_result(node):
+            yield i, None, None
+            continue
         err = None
         result = None
         try:
@@ -112,6 +253,15 @@ def nodelist_runner(nodes, updatehash=False, stop_first=False):
             yield i, result, err
 
 
+def _has_cached_result(node):
+    """Whether running ``node`` would only load its cached results"""
+    if node.overwrite or (node.overwrite is None and
+                          node.interface.always_run):
+        return False
+    resultsfile = os.path.join(node.output_dir(), 'result_%s.pklz' % node.name)
+    return node.is_cached()[1] and os.path.exists(resultsfile)
+
+
 def write_report(node, report_type=None, is_mapnode=False):
     """Write a report file for a node"""
     if not str2bool(node.config['execution']['create_report']):
@@ -284,9 +434,16 @@ def _protect_collapses(hastraits):
     return _uncollapse(hastraits.trait_get(), collapsed)
 
 
-def save_resultfile(result, cwd, name):
-    """Save a result pklz file to ``cwd``"""
+def save_resultfile(result, cwd, name, compression=None):
+    """Save a result pklz file to ``cwd``
+
+    The outputs are also written, when they can be represented exactly
+    in JSON, to a small sidecar file (see :func:`load_outputs`).
+    ``compression`` defaults to the ``result_compression`` option.
+    """
     resultsfile = os.path.join(cwd, 'result_%s.pklz' % name)
+    if compression is None:
+        compression = config.get('execution', 'result_compression', 'gzip')
     if result.outputs:
         try:
             collapsed = _identify_collapses(result.outputs)
@@ -300,8 +457,13 @@ def save_resultfile(result, cwd, name):
         for k, v in list(modify_paths(tosave, relative=True, basedir=cwd).items()):
             setattr(result.outputs, k, v)
 
-    savepkl(resultsfile, result)
+    outputsfile = _outputs_file(resultsfile)
+    if os.path.exists(outputsfile):
+        os.remove(outputsfile)
+    savepkl(resultsfile, result, compression=compression)
     logger.debug('saved results in %s', resultsfile)
+    if result.outputs:
+        _save_outputs(result.outputs, resultsfile)
 
     if result.outputs:
         for k, v in list(outputs.items()):
@@ -332,13 +494,8 @@ def load_resultfile(path, name):
     result = None
     attribute_error = False
     if os.path.exists(resultsoutputfile):
-        pkl_file = gzip.open(resultsoutputfile, 'rb')
         try:
-            result = pickle.load(pkl_file)
-        except UnicodeDecodeError:
-            # Was this pickle created with Python 2.x?
-            pickle.load(pkl_file, fix_imports=True, encoding='utf-8')
-            logger.warning('Successfully loaded pkl in compatibility mode')
+            result = loadpkl(resultsoutputfile)
         except (traits.TraitError, AttributeError, ImportError,
                 EOFError) as err:
             if isinstance(err, (AttributeError, ImportError)):
@@ -361,12 +518,227 @@ def load_resultfile(path, name):
                 except FileNotFoundError:
                     logger.debug('conversion to full path results in '
                                  'non existent file')
+                _bind_subnode_results(
+                    [getattr(result.outputs, key) for key in outputs], path)
+            _bind_subnode_results([
+                getattr(result, attr, None)
+                for attr in SubnodeResults.attributes], path)
             aggregate = False
-        pkl_file.close()
     logger.debug('Aggregate: %s', aggregate)
     return result, aggregate, attribute_error
 
 
+def _outputs_file(resultsfile):
+    """Path of the outputs sidecar of a results file"""
+    return os.path.splitext(resultsfile)[0] + '.json'
+
+
+def _results_stamp(resultsfile):
+    stat = os.stat(resultsfile)
+    return [stat.st_size, getattr(stat, 'st_mtime_ns', stat.st_mtime)]
+
+
+def _outputs_dict(outputs):
+    try:
+        return outputs.trait_get()
+    except AttributeError:
+        return outputs.dictcopy()  # outputs is a Bunch
+
+
+def _save_outputs(outputs, resultsfile):
+    """Write the outputs, as stored in ``resultsfile``, to a JSON sidecar
+
+    Nothing is written if the outputs do not survive a round trip to JSON
+    (e.g., tuples or arrays).
+    """
+    # Values as read back from the results file (e.g., collapsed lists)
+    outputs = _outputs_dict(pickle.loads(pickle.dumps(outputs)))
+    data = {
+        'results': _results_stamp(resultsfile),
+        'outputs': {key: val for key, val in outputs.items()
+                    if isdefined(val)},
+        'undefined': sorted(key for key, val in outputs.items()
+                            if not isdefined(val)),
+    }
+    try:
+        if json.loads(json.dumps(data['outputs'])) != data['outputs']:
+            return
+    except (TypeError, ValueError):
+        return
+    save_json(_outputs_file(resultsfile), data)
+
+
+class OutputsCache(object):
+    """Bounded LRU cache of the outputs read by :func:`load_outputs`
+
+    Entries are keyed by the path, size and modification time of the
+    results file, so that rewritten results are read again. A ``maxsize``
+    of 0 disables the cache.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return a cached value (None if not cached)"""
+        value = self._entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries[key] = value  # Most recently used
+        return value
+
+    def put(self, key, value):
+        self._entries.pop(key, None)
+        if self.maxsize <= 0:
+            return
+        while len(self._entries) >= self.maxsize:
+            self._entries.popitem(last=False)
+        self._entries[key] = value
+
+    def resize(self, maxsize):
+        """Change the size limit, and reset the statistics"""
+        self.maxsize = maxsize
+        while len(self._entries) > max(maxsize, 0):
+            self._entries.popitem(last=False)
+        self.hits = self.misses = 0
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+
+_OUTPUTS_CACHE = OutputsCache()
+
+
+def get_outputs_cache():
+    """Return the :class:`OutputsCache` of this process"""
+    return _OUTPUTS_CACHE
+
+
+def load_outputs(resultsfile):
+    """Return the outputs stored in a results file, as a dictionary
+
+    Outputs are read from the JSON sidecar written by
+    :func:`save_resultfile` if it is up to date, which avoids unpickling
+    the whole result. Outputs read are kept in a cache (see
+    :class:`OutputsCache`). Returns None if the result has no outputs.
+    """
+    try:
+        key = (resultsfile, ) + tuple(_results_stamp(resultsfile))
+    except OSError:
+        key = None
+    outputs = _OUTPUTS_CACHE.get(key) if key else None
+    if outputs is None:
+        outputs = _read_outputs(resultsfile)
+        if outputs is None:
+            return None
+        if key:
+            _OUTPUTS_CACHE.put(key, outputs)
+    # Callers may modify the outputs (including nested lists and dicts)
+    return deepcopy(outputs)
+
+
+def _read_outputs(resultsfile):
+    try:
+        data = load_json(_outputs_file(resultsfile))
+        uptodate = data['results'] == _results_stamp(resultsfile)
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        uptodate = False
+    if uptodate:
+        outputs = data['outputs']
+        outputs.update((key, Undefined) for key in data['undefined'])
+        return outputs
+    outputs = loadpkl(resultsfile).outputs
+    if outputs is None:
+        return None
+    outputs = _outputs_dict(outputs)
+    _bind_subnode_results(outputs.values(), os.path.dirname(resultsfile))
+    return outputs
+
+
+class SubnodeResults(object):
+    """Lazy sequence of the results of the subnodes of a MapNode
+
+    With the ``lazy_mapnode_results`` option, the results of the subnodes
+    are not collated into the result of a MapNode. Each output ``field``,
+    and the runtimes, inputs, interfaces and provenance (``attribute``)
+    are sequences that only refer to the subnode directories (relative
+    to the MapNode directory, ``base_dir``). An item is read from the
+    results file of its subnode when accessed; outputs are read with
+    :func:`load_outputs`.
+    """
+
+    attributes = ('runtime', 'inputs', 'interface', 'provenance')
+
+    def __init__(self, subnodes, attribute='outputs', field=None,
+                 base_dir=None):
+        self.subnodes = list(subnodes)
+        self.attribute = attribute
+        self.field = field
+        self.base_dir = base_dir
+
+    def __getstate__(self):
+        # The directory is set again when the results file is read
+        state = self.__dict__.copy()
+        state['base_dir'] = None
+        return state
+
+    def __deepcopy__(self, memo):
+        return SubnodeResults(self.subnodes, self.attribute, self.field,
+                              self.base_dir)
+
+    def __len__(self):
+        return len(self.subnodes)
+
+    def _load(self, subnode):
+        if self.base_dir is None:
+            raise RuntimeError('The directory of the results of MapNode '
+                               'subnode "%s" is not known' % subnode)
+        path = os.path.join(self.base_dir, subnode)
+        name = os.path.basename(subnode)
+        if self.attribute == 'outputs':
+            outputs = load_outputs(os.path.join(path, 'result_%s.pklz' % name))
+            return None if outputs is None else outputs[self.field]
+        result = load_resultfile(path, name)[0]
+        return getattr(result, self.attribute, None)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._load(subnode) for subnode in self.subnodes[index]]
+        return self._load(self.subnodes[index])
+
+    def __iter__(self):
+        for subnode in self.subnodes:
+            yield self._load(subnode)
+
+    def tolist(self):
+        """Read all items (an output is Undefined if no item is defined)"""
+        values = list(self)
+        if self.attribute == 'outputs' and not any(
+                isdefined(val) for val in values):
+            return Undefined
+        return values
+
+    def __repr__(self):
+        return '<%s of %d subnodes>' % (self.field or self.attribute,
+                                        len(self))
+
+
+def _bind_subnode_results(values, base_dir):
+    """Set the MapNode directory of the lazy results among ``values``"""
+    for value in values:
+        if isinstance(value, SubnodeResults):
+            value.base_dir = base_dir
+
+
 def strip_temp(files, wd):
     """Remove temp from a list of file paths"""
     out = []
@@ -783,44 +1155,45 @@ def _merge_graphs(supergraph,
     Returns
     -------
     Returns a merged graph containing copies of the subgraph with
-    appropriate edge connections to the supergraph.
+    appropriate edge connections to the supergraph, and the list of
+    the {subgraph node: copy} dictionaries of each copy.
 
     """
-    # Retrieve edge information connecting nodes of the subgraph to other
-    # nodes of the supergraph.
-    supernodes = supergraph.nodes()
-    ids = [n._hierarchy + n._id for n in supernodes]
-    if len(np.unique(ids)) != len(ids):
+    # The root node is found by id in the subgraph
+    ids = [n._hierarchy + n._id for n in subgraph.nodes()]
+    if len(set(ids)) != len(ids):
         # This should trap the problem of miswiring when multiple iterables are
         # used at the same level. The use of the template below for naming
         # updates to nodes is the general solution.
         raise Exception(("Execution graph does not have a unique set of node "
                          "names. Please rerun the workflow"))
+    # Retrieve edge information connecting nodes of the subgraph to other
+    # nodes of the supergraph.
     edgeinfo = {}
-    for n in list(subgraph.nodes()):
-        nidx = ids.index(n._hierarchy + n._id)
-        for edge in supergraph.in_edges(list(supernodes)[nidx]):
+    for n in subgraph.nodes():
+        for edge in supergraph.in_edges(n):
             # make sure edge is not part of subgraph
-            if edge[0] not in subgraph.nodes():
-                if n._hierarchy + n._id not in list(edgeinfo.keys()):
-                    edgeinfo[n._hierarchy + n._id] = []
-                edgeinfo[n._hierarchy + n._id].append(
+            if edge[0] not in subgraph:
+                edgeinfo.setdefault(n, []).append(
                     (edge[0], supergraph.get_edge_data(*edge)))
     supergraph.remove_nodes_from(nodes)
     # Add copies of the subgraph depending on the number of iterables
     iterable_params = expand_iterables(iterables, synchronize)
     # If there are no iterable subgraphs, then return
     if not iterable_params:
-        return supergraph
+        return supergraph, []
     # Make an iterable subgraph node id template
     count = len(iterable_params)
     template = '.%s%%0%dd' % (prefix, np.ceil(np.log10(count)))
+    # The levels are the same in every copy of the subgraph
+    levels = get_levels(subgraph)
+    rootidx = ids.index(nodeid)
     # Copy the iterable subgraphs
+    all_copies = []
     for i, params in enumerate(iterable_params):
-        Gc = deepcopy(subgraph)
-        ids = [n._hierarchy + n._id for n in Gc.nodes()]
-        nodeidx = ids.index(nodeid)
-        rootnode = list(Gc.nodes())[nodeidx]
+        Gc, copies = _copy_subgraph(subgraph)
+        all_copies.append(copies)
+        rootnode = list(copies.values())[rootidx]
         paramstr = ''
         for key, val in sorted(params.items()):
             paramstr = '{}_{}_{}'.format(paramstr, _get_valid_pathstr(key),
@@ -828,8 +1201,7 @@ def _merge_graphs(supergraph,
             rootnode.set_input(key, val)
 
         logger.debug('Parameterization: paramstr=%s', paramstr)
-        levels = get_levels(Gc)
-        for n in Gc.nodes():
+        for orig, n in list(copies.items()):
             # update parameterization of the node to reflect the location of
             # the output directory.  For example, if the iterables along a
             # path of the directed graph consisted of the variables 'a' and
@@ -837,7 +1209,7 @@ def _merge_graphs(supergraph,
             # with iterable 'b' will be placed in a directory
             # _a_aval/_b_bval/.
 
-            path_length = levels[n]
+            path_length = levels[orig]
             # enter as negative numbers so that earlier iterables with longer
             # path lengths get precedence in a sort
             paramlist = [(-path_length, paramstr)]
@@ -847,12 +1219,51 @@ def _merge_graphs(supergraph,
                 n.parameterization = paramlist
         supergraph.add_nodes_from(Gc.nodes())
         supergraph.add_edges_from(Gc.edges(data=True))
-        for node in Gc.nodes():
-            if node._hierarchy + node._id in list(edgeinfo.keys()):
-                for info in edgeinfo[node._hierarchy + node._id]:
-                    supergraph.add_edges_from([(info[0], node, info[1])])
+        for orig, node in list(copies.items()):
+            for info in edgeinfo.get(orig, []):
+                supergraph.add_edges_from([(info[0], node, info[1])])
             node._id += template % i
-    return supergraph
+    return supergraph, all_copies
+
+
+# Node attributes that are replaced, never modified in place, once the
+# flat graph is built: copies of a node may share them
+_SHARED_NODE_ATTRIBUTES = ('config', 'plugin_args', 'input_source',
+                           'iterables', 'parameterization', '_needed_outputs')
+
+
+def _copy_node(node, memo):
+    """Copy a node for one parameterization of an iterable subgraph
+
+    Equivalent to a deepcopy, but immutable values and the attributes in
+    ``_SHARED_NODE_ATTRIBUTES`` are shared with the original node: only the
+    interface and the remaining mutable state are copied.
+    """
+    clone = copy(node)
+    memo[id(node)] = clone
+    for key, value in list(node.__dict__.items()):
+        if key not in _SHARED_NODE_ATTRIBUTES and not isinstance(
+                value, (str, bytes, Number, type(None))):
+            clone.__dict__[key] = deepcopy(value, memo)
+    return clone
+
+
+def _copy_subgraph(graph):
+    """Copy a graph of nodes with `_copy_node`
+
+    Returns the copy and the {node: copy} dictionary.
+    """
+    memo = {}
+    copies = OrderedDict(
+        (node, _copy_node(node, memo)) for node in graph.nodes())
+    graph_copy = graph.__class__()
+    graph_copy.add_nodes_from(
+        (copies[node], deepcopy(data, memo))
+        for node, data in graph.nodes(data=True))
+    graph_copy.add_edges_from(
+        (copies[src], copies[dest], deepcopy(data, memo))
+        for src, dest, data in graph.edges(data=True))
+    return graph_copy, copies
 
 
 def _connect_nodes(graph, srcnode, destnode, connection_info):
@@ -1008,28 +1419,40 @@ def generate_expanded_graph(graph_in):
     # the iterable nodes
     inodes = _iterable_nodes(graph_in)
     logger.debug("Detected iterable nodes %s", inodes)
+    # the queue of iterable nodes to expand, in the order of
+    # _iterable_nodes. The copies of an iterable node made by the
+    # expansion of its predecessors take its rank in the queue, so the
+    # order is never recomputed on the whole graph.
+    ranks = dict((node, rank) for rank, node in enumerate(inodes))
+    queue = [(rank, 0, node) for rank, node in enumerate(inodes)]
     # while there is an iterable node, expand the iterable node's
     # subgraphs
-    while inodes:
-        inode = inodes[0]
+    while queue:
+        inode = heappop(queue)[2]
+        if inode not in graph_in:
+            # replaced by its copies, or removed by an empty expansion
+            continue
         logger.debug("Expanding the iterable node %s...", inode)
 
         # the join successor nodes of the current iterable node
         jnodes = [
-            node for node in graph_in.nodes()
+            node for node in dfs_preorder(graph_in, inode)
             if hasattr(node, 'joinsource') and inode.name == node.joinsource
-            and nx.has_path(graph_in, inode, node)
         ]
 
         # excise the join in-edges. save the excised edges in a
         # {jnode: {source name: (destination name, edge data)}}
+        # dictionary, and the source nodes in a {jnode: sources}
         # dictionary
         jedge_dict = {}
+        jsrc_dict = {}
         for jnode in jnodes:
             in_edges = jedge_dict[jnode] = {}
+            jsrc_dict[jnode] = []
             edges2remove = []
             for src, dest, data in graph_in.in_edges(jnode, True):
                 in_edges[src.itername] = data
+                jsrc_dict[jnode].append(src)
                 edges2remove.append((src, dest))
 
             for src, dest in edges2remove:
@@ -1045,9 +1468,9 @@ def generate_expanded_graph(graph_in):
                 src_fields = [src_fields]
             # find the unique iterable source node in the graph
             try:
-                iter_src = next((node for node in graph_in.nodes()
-                                 if node.name == src_name
-                                 and nx.has_path(graph_in, node, inode)))
+                iter_src = next((node
+                                 for node in nx.ancestors(graph_in, inode)
+                                 if node.name == src_name))
             except StopIteration:
                 raise ValueError("The node %s itersource %s was not found"
                                  " among the iterable predecessor nodes" %
@@ -1108,9 +1531,18 @@ def generate_expanded_graph(graph_in):
             subgraph = graph_in.subgraph(subnodes)
         else:
             subgraph = graph_in.subgraph(subnodes).copy()
-        graph_in = _merge_graphs(graph_in, subnodes, subgraph,
-                                 inode._hierarchy + inode._id, iterables,
-                                 iterable_prefix, inode.synchronize)
+        graph_in, copies = _merge_graphs(graph_in, subnodes, subgraph,
+                                         inode._hierarchy + inode._id,
+                                         iterables, iterable_prefix,
+                                         inode.synchronize)
+        # queue the copies of the iterable subnodes
+        new_nodes = []
+        for subgraph_copies in copies:
+            for node, node_copy in list(subgraph_copies.items()):
+                new_nodes.append(node_copy)
+                if node_copy.iterables is not None:
+                    ranks[node_copy] = ranks[node]
+                    heappush(queue, (ranks[node], len(ranks), node_copy))
 
         # reconnect the join nodes
         for jnode in jnodes:
@@ -1119,7 +1551,12 @@ def generate_expanded_graph(graph_in):
             old_edge_dict = jedge_dict[jnode]
             # the edge source node replicates
             expansions = defaultdict(list)
-            for node in graph_in.nodes():
+            # the join in-edge sources are either replicated in the new
+            # nodes, or outside of the expanded subgraph
+            candidates = new_nodes + [
+                node for node in jsrc_dict[jnode] if node in graph_in
+            ]
+            for node in candidates:
                 for src_id in list(old_edge_dict.keys()):
                     # Drop the original JoinNodes; only concerned with
                     # generated Nodes
@@ -1189,8 +1626,6 @@ def generate_expanded_graph(graph_in):
                                  " expanded join point %s", jnode, in_node)
 
         # nx.write_dot(graph_in, '%s_post.dot' % node)
-        # the remaining iterable nodes
-        inodes = _iterable_nodes(graph_in)
 
     for node in graph_in.nodes():
         if node.parameterization:
@@ -1202,6 +1637,176 @@ def generate_expanded_graph(graph_in):
     return _remove_nonjoin_identity_nodes(graph_in)
 
 
+def stream_flatgraphs(flatgraph, chunk_size):
+    """Split the iterations of a flat graph in chunks
+
+    The iterables of one node are split in chunks of ``chunk_size``
+    values, so that each chunk can be expanded and run in turn, and the
+    execution graph expanded and scheduled at once is only a fraction of
+    the whole one. The streamed node is the iterable node with the most
+    iterations among the nodes without an itersource that are not the
+    joinsource of a join node.
+
+    The nodes that do not depend on the streamed node are yielded first,
+    in a graph of their own. Each chunk then copies the streamed node and
+    the nodes depending on it, along with their upstream nodes, which are
+    needed to expand and connect the chunk but have already been run (see
+    ``Workflow._run_flatgraphs``). Iterables are not expanded
+    incrementally within a chunk: the iterables of the nodes depending on
+    the streamed node are expanded for all the values of a chunk.
+
+    Yields copies of parts of the flat graph, or the flat graph itself
+    when none of its iterables can be streamed.
+    """
+    import networkx as nx
+    joinsources = set(node.joinsource for node in flatgraph.nodes()
+                      if hasattr(node, 'joinsource'))
+    candidates = []
+    for node in nx.topological_sort(flatgraph):
+        if node.iterables and not node.itersource and \
+                node.name not in joinsources:
+            _standardize_iterables(node)
+            candidates.append(node)
+    if not candidates:
+        logger.info('No iterables can be streamed, running the whole '
+                    'execution graph.')
+        yield flatgraph
+        return
+    snode = max(candidates, key=lambda node: count_iterables(
+        node.iterables, node.synchronize))
+    values = dict((field, list(func()))
+                  for field, func in list(snode.iterables.items()))
+    # split all the fields of synchronized iterables alike, or the first
+    # field of the product of the iterables
+    fields = sorted(values) if snode.synchronize else [sorted(values)[0]]
+    length = max(len(values[field]) for field in fields)
+    nchunks = int(np.ceil(length / chunk_size))
+    if nchunks < 2:
+        yield flatgraph
+        return
+
+    streamed = nx.descendants(flatgraph, snode) | set([snode])
+    upstream = set()
+    for node in streamed:
+        upstream |= nx.ancestors(flatgraph, node)
+    upstream -= streamed
+    others = set(flatgraph.nodes()) - streamed
+    if others:
+        logger.info('Running the nodes that do not depend on %s.', snode)
+        yield deepcopy(flatgraph.subgraph(others).copy())
+
+    def make_field_func(values):
+        return lambda: values
+
+    subgraph = flatgraph.subgraph(streamed | upstream).copy()
+    for chunk in range(nchunks):
+        logger.info('Streaming the iterables of %s: chunk %d of %d.', snode,
+                    chunk + 1, nchunks)
+        memo = {}
+        graph = deepcopy(subgraph, memo)
+        iterables = dict(
+            (field, make_field_func(
+                vals[chunk * chunk_size:(chunk + 1) * chunk_size]
+                if field in fields else vals))
+            for field, vals in list(values.items()))
+        memo[id(snode)].iterables = iterables
+        yield graph
+
+
+# Node attributes defining the structure of a flat graph, besides its
+# interfaces and connections (see graph_signature)
+_STRUCTURAL_NODE_ATTRIBUTES = (
+    '_hierarchy', '_id', 'iterables', 'itersource', 'synchronize',
+    'overwrite', 'run_without_submitting', 'plugin_args', '_mem_gb',
+    '_n_procs', '_needed_outputs', 'config', 'parameterization', 'iterfield',
+    'nested', '_serial', 'joinsource', 'joinfield')
+
+
+def _static_inputs(graph, node):
+    """Return the {field: value} inputs of a flat graph node that are
+    neither connected nor set by its iterables"""
+    fixed = set(dest for _, _, data in graph.in_edges(node, data=True)
+                for _, dest in data['connect'])
+    if node.iterables:
+        _standardize_iterables(node)
+        if isinstance(node.iterables, dict):
+            fixed.update(node.iterables)
+        else:
+            fixed.update(field for field, _ in node.iterables)
+    return dict((field, getattr(node.inputs, field))
+                for field in node.inputs.copyable_trait_names()
+                if field not in fixed)
+
+
+def graph_signature(flatgraph, *args):
+    """Hash the structure of a flat graph
+
+    The structural hash covers the nodes (interfaces, versions, iterables
+    and other settings), the connections, the inputs of the identity nodes
+    (propagated by the expansion), and ``args``. The other inputs of the
+    nodes, which can be patched into an execution graph, are hashed
+    separately.
+
+    Returns the structural hash, and the {node fullname: inputs hash}
+    dictionary of the non-identity nodes.
+    """
+    from ... import __version__
+    structure = [__version__, args]
+    inputs_hashes = {}
+    for node in sorted(flatgraph.nodes(), key=lambda node: node.fullname):
+        interface = node.interface
+        try:
+            version = interface.version
+        except Exception:
+            version = None
+        try:
+            outputs = node.outputs.copyable_trait_names()
+        except Exception:
+            outputs = None
+        attrs = []
+        for attr in _STRUCTURAL_NODE_ATTRIBUTES:
+            if not hasattr(node, attr):
+                continue
+            value = getattr(node, attr)
+            if attr == 'iterables' and isinstance(value, dict):
+                # standardized iterables hold functions returning the values
+                value = sorted((field, func() if callable(func) else func)
+                               for field, func in list(value.items()))
+            attrs.append((attr, value))
+        structure.append([
+            node.fullname, node.__class__.__name__, interface.__module__,
+            interface.__class__.__name__, version,
+            sorted(node.inputs.copyable_trait_names()), sorted(outputs or []),
+            attrs
+        ])
+        # standardizes the iterables of the node
+        static = sorted(_static_inputs(flatgraph, node).items())
+        if isinstance(interface, IdentityInterface):
+            structure.append(static)
+        else:
+            inputs_hashes[node.fullname] = sha1(
+                to_str(static).encode()).hexdigest()
+    structure.append(sorted(
+        (src.fullname, dest.fullname, data['connect'])
+        for src, dest, data in flatgraph.edges(data=True)))
+    return sha1(to_str(structure).encode()).hexdigest(), inputs_hashes
+
+
+def patch_static_inputs(flatgraph, execgraph, fullnames):
+    """Set the static inputs of the given flat graph nodes on their
+    replicates in the execution graph"""
+    replicates = defaultdict(list)
+    for node in execgraph.nodes():
+        replicates[node.fullname].append(node)
+    for node in flatgraph.nodes():
+        if node.fullname not in fullnames:
+            continue
+        static = _static_inputs(flatgraph, node)
+        for replicate in replicates[node.fullname]:
+            for field, value in list(static.items()):
+                replicate.set_input(field, value)
+
+
 def _iterable_nodes(graph_in):
     """Returns the iterable nodes in the given graph and their join
     dependencies.
@@ -1481,8 +2086,8 @@ def clean_working_directory(outputs,
         needed_files += [path for path, type in input_files if type == 'f']
     for extra in [
             '_0x*.json', 'provenance.*', 'pyscript*.m', 'pyjobs*.mat',
-            'command.txt', 'result*.pklz', '_inputs.pklz', '_node.pklz',
-            '.proc-*',
+            'command.txt', 'result*.pklz', 'result*.json', '_inputs.pklz',
+            '_node.pklz', '.proc-*',
     ]:
         needed_files.extend(glob(os.path.join(cwd, extra)))
     if files2keep:
@@ -1563,6 +2168,86 @@ def merge_dict(d1, d2, merge=lambda x, y: y):
     return result
 
 
+class _LayeredSection(Mapping):
+    """Read-only view of one section of a :class:`LayeredConfig`"""
+
+    def __init__(self, layers):
+        self.layers = layers
+
+    def __getitem__(self, key):
+        for layer in reversed(self.layers):
+            if key in layer:
+                return layer[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        seen = set()
+        for layer in reversed(self.layers):
+            for key in layer:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def __len__(self):
+        return len(set().union(*self.layers))
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class LayeredConfig(Mapping):
+    """Read-only configuration, looked up through a stack of layers
+
+    Each layer is a {section: {option: value}} dictionary, and options are
+    looked up from the last layer to the first one. Layers are referenced,
+    not copied, so nodes configured with the same layers can share one
+    instance.
+
+    >>> cfg = LayeredConfig({'execution': {'a': 1, 'b': 2}},
+    ...                     {'execution': {'b': 3}})
+    >>> cfg['execution']['a'], cfg['execution']['b']
+    (1, 3)
+    >>> LayeredConfig({'logging': {'a': 0}}, cfg)['execution']['b']
+    3
+
+    """
+
+    def __init__(self, *layers):
+        stack = []
+        for layer in layers:
+            stack.extend(getattr(layer, 'layers', [layer]))
+        # keep the last occurrence of layers given more than once
+        self.layers = []
+        for i, layer in enumerate(stack):
+            if layer and not any(layer is other for other in stack[i + 1:]):
+                self.layers.append(layer)
+
+    def __getitem__(self, section):
+        found = [layer[section] for layer in self.layers if section in layer]
+        if not found:
+            raise KeyError(section)
+        return _LayeredSection(found)
+
+    def __iter__(self):
+        seen = set()
+        for layer in self.layers:
+            for section in layer:
+                if section not in seen:
+                    seen.add(section)
+                    yield section
+
+    def __len__(self):
+        return len(set().union(*self.layers))
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.to_dict())
+
+    def to_dict(self):
+        """Return the resolved configuration as a dictionary"""
+        return dict((section, dict(values.items()))
+                    for section, values in self.items())
+
+
 def merge_bundles(g1, g2):
     for rec in g2.get_records():
         g1._add_record(rec)
@@ -1589,7 +2274,7 @@ def write_workflow_prov(graph, filename=None, format='all'):
             nipype_ns['hashval']: hashval
         }
         process = ps.g.activity(get_id(), None, None, attrs)
-        if isinstance(result.runtime, list):
+        if isinstance(result.runtime, (list, SubnodeResults)):
             process.add_attributes({pm.PROV["type"]: nipype_ns["MapNode"]})
             # add info about sub processes
             for idx, runtime in enumerate(result.runtime):
@@ -1692,7 +2377,7 @@ def write_workflow_resources(graph, filename=None, append=None):
                            ' (%s interface)', nodename, classname)
             continue
 
-        if not isinstance(rt_list, list):
+        if not isinstance(rt_list, (list, SubnodeResults)):
             rt_list = [rt_list]
 
         for subidx, runtime in enumerate(rt_list):
@@ -1726,22 +2411,23 @@ def topological_sort(graph, depth_first=False):
     if not depth_first:
         return nodesort, None
     logger.debug("Performing depth first search")
-    nodes = []
-    groups = []
-    group = 0
     G = nx.Graph()
     G.add_nodes_from(graph.nodes())
     G.add_edges_from(graph.edges())
-    components = nx.connected_components(G)
-    for desc in components:
-        group += 1
-        indices = []
-        for node in desc:
-            indices.append(nodesort.index(node))
-        nodes.extend(
-            np.array(nodesort)[np.array(indices)[np.argsort(indices)]]
-            .tolist())
+    # the (1-based) group of each node is its connected component
+    node_groups = {}
+    ngroups = 0
+    for desc in nx.connected_components(G):
+        ngroups += 1
         for node in desc:
-            nodesort.remove(node)
-        groups.extend([group] * len(desc))
+            node_groups[node] = ngroups
+    # keep the topological order within each group
+    components = [[] for _ in range(ngroups)]
+    for node in nodesort:
+        components[node_groups[node] - 1].append(node)
+    nodes = []
+    groups = []
+    for group, component in enumerate(components, 1):
+        nodes.extend(component)
+        groups.extend([group] * len(component))
     return nodes, groups
@@ -13,6 +13,7 @@ from builtins import str, bytes, open
 import os
 import os.path as op
 import sys
+from collections import defaultdict
 from datetime import datetime
 from copy import deepcopy
 import pickle
@@ -26,10 +27,13 @@ from ...utils.functions import (getsource, create_function_from_source)
 
 from ...interfaces.base import (traits, TraitedSpec, TraitDictObject,
                                 TraitListObject)
-from ...utils.filemanip import save_json, makedirs, to_str
-from .utils import (generate_expanded_graph, export_graph, write_workflow_prov,
-                    write_workflow_resources, format_dot, topological_sort,
-                    get_print_name, merge_dict, format_node)
+from ...utils.filemanip import (save_json, makedirs, to_str, savepkl,
+                                loadpkl, clear_file_hashes)
+from .utils import (generate_expanded_graph, stream_flatgraphs, export_graph,
+                    write_workflow_prov, write_workflow_resources, format_dot,
+                    topological_sort, get_print_name, merge_dict, format_node,
+                    cache_status_index, get_outputs_cache, graph_signature,
+                    patch_static_inputs, LayeredConfig)
 
 from .base import EngineBase
 from .nodes import MapNode
@@ -434,7 +438,8 @@ connected.
             if graph2use in ['flat', 'exec']:
                 graph = self._create_flat_graph()
             if graph2use == 'exec':
-                graph = generate_expanded_graph(deepcopy(graph))
+                # the flat graph is a private copy, expanded in place
+                graph = generate_expanded_graph(graph)
             outfname = export_graph(
                 graph,
                 base_dir,
@@ -566,6 +571,7 @@ connected.
         """
         if plugin is None:
             plugin = config.get('execution', 'plugin')
+        plugin_mod = None
         if not isinstance(plugin, (str, bytes)):
             runner = plugin
             plugin = runner.__class__.__name__[:-len('Plugin')]
@@ -581,22 +587,39 @@ connected.
             else:
                 plugin_mod = getattr(sys.modules[name], '%sPlugin' % plugin)
                 runner = plugin_mod(plugin_args=plugin_args)
+        # Files may have changed since the last run
+        clear_file_hashes()
         flatgraph = self._create_flat_graph()
         self.config = merge_dict(deepcopy(config._sections), self.config)
+        execution = self.config['execution']
+        if execution.get('shared_cache_dir') and \
+                execution['hash_method'].lower() != 'content':
+            logger.warning('The shared cache (%s) is only used with '
+                           'hash_method = content.',
+                           execution['shared_cache_dir'])
         logger.info('Workflow %s settings: %s', self.name,
                     to_str(sorted(self.config)))
         self._set_needed_outputs(flatgraph)
-        execgraph = generate_expanded_graph(deepcopy(flatgraph))
-        for index, node in enumerate(execgraph.nodes()):
-            node.config = merge_dict(deepcopy(self.config), node.config)
-            node.base_dir = self.base_dir
-            node.index = index
-            if isinstance(node, MapNode):
-                node.use_plugin = (plugin, plugin_args)
-        self._configure_exec_nodes(execgraph)
-        if str2bool(self.config['execution']['create_report']):
-            self._write_report_info(self.base_dir, self.name, execgraph)
-        runner.run(execgraph, updatehash=updatehash, config=self.config)
+        chunk_size = int(execution.get('stream_chunk_size') or 0)
+        if chunk_size > 0:
+            flatgraphs = stream_flatgraphs(flatgraph, chunk_size)
+        else:
+            flatgraphs = [flatgraph]
+        outputs_cache = get_outputs_cache()
+        outputs_cache.resize(int(execution.get('outputs_cache_size', 256)))
+        if self.base_dir and str2bool(execution.get('cache_status_index')):
+            # One scan of the working directory instead of queries per node
+            with cache_status_index(op.join(self.base_dir, self.name)):
+                execgraph = self._run_flatgraphs(
+                    flatgraphs, runner, plugin, plugin_args, plugin_mod,
+                    updatehash)
+        else:
+            execgraph = self._run_flatgraphs(
+                flatgraphs, runner, plugin, plugin_args, plugin_mod,
+                updatehash)
+        logger.info('Outputs cache: %d hits, %d misses, %d of %d entries '
+                    'used.', outputs_cache.hits, outputs_cache.misses,
+                    len(outputs_cache), outputs_cache.maxsize)
         datestr = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
         if str2bool(self.config['execution']['write_provenance']):
             prov_base = op.join(self.base_dir,
@@ -613,6 +636,119 @@ connected.
 
     # PRIVATE API AND FUNCTIONS
 
+    def _run_flatgraphs(self, flatgraphs, runner, plugin, plugin_args,
+                        plugin_mod, updatehash):
+        """Expand and run the flat graphs in turn
+
+        When streaming, each chunk is run by a new instance of the plugin
+        (unless an instance was given). The nodes of a chunk that were
+        already run with a previous graph (the upstream nodes of the
+        streamed subgraph) are not run again: the nodes depending on them
+        read their results. Returns the union of the execution graphs, so
+        that all the nodes run are reported.
+        """
+        execution = self.config['execution']
+        use_cache = self.base_dir and str2bool(
+            execution.get('graph_cache', False)) and not int(
+                execution.get('stream_chunk_size') or 0)
+        execgraph = None
+        done = {}
+        for chunk, flatgraph in enumerate(flatgraphs):
+            if chunk and plugin_mod is not None:
+                runner = plugin_mod(plugin_args=plugin_args)
+            if use_cache:
+                graph = self._load_execgraph(flatgraph)
+            else:
+                graph = self._compile_execgraph(flatgraph)
+            # the inputs of the nodes were already set from their sources
+            edges = []
+            rerun = [node for node in graph.nodes()
+                     if node.output_dir() in done]
+            for node in rerun:
+                for _, target, data in graph.out_edges(node, data=True):
+                    edges.append((done[node.output_dir()], target, data))
+            graph.remove_nodes_from(rerun)
+            for node in graph.nodes():
+                if isinstance(node, MapNode):
+                    node.use_plugin = (plugin, plugin_args)
+            if str2bool(self.config['execution']['create_report']):
+                self._write_report_info(self.base_dir, self.name, graph)
+            runner.run(graph, updatehash=updatehash, config=self.config)
+            done.update((node.output_dir(), node) for node in graph.nodes())
+            if execgraph is None:
+                execgraph = graph
+            else:
+                execgraph.add_nodes_from(graph.nodes(data=True))
+                execgraph.add_edges_from(graph.edges(data=True))
+                execgraph.add_edges_from(edges)
+        return execgraph
+
+    def _compile_execgraph(self, flatgraph):
+        """Expand a flat graph, and configure the nodes for execution"""
+        # the flat graph is a private copy, expanded in place
+        execgraph = generate_expanded_graph(flatgraph)
+        # nodes share a snapshot of the workflow configuration, and the
+        # replicates of a node share its layered configuration
+        base = deepcopy(self.config)
+        execution = base['execution']
+        if str2bool(execution['persistent_hashes']) and \
+                not execution['hash_cache_dir']:
+            # Shared by all nodes (MapNode subnodes have their own base_dir)
+            execution['hash_cache_dir'] = op.join(
+                self.base_dir or os.getcwd(), '.nipype_hashes')
+        layered = {}
+        for index, node in enumerate(execgraph.nodes()):
+            if id(node.config) not in layered:
+                layered[id(node.config)] = (node.config, LayeredConfig(
+                    base, node.config))
+            node.config = layered[id(node.config)][1]
+            node.base_dir = self.base_dir
+            node.index = index
+        self._configure_exec_nodes(execgraph)
+        return execgraph
+
+    def _load_execgraph(self, flatgraph):
+        """Compile a flat graph, or reuse the execution graph compiled by a
+        previous run of the same workflow structure
+
+        The execution graph is saved in the working directory of the
+        workflow, with the structural hash of the flat graph and the hashes
+        of the inputs of its nodes. When the structure is unchanged, the
+        inputs that changed since are set on the replicates of their nodes.
+        """
+        cachefile = op.join(self.base_dir, self.name, '_graph_cache.pklz')
+        key, inputs_hashes = graph_signature(flatgraph, self.config,
+                                             self.base_dir)
+        cached = None
+        if op.exists(cachefile):
+            try:
+                cached = loadpkl(cachefile)
+            except Exception as e:
+                logger.warning('Could not load the graph cache %s: %s',
+                               cachefile, e)
+        if cached is not None and cached['key'] == key:
+            changed = set(
+                fullname for fullname, inputs_hash in inputs_hashes.items()
+                if cached['inputs'].get(fullname) != inputs_hash)
+            execgraph = cached['graph']
+            patch_static_inputs(flatgraph, execgraph, changed)
+            logger.info('Workflow %s: execution graph loaded from %s (%d '
+                        'nodes with new inputs).', self.name, cachefile,
+                        len(changed))
+            return execgraph
+
+        execgraph = self._compile_execgraph(flatgraph)
+        try:
+            makedirs(op.dirname(cachefile), exist_ok=True)
+            savepkl(cachefile, {'key': key, 'inputs': inputs_hashes,
+                                'graph': execgraph})
+        except Exception as e:
+            logger.warning('Could not save the execution graph in %s: %s',
+                           cachefile, e)
+            if op.exists(cachefile):
+                os.remove(cachefile)
+        return execgraph
+
     def _write_report_info(self, workingdir, name, graph):
         if workingdir is None:
             workingdir = os.getcwd()
@@ -625,6 +761,7 @@ connected.
             op.join(op.dirname(__file__), '..', '..', 'external', 'd3.js'),
             op.join(report_dir, 'd3.js'))
         nodes, groups = topological_sort(graph, depth_first=True)
+        jobids = dict((node, i) for i, node in enumerate(nodes))
         graph_file = op.join(report_dir, 'graph1.json')
         json_dict = {'nodes': [], 'links': [], 'groups': [], 'maxN': 0}
         for i, node in enumerate(nodes):
@@ -640,8 +777,10 @@ connected.
                     result=result_file,
                     group=groups[i]))
         maxN = 0
-        for gid in np.unique(groups):
-            procs = [i for i, val in enumerate(groups) if val == gid]
+        group_procs = defaultdict(list)
+        for i, gid in enumerate(groups):
+            group_procs[gid].append(i)
+        for gid, procs in sorted(group_procs.items()):
             N = len(procs)
             if N > maxN:
                 maxN = N
@@ -650,7 +789,7 @@ connected.
         json_dict['maxN'] = maxN
         for u, v in graph.in_edges():
             json_dict['links'].append(
-                dict(source=nodes.index(u), target=nodes.index(v), value=1))
+                dict(source=jobids[u], target=jobids[v], value=1))
         save_json(graph_file, json_dict)
         graph_file = op.join(report_dir, 'graph.json')
         # Avoid RuntimeWarning: divide by zero encountered in log10
@@ -670,7 +809,7 @@ connected.
         for i, node in enumerate(nodes):
             imports = []
             for u, v in graph.in_edges(nbunch=node):
-                imports.append(getname(u, nodes.index(u)))
+                imports.append(getname(u, jobids[u]))
             json_dict.append(
                 dict(
                     name=getname(node, i),
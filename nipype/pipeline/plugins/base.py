@@ -8,11 +8,13 @@ from __future__ import (print_function, division, unicode_literals,
 from builtins import range, object, open
 
 import sys
-from copy import deepcopy
 from glob import glob
+import getpass
+import json
 import os
 import shutil
-from time import sleep, time
+import threading
+from time import time
 from traceback import format_exception
 
 import numpy as np
@@ -20,9 +22,11 @@ import numpy as np
 from ... import logging
 from ...utils.filemanip import loadpkl
 from ...utils.misc import str2bool
-from ..engine.utils import topological_sort
+from ..engine.utils import topological_sort, get_cache_status_index
 from ..engine import MapNode
-from .tools import report_crash, report_nodes_not_run, create_pyscript
+from .tools import (report_crash, report_nodes_not_run, create_pyscript,
+                    load_runtime_profile, JobStatusCache,
+                    ResultWatcher)
 
 logger = logging.getLogger('nipype.workflow')
 
@@ -68,8 +72,30 @@ class DistributedPluginBase(PluginBase):
         submitted for execution
     proc_pending: a boolean numpy array (N,) signifying whether a
         process is currently running.
-    depidx: a boolean matrix (NxN) storing the dependency structure accross
-        processes. Process dependencies are derived from each column.
+
+    The dependency structure is kept in append-only adjacency lists
+    (``_successors``) together with a counter of unfinished dependencies per
+    process (``_indegree``). Processes enter the ``_ready`` set when their
+    counter drops to zero in :py:meth:`_task_finished_cb`, so finding the
+    jobs that can be submitted does not require scanning the whole graph.
+
+    The scheduling loop does not busy-wait: between iterations it blocks
+    until either a worker signals that a task has finished (see
+    :py:meth:`_notify`) or ``poll_sleep_duration`` seconds have elapsed.
+    Plugins that cannot signal completions (e.g. batch systems) simply fall
+    back to polling.
+
+    Very short jobs may be fused into a single worker task to amortize the
+    per-task overhead (serialization, process or batch job startup). This is
+    controlled with the following ``plugin_args``:
+
+      - batch_max_runtime: jobs whose estimated runtime (in seconds, see
+        ``runtime_profile``) is below this threshold are batched together.
+        Jobs with unknown runtime are never batched. Default: no batching.
+      - batch_size: maximum number of jobs fused into one task (default: 50)
+
+    Plugins implement :py:meth:`_submit_batch` to run a batch; results are
+    still collected and reported for each job individually.
 
     Combinations of ``proc_done`` and ``proc_pending``
     --------------------------------------------------
@@ -94,14 +120,28 @@ class DistributedPluginBase(PluginBase):
         """
         super(DistributedPluginBase, self).__init__(plugin_args=plugin_args)
         self.procs = None
-        self.depidx = None
-        self.refidx = None
+        self._jobids = None
         self.mapnodes = None
         self.mapnodesubids = None
         self.proc_done = None
         self.proc_pending = None
         self.pending_tasks = []
         self.max_jobs = self.plugin_args.get('max_jobs', np.inf)
+        self._successors = None
+        self._predecessors = None
+        self._indegree = None
+        self._ready = None
+        self._consumers = None
+        self._removable = None
+        self._priorities = None
+        self._runtimes_by_name = {}
+        self._runtimes_by_interface = {}
+        if self.plugin_args.get('runtime_profile'):
+            self._runtimes_by_name, self._runtimes_by_interface = \
+                load_runtime_profile(self.plugin_args['runtime_profile'])
+        self._wakeup = threading.Event()
+        self._batch_max_runtime = self.plugin_args.get('batch_max_runtime')
+        self._batch_size = int(self.plugin_args.get('batch_size', 50))
 
     def _prerun_check(self, graph):
         """Stub method to validate/massage graph and nodes before running"""
@@ -122,7 +162,6 @@ class DistributedPluginBase(PluginBase):
         self._generate_dependency_list(graph)
         self.mapnodes = []
         self.mapnodesubids = {}
-        # setup polling - TODO: change to threaded model
         notrun = []
 
         old_progress_stats = None
@@ -130,9 +169,7 @@ class DistributedPluginBase(PluginBase):
         while not np.all(self.proc_done) or np.any(self.proc_pending):
             loop_start = time()
             # Check if a job is available (jobs with all dependencies run)
-            # https://github.com/nipy/nipype/pull/2200#discussion_r141605722
-            jobs_ready = np.nonzero(~self.proc_done &
-                                    (self.depidx.sum(0) == 0))[1]
+            jobs_ready = self._ready_jobs()
 
             progress_stats = (len(self.proc_done),
                               np.sum(self.proc_done ^ self.proc_pending),
@@ -160,6 +197,7 @@ class DistributedPluginBase(PluginBase):
                             notrun.append(
                                 self._clean_queue(jobid, graph, result=result))
                         else:
+                            self._record_runtime(jobid, result['result'])
                             self._task_finished_cb(jobid)
                             self._remove_node_dirs()
                         self._clear_task(taskid)
@@ -184,8 +222,9 @@ class DistributedPluginBase(PluginBase):
             elif display_stats:
                 logger.debug('Not submitting (max jobs reached)')
 
-            sleep_til = loop_start + poll_sleep_secs
-            sleep(max(0, sleep_til - time()))
+            # Block until a task finishes or the polling period expires
+            if not np.all(self.proc_done) or np.any(self.proc_pending):
+                self._wait(loop_start + poll_sleep_secs - time())
 
         self._remove_node_dirs()
         report_nodes_not_run(notrun)
@@ -193,12 +232,50 @@ class DistributedPluginBase(PluginBase):
         # close any open resources
         self._postrun_check()
 
+    def _notify(self):
+        """Wake up the scheduling loop
+
+        Thread-safe: meant to be called from worker callbacks whenever a
+        task finishes, so that results are collected and new jobs
+        submitted without waiting for the next polling period.
+        """
+        self._wakeup.set()
+
+    def _wait(self, timeout):
+        """Block until :py:meth:`_notify` is called or ``timeout`` expires"""
+        if timeout > 0:
+            self._wakeup.wait(timeout)
+        # Notifications arriving after this point are not lost: the loop
+        # checks all pending tasks before waiting again.
+        self._wakeup.clear()
+
     def _get_result(self, taskid):
         raise NotImplementedError
 
     def _submit_job(self, node, updatehash=False):
         raise NotImplementedError
 
+    def _submit_batch(self, nodes, updatehash=False):
+        """Submit several nodes as a single task and return their taskids
+
+        Plugins supporting batched execution run the nodes one after the
+        other in a single worker and return one (distinct) taskid per node,
+        so that results are handed back individually by
+        :py:meth:`_get_result`. By default, nodes are submitted separately.
+        """
+        return [self._submit_job(node, updatehash=updatehash)
+                for node in nodes]
+
+    def _submit_array(self, nodes, updatehash=False):
+        """Submit homogeneous nodes as a job array and return their taskids
+
+        Unlike batches, the nodes of an array run as independent tasks of
+        the same submission. Only called with nodes sharing the same
+        :py:meth:`_array_key`. By default, nodes are submitted separately.
+        """
+        return [self._submit_job(node, updatehash=updatehash)
+                for node in nodes]
+
     def _report_crash(self, node, result=None):
         tb = None
         if result is not None:
@@ -233,8 +310,112 @@ class DistributedPluginBase(PluginBase):
         # remove dependencies from queue
         return self._remove_node_deps(jobid, crashfile, graph)
 
+    def _ready_jobs(self):
+        """Return the ids (sorted) of queued jobs with all dependencies run
+        """
+        # Jobs are dropped from the ready set lazily, once submitted
+        self._ready = set(
+            jobid for jobid in self._ready if not self.proc_done[jobid])
+        return np.array(sorted(self._ready), dtype=int)
+
+    def _runtime_estimate(self, jobid):
+        """Expected runtime of a job in seconds (``None`` if unknown)
+
+        Estimates are read from the ``runtime_profile`` plugin argument
+        (see :py:func:`~nipype.pipeline.plugins.tools.load_runtime_profile`)
+        and refined with the runtimes measured during the current run.
+        """
+        node = self.procs[jobid]
+        for name in (node.fullname, node.name):
+            if name in self._runtimes_by_name:
+                return self._runtimes_by_name[name]
+        return self._runtimes_by_interface.get(
+            node.interface.__class__.__name__)
+
+    def _record_runtime(self, jobid, result):
+        """Update the runtime estimate of the interface run by a job"""
+        runtime = getattr(result, 'runtime', None)
+        duration = getattr(runtime, 'duration', None)
+        if duration is None:  # Also skips MapNodes (list of runtimes)
+            return
+        key = self.procs[jobid].interface.__class__.__name__
+        previous = self._runtimes_by_interface.get(key)
+        self._runtimes_by_interface[key] = (
+            duration if previous is None else 0.5 * (previous + duration))
+        if previous is None:
+            # First estimate of this interface: update the priorities
+            self._priorities = None
+
+    def _job_priority(self, jobid):
+        """Estimated length (in seconds) of the critical path of a job
+
+        That is, the longest sequence of dependent jobs starting with
+        ``jobid``, weighted by their runtime estimates. Jobs with unknown
+        runtimes weigh the median of known estimates (or one second).
+        MapNode subnodes share the priority of their parent.
+
+        Priorities are computed for the whole graph at once, and computed
+        again when an interface is timed for the first time in the run.
+        Later measurements of the same interface only refine its estimate
+        for job batching.
+        """
+        if self._priorities is None:
+            known = (list(self._runtimes_by_name.values()) +
+                     list(self._runtimes_by_interface.values()))
+            default = float(np.median(known)) if known else 1.0
+            # Jobs are topologically sorted: visit successors first
+            self._priorities = [0.0] * len(self._successors)
+            for idx in reversed(range(len(self._successors))):
+                if idx in self.mapnodesubids:
+                    continue
+                estimate = self._runtime_estimate(idx)
+                self._priorities[idx] = (
+                    default if estimate is None else estimate) + max(
+                        [self._priorities[child]
+                         for child in self._successors[idx]] or [0.0])
+        return self._priorities[self.mapnodesubids.get(jobid, jobid)]
+
+    def _batchable(self, jobid):
+        """Whether a job is short enough to be fused with other jobs"""
+        if not self._batch_max_runtime or self._batch_size < 2:
+            return False
+        node = self.procs[jobid]
+        if isinstance(node, MapNode) or node.run_without_submitting:
+            return False
+        estimate = self._runtime_estimate(jobid)
+        return estimate is not None and estimate < self._batch_max_runtime
+
+    def _array_key(self, jobid):
+        """Key grouping jobs that can be submitted in the same job array
+
+        ``None`` (the default) if the job cannot be part of an array.
+        """
+        return None
+
+    def _dispatch(self, jobids, updatehash=False, array=False):
+        """Submit jobs, as a single task (batch or job array) when more
+        than one is given"""
+        nodes = [self.procs[jobid] for jobid in jobids]
+        if len(nodes) > 1 and array:
+            logger.info('Submitting %d jobs as a job array', len(nodes))
+            taskids = self._submit_array(nodes, updatehash=updatehash)
+        elif len(nodes) > 1:
+            logger.info('Submitting %d short jobs as a single task',
+                        len(nodes))
+            taskids = self._submit_batch(nodes, updatehash=updatehash)
+        else:
+            # Plugins serialize the node on submission, so there is no
+            # need for a (costly) deep copy
+            taskids = [self._submit_job(nodes[0], updatehash=updatehash)]
+        for jobid, tid in zip(jobids, taskids):
+            if tid is None:
+                self.proc_done[jobid] = False
+                self.proc_pending[jobid] = False
+                self._ready.add(jobid)
+            else:
+                self.pending_tasks.insert(0, (tid, jobid))
+
     def _submit_mapnode(self, jobid):
-        import scipy.sparse as ssp
         if jobid in self.mapnodes:
             return True
         self.mapnodes.append(jobid)
@@ -242,18 +423,20 @@ class DistributedPluginBase(PluginBase):
         numnodes = len(mapnodesubids)
         logger.debug('Adding %d jobs for mapnode %s', numnodes,
                      self.procs[jobid])
-        for i in range(numnodes):
-            self.mapnodesubids[self.depidx.shape[0] + i] = jobid
+        first = len(self.procs)
+        subids = range(first, first + numnodes)
+        for subid in subids:
+            self.mapnodesubids[subid] = jobid
         self.procs.extend(mapnodesubids)
-        self.depidx = ssp.vstack(
-            (self.depidx,
-             ssp.lil_matrix(np.zeros(
-                 (numnodes, self.depidx.shape[1])))), 'lil')
-        self.depidx = ssp.hstack(
-            (self.depidx,
-             ssp.lil_matrix(np.zeros(
-                 (self.depidx.shape[0], numnodes)))), 'lil')
-        self.depidx[-numnodes:, jobid] = 1
+        self._jobids.update(zip(mapnodesubids, subids))
+        # Subnodes have no dependencies, and the mapnode now waits for them
+        self._successors.extend([jobid] for _ in subids)
+        self._predecessors.extend([] for _ in subids)
+        self._indegree.extend(0 for _ in subids)
+        self._consumers.extend(0 for _ in subids)
+        self._indegree[jobid] += numnodes
+        self._ready.discard(jobid)
+        self._ready.update(subids)
         self.proc_done = np.concatenate((self.proc_done,
                                          np.zeros(numnodes, dtype=bool)))
         self.proc_pending = np.concatenate((self.proc_pending,
@@ -276,14 +459,15 @@ class DistributedPluginBase(PluginBase):
                 break
 
             # Check if a job is available (jobs with all dependencies run)
-            # https://github.com/nipy/nipype/pull/2200#discussion_r141605722
-            jobids = np.nonzero(~self.proc_done & (self.depidx.sum(0) == 0))[1]
+            jobids = self._ready_jobs()
 
             if len(jobids) > 0:
                 # send all available jobs
                 logger.info('Pending[%d] Submitting[%d] jobs Slots[%s]',
                             num_jobs, len(jobids[:slots]), slots or 'inf')
 
+                batch = []
+                arrays = {}
                 for jobid in jobids[:slots]:
                     if isinstance(self.procs[jobid], MapNode):
                         try:
@@ -315,17 +499,22 @@ class DistributedPluginBase(PluginBase):
                                 self._clean_queue(jobid, graph)
                             self._task_finished_cb(jobid)
                             self._remove_node_dirs()
+                        elif self._batchable(jobid):
+                            batch.append(jobid)
+                            if len(batch) >= self._batch_size:
+                                self._dispatch(batch, updatehash=updatehash)
+                                batch = []
+                        elif self._array_key(jobid) is not None:
+                            arrays.setdefault(
+                                self._array_key(jobid), []).append(jobid)
                         else:
-                            tid = self._submit_job(
-                                deepcopy(self.procs[jobid]),
-                                updatehash=updatehash)
-                            if tid is None:
-                                self.proc_done[jobid] = False
-                                self.proc_pending[jobid] = False
-                            else:
-                                self.pending_tasks.insert(0, (tid, jobid))
+                            self._dispatch([jobid], updatehash=updatehash)
                     logger.info('Finished submitting: %s ID: %d',
                                 self.procs[jobid], jobid)
+                if batch:
+                    self._dispatch(batch, updatehash=updatehash)
+                for array in arrays.values():
+                    self._dispatch(array, updatehash=updatehash, array=True)
             else:
                 break
 
@@ -382,25 +571,42 @@ class DistributedPluginBase(PluginBase):
             self._status_callback(self.procs[jobid], 'end')
         # Update job and worker queues
         self.proc_pending[jobid] = False
+        index = get_cache_status_index()
+        if index is not None and not cached:
+            index.update(self.procs[jobid].output_dir())
         # update the job dependency structure
-        rowview = self.depidx.getrowview(jobid)
-        rowview[rowview.nonzero()] = 0
+        for child in self._successors[jobid]:
+            self._indegree[child] -= 1
+            if self._indegree[child] == 0:
+                self._ready.add(child)
+                self._notify()
         if jobid not in self.mapnodesubids:
-            self.refidx[self.refidx[:, jobid].nonzero()[0], jobid] = 0
+            # Outputs of this job and its inputs may not be needed anymore
+            if self._consumers[jobid] == 0:
+                self._removable.append(jobid)
+            for parent in self._predecessors[jobid]:
+                self._consumers[parent] -= 1
+                if self._consumers[parent] == 0:
+                    self._removable.append(parent)
 
     def _generate_dependency_list(self, graph):
         """ Generates a dependency list for a list of graphs.
         """
-        import networkx as nx
-
         self.procs, _ = topological_sort(graph)
-        try:
-            self.depidx = nx.to_scipy_sparse_matrix(
-                graph, nodelist=self.procs, format='lil')
-        except:
-            self.depidx = nx.to_scipy_sparse_matrix(graph, nodelist=self.procs)
-        self.refidx = deepcopy(self.depidx)
-        self.refidx.astype = np.int
+        # the {node: jobid} map of the job table
+        self._jobids = jobids = {
+            node: jobid for jobid, node in enumerate(self.procs)}
+        self._successors = [[jobids[child] for child in graph.successors(node)]
+                            for node in self.procs]
+        self._predecessors = [
+            [jobids[parent] for parent in graph.predecessors(node)]
+            for node in self.procs]
+        self._indegree = [len(parents) for parents in self._predecessors]
+        self._ready = set(jobid for jobid, count in enumerate(self._indegree)
+                          if count == 0)
+        self._consumers = [len(children) for children in self._successors]
+        self._removable = []
+        self._priorities = None
         self.proc_done = np.zeros(len(self.procs), dtype=bool)
         self.proc_pending = np.zeros(len(self.procs), dtype=bool)
 
@@ -412,7 +618,7 @@ class DistributedPluginBase(PluginBase):
             dfs_preorder = nx.dfs_preorder_nodes
         subnodes = [s for s in dfs_preorder(graph, self.procs[jobid])]
         for node in subnodes:
-            idx = self.procs.index(node)
+            idx = self._jobids[node]
             self.proc_done[idx] = True
             self.proc_pending[idx] = False
         return dict(
@@ -421,13 +627,10 @@ class DistributedPluginBase(PluginBase):
     def _remove_node_dirs(self):
         """Removes directories whose outputs have already been used up
         """
+        removable, self._removable = self._removable, []
         if str2bool(self._config['execution']['remove_node_directories']):
-            indices = np.nonzero((self.refidx.sum(axis=1) == 0).__array__())[0]
-            for idx in indices:
-                if idx in self.mapnodesubids:
-                    continue
+            for idx in removable:
                 if self.proc_done[idx] and (not self.proc_pending[idx]):
-                    self.refidx[idx, idx] = -1
                     outdir = self.procs[idx].output_dir()
                     logger.info(('[node dependencies finished] '
                                  'removing node: %s from directory %s') %
@@ -437,12 +640,38 @@ class DistributedPluginBase(PluginBase):
 
 class SGELikeBatchManagerBase(DistributedPluginBase):
     """Execute workflow with SGE/OGE/PBS like batch system
+
+    Plugins supporting job arrays set ``_array_index_var`` to the
+    environment variable holding the (1-based) index of array tasks, and
+    accept an ``array_size`` argument in :py:meth:`_submit_batchtask`.
+    With the ``job_arrays`` plugin argument, ready nodes running the same
+    interface with the same ``plugin_args`` (e.g., the subnodes of a
+    MapNode) are then submitted as a single job array.
+
+    Plugins defining ``_status_command`` (a command listing the jobs of
+    ``{user}``) and :py:meth:`_parse_job_states` get their job states from
+    a :py:class:`~nipype.pipeline.plugins.tools.JobStatusCache`, refreshed
+    at most every ``status_refresh`` seconds (plugin argument, default 1),
+    instead of running one status command per pending job. Jobs not listed
+    yet are considered pending during ``status_grace`` seconds after their
+    submission (plugin argument, default 10).
+
+    Results are collected without blocking (see :py:meth:`_get_result`).
+    With the ``result_watcher`` plugin argument, a background thread
+    watches the directories of finished jobs and wakes up the scheduling
+    loop as soon as their result files appear.
     """
 
+    _array_index_var = None
+    _status_command = None
+    _done_states = ()
+
     def __init__(self, template, plugin_args=None):
         super(SGELikeBatchManagerBase, self).__init__(plugin_args=plugin_args)
         self._template = template
         self._qsub_args = None
+        self._job_arrays = bool(self._array_index_var) and \
+            str2bool((plugin_args or {}).get('job_arrays', False))
         if plugin_args:
             if 'template' in plugin_args:
                 self._template = plugin_args['template']
@@ -452,58 +681,117 @@ class SGELikeBatchManagerBase(DistributedPluginBase):
             if 'qsub_args' in plugin_args:
                 self._qsub_args = plugin_args['qsub_args']
         self._pending = {}
+        self._deadlines = {}
+        self._result_watcher = None
+        if str2bool((plugin_args or {}).get('result_watcher', False)):
+            self._result_watcher = ResultWatcher(self._notify)
+        self._job_states = None
+        if self._status_command:
+            self._job_states = JobStatusCache(
+                self._status_command.format(user=getpass.getuser()),
+                self._parse_job_states,
+                refresh_secs=(plugin_args or {}).get('status_refresh', 1.0),
+                done_states=self._done_states,
+                grace_secs=(plugin_args or {}).get('status_grace', 10.0))
 
     def _is_pending(self, taskid):
         """Check if a task is pending in the batch system
         """
+        if self._job_states is None:
+            raise NotImplementedError
+        return self._job_states.is_pending(taskid)
+
+    @staticmethod
+    def _parse_job_states(stdout):
+        """Parse the output of ``_status_command`` into (jobid, state) pairs
+        """
         raise NotImplementedError
 
+    def _track(self, jobid):
+        """Register a submitted job for status checks"""
+        if jobid is not None and self._job_states is not None:
+            self._job_states.add(jobid)
+        return jobid
+
     def _submit_batchtask(self, scriptfile, node):
         """Submit a task to the batch system
         """
         raise NotImplementedError
 
+    def _array_key(self, jobid):
+        if not self._job_arrays:
+            return None
+        node = self.procs[jobid]
+        if isinstance(node, MapNode):
+            return None
+        return (node.interface.__class__.__module__,
+                node.interface.__class__.__name__,
+                json.dumps(node.plugin_args, sort_keys=True, default=str))
+
+    @staticmethod
+    def _job_id(taskid):
+        """Batch system id of the job running a task
+
+        Tasks fused in a batch (see :py:meth:`_submit_batch`) are identified
+        by ``(jobid, index)`` tuples.
+        """
+        return taskid[0] if isinstance(taskid, tuple) else taskid
+
     def _get_result(self, taskid):
+        """Collect the result of a task without blocking
+
+        Once the batch system reports the job as finished, its result file
+        may take a while to show up on shared storage (e.g., NFS attribute
+        caching). Instead of waiting inline, which would hold the results
+        of every other job, the task is given a deadline of
+        ``job_finished_timeout`` seconds and checked again at the next
+        iterations of the scheduling loop (or as soon as the
+        ``result_watcher`` thread spots the file).
+        """
         if taskid not in self._pending:
-            raise Exception('Task %d not found' % taskid)
-        if self._is_pending(taskid):
-            return None
+            raise Exception('Task %s not found' % (taskid, ))
         node_dir = self._pending[taskid]
+        if taskid not in self._deadlines:
+            if self._is_pending(self._job_id(taskid)):
+                return None
+            timeout = float(self._config['execution']['job_finished_timeout'])
+            self._deadlines[taskid] = time() + timeout
+            if self._result_watcher is not None:
+                self._result_watcher.watch(node_dir)
         # MIT HACK
         # on the pbs system at mit the parent node directory needs to be
         # accessed before internal directories become available. there
         # is a disconnect when the queueing engine knows a job is
         # finished to when the directories become statable.
-        t = time()
-        timeout = float(self._config['execution']['job_finished_timeout'])
-        timed_out = True
-        while (time() - t) < timeout:
-            try:
-                glob(os.path.join(node_dir, 'result_*.pklz')).pop()
-                timed_out = False
-                break
-            except Exception as e:
-                logger.debug(e)
-            sleep(2)
-        if timed_out:
-            result_data = {
-                'hostname': 'unknown',
-                'result': None,
-                'traceback': None
-            }
-            results_file = None
-            try:
-                error_message = ('Job id ({0}) finished or terminated, but '
-                                 'results file does not exist after ({1}) '
-                                 'seconds. Batch dir contains crashdump file '
-                                 'if node raised an exception.\n'
-                                 'Node working directory: ({2}) '.format(
-                                     taskid, timeout, node_dir))
-                raise IOError(error_message)
-            except IOError as e:
-                result_data['traceback'] = '\n'.join(format_exception(*sys.exc_info()))
-        else:
-            results_file = glob(os.path.join(node_dir, 'result_*.pklz'))[0]
+        results_files = glob(os.path.join(node_dir, 'result_*.pklz'))
+        if results_files:
+            return self._load_result(results_files[0], node_dir)
+        if time() < self._deadlines[taskid]:
+            logger.debug('Waiting for the results of job %s in %s',
+                         taskid, node_dir)
+            return None
+        result_data = {
+            'hostname': 'unknown',
+            'result': None,
+            'traceback': None
+        }
+        try:
+            error_message = ('Job id ({0}) finished or terminated, but '
+                             'results file does not exist after ({1}) '
+                             'seconds. Batch dir contains crashdump file '
+                             'if node raised an exception.\n'
+                             'Node working directory: ({2}) '.format(
+                                 taskid,
+                                 self._config['execution'][
+                                     'job_finished_timeout'],
+                                 node_dir))
+            raise IOError(error_message)
+        except IOError as e:
+            result_data['traceback'] = '\n'.join(format_exception(*sys.exc_info()))
+        return self._load_result(None, node_dir, result_data)
+
+    def _load_result(self, results_file, node_dir, result_data=None):
+        if results_file:
             result_data = loadpkl(results_file)
         result_out = dict(result=None, traceback=None)
         if isinstance(result_data, dict):
@@ -528,10 +816,64 @@ class SGELikeBatchManagerBase(DistributedPluginBase):
         batchscriptfile = os.path.join(batch_dir, 'batchscript_%s.sh' % name)
         with open(batchscriptfile, 'wt') as fp:
             fp.writelines(batchscript)
-        return self._submit_batchtask(batchscriptfile, node)
+        return self._track(self._submit_batchtask(batchscriptfile, node))
+
+    def _submit_batch(self, nodes, updatehash=False):
+        """submit several nodes as a single job and return their taskids
+        """
+        pyscripts = [create_pyscript(node, updatehash=updatehash)
+                     for node in nodes]
+        batch_dir, name = os.path.split(pyscripts[0])
+        name = 'batch_' + '.'.join(name.split('.')[:-1])
+        batchscript = '\n'.join([self._template] + [
+            '%s %s' % (sys.executable, pyscript) for pyscript in pyscripts])
+        batchscriptfile = os.path.join(batch_dir, 'batchscript_%s.sh' % name)
+        with open(batchscriptfile, 'wt') as fp:
+            fp.writelines(batchscript)
+        jobid = self._track(self._submit_batchtask(batchscriptfile, nodes[0]))
+        return self._register_tasks(jobid, nodes)
+
+    def _submit_array(self, nodes, updatehash=False):
+        """submit nodes as a job array and return their taskids
+        """
+        pyscripts = [create_pyscript(node, updatehash=updatehash)
+                     for node in nodes]
+        batch_dir, name = os.path.split(pyscripts[0])
+        name = 'array_' + '.'.join(name.split('.')[:-1])
+        # Array task i runs the script on the i-th line
+        listfile = os.path.join(batch_dir, 'pyscripts_%s.txt' % name)
+        with open(listfile, 'wt') as fp:
+            fp.writelines('\n'.join(pyscripts) + '\n')
+        batchscript = '\n'.join((self._template, '%s $(sed -n "${%s}p" %s)' % (
+            sys.executable, self._array_index_var, listfile)))
+        batchscriptfile = os.path.join(batch_dir, 'batchscript_%s.sh' % name)
+        with open(batchscriptfile, 'wt') as fp:
+            fp.writelines(batchscript)
+        jobid = self._track(self._submit_batchtask(
+            batchscriptfile, nodes[0], array_size=len(nodes)))
+        return self._register_tasks(jobid, nodes)
+
+    def _register_tasks(self, jobid, nodes):
+        """Track the nodes run by a (batch or array) job as separate tasks
+        """
+        if jobid is None:
+            return [None] * len(nodes)
+        # The job was registered under the first node only
+        self._pending.pop(jobid, None)
+        taskids = [(jobid, idx) for idx in range(len(nodes))]
+        for taskid, node in zip(taskids, nodes):
+            self._pending[taskid] = node.output_dir()
+        return taskids
 
     def _clear_task(self, taskid):
-        del self._pending[taskid]
+        node_dir = self._pending.pop(taskid)
+        if self._deadlines.pop(taskid, None) is not None and \
+                self._result_watcher is not None:
+            self._result_watcher.unwatch(node_dir)
+
+    def _postrun_check(self):
+        if self._result_watcher is not None:
+            self._result_watcher.stop()
 
 
 class GraphPluginBase(PluginBase):
@@ -550,13 +892,14 @@ class GraphPluginBase(PluginBase):
         dependencies = {}
         self._config = config
         nodes = list(nx.topological_sort(graph))
+        jobids = dict((node, idx) for idx, node in enumerate(nodes))
         logger.debug('Creating executable python files for each node')
         for idx, node in enumerate(nodes):
             pyfiles.append(
                 create_pyscript(
                     node, updatehash=updatehash, store_exception=False))
             dependencies[idx] = [
-                nodes.index(prevnode)
+                jobids[prevnode]
                 for prevnode in list(graph.predecessors(node))]
         self._submit_graph(pyfiles, dependencies, nodes)
 
@@ -31,8 +31,15 @@ class CondorPlugin(SGELikeBatchManagerBase):
                  by condor_qsub
     - qsub_args : arguments to be prepended to the job execution script in the
                   qsub call
+    - status_refresh : minimum time (in seconds) between two listings of
+                       the jobs with ``condor_q`` (default: 1)
     """
 
+    _status_command = ('condor_q {user} -format "%d " ClusterId '
+                       '-format "%d\\n" JobStatus')
+    # Removed (3) and completed (4) jobs
+    _done_states = ('3', '4')
+
     def __init__(self, **kwargs):
         template = """
 #$ -V
@@ -47,18 +54,13 @@ class CondorPlugin(SGELikeBatchManagerBase):
                 self._max_tries = kwargs['plugin_args']['max_tries']
         super(CondorPlugin, self).__init__(template, **kwargs)
 
-    def _is_pending(self, taskid):
-        cmd = CommandLine(
-            'condor_q', resource_monitor=False, terminal_output='allatonce')
-        cmd.inputs.args = '%d' % taskid
-        # check condor cluster
-        oldlevel = iflogger.level
-        iflogger.setLevel(logging.getLevelName('CRITICAL'))
-        result = cmd.run(ignore_exception=True)
-        iflogger.setLevel(oldlevel)
-        if result.runtime.stdout.count('\n%d' % taskid):
-            return True
-        return False
+    @staticmethod
+    def _parse_job_states(stdout):
+        """Parse ``condor_q`` formatted as ``<ClusterId> <JobStatus>``"""
+        for line in stdout.splitlines():
+            fields = line.split()
+            if len(fields) == 2 and fields[0].isdigit():
+                yield fields[0], fields[1]
 
     def _submit_batchtask(self, scriptfile, node):
         cmd = CommandLine(
@@ -215,6 +215,8 @@ class LegacyMultiProcPlugin(DistributedPluginBase):
         # Make sure runtime is not left at a dubious working directory
         os.chdir(self._cwd)
         self._taskresult[args['taskid']] = args
+        # Wake up the scheduler to collect the result
+        self._notify()
 
     def _get_result(self, taskid):
         return self._taskresult.get(taskid)
@@ -280,10 +282,8 @@ class LegacyMultiProcPlugin(DistributedPluginBase):
         """
 
         # Check to see if a job is available (jobs with all dependencies run)
-        # See https://github.com/nipy/nipype/pull/2200#discussion_r141605722
         # See also https://github.com/nipy/nipype/issues/2372
-        jobids = np.flatnonzero(~self.proc_done &
-                                (self.depidx.sum(axis=0) == 0).__array__())
+        jobids = self._ready_jobs()
 
         # Check available resources by summing all threads and memory used
         free_memory_gb, free_processors = self._check_resources(
@@ -410,6 +410,7 @@ class LegacyMultiProcPlugin(DistributedPluginBase):
             if tid is None:
                 self.proc_done[jobid] = False
                 self.proc_pending[jobid] = False
+                self._ready.add(jobid)
             else:
                 self.pending_tasks.insert(0, (tid, jobid))
             # Display stats next loop
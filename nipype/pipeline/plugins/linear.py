@@ -36,7 +36,7 @@ class LinearPlugin(PluginBase):
         logger.info("Running serially.")
         old_wd = os.getcwd()
         notrun = []
-        donotrun = []
+        donotrun = set()
         nodes, _ = topological_sort(graph)
         for node in nodes:
             endstatus = 'end'
@@ -57,7 +57,7 @@ class LinearPlugin(PluginBase):
                 subnodes = [s for s in dfs_preorder(graph, node)]
                 notrun.append({'node': node, 'dependents': subnodes,
                                'crashfile': crashfile})
-                donotrun.extend(subnodes)
+                donotrun.update(subnodes)
                 # Delay raising the crash until we cleaned the house
                 if str2bool(config['execution']['stop_on_first_crash']):
                     os.chdir(old_wd)  # Return wherever we were before
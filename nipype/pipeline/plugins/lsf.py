@@ -23,9 +23,14 @@ class LSFPlugin(SGELikeBatchManagerBase):
     - template : template to use for batch job submission
     - bsub_args : arguments to be prepended to the job execution script in the
                   bsub call
+    - status_refresh : minimum time (in seconds) between two listings of
+                       the jobs with ``bjobs`` (default: 1)
 
     """
 
+    _status_command = 'bjobs -w -u {user}'
+    _done_states = ('DONE', 'EXIT')
+
     def __init__(self, **kwargs):
         template = """
 #$ -S /bin/sh
@@ -42,25 +47,15 @@ class LSFPlugin(SGELikeBatchManagerBase):
                 self._bsub_args = kwargs['plugin_args']['bsub_args']
         super(LSFPlugin, self).__init__(template, **kwargs)
 
-    def _is_pending(self, taskid):
-        """LSF lists a status of 'PEND' when a job has been submitted but is
-        waiting to be picked up, and 'RUN' when it is actively being processed.
-        But _is_pending should return True until a job has finished and is
-        ready to be checked for completeness. So return True if status is
-        either 'PEND' or 'RUN'"""
-        cmd = CommandLine(
-            'bjobs', resource_monitor=False, terminal_output='allatonce')
-        cmd.inputs.args = '%d' % taskid
-        # check lsf task
-        oldlevel = iflogger.level
-        iflogger.setLevel(logging.getLevelName('CRITICAL'))
-        result = cmd.run(ignore_exception=True)
-        iflogger.setLevel(oldlevel)
-        # logger.debug(result.runtime.stdout)
-        if 'DONE' in result.runtime.stdout or 'EXIT' in result.runtime.stdout:
-            return False
-        else:
-            return True
+    @staticmethod
+    def _parse_job_states(stdout):
+        """Parse ``bjobs -w``. LSF lists a status of 'PEND' when a job has
+        been submitted but is waiting to be picked up, and 'RUN' when it is
+        actively being processed; finished jobs are 'DONE' or 'EXIT'."""
+        for line in stdout.splitlines():
+            fields = line.split()
+            if len(fields) > 2 and fields[0].isdigit():
+                yield fields[0], fields[2]
 
     def _submit_batchtask(self, scriptfile, node):
         cmd = CommandLine(
@@ -17,11 +17,14 @@ from traceback import format_exception
 import sys
 from logging import INFO
 import gc
+import importlib
+import pickle
+from time import time
 
-from copy import deepcopy
 import numpy as np
 from ... import logging
-from ...utils.profiler import get_system_total_memory_gb
+from ...utils.profiler import (get_system_total_memory_gb,
+                               get_process_rss_gb, GCMonitor)
 from ..engine import MapNode
 from .base import DistributedPluginBase
 
@@ -41,6 +44,32 @@ except ImportError:
 logger = logging.getLogger('nipype.workflow')
 
 
+class NodeTask(object):
+    """Picklable description of a node submitted to the workers
+
+    The node is serialized only once, when the task is created, instead of
+    being deep-copied and then pickled again by the executor. Nodes cannot
+    be rebuilt from their interface class and traits-free inputs alone
+    (e.g., interfaces with dynamically added traits), so the payload is
+    the pickled node itself. A few attributes are kept in clear for
+    bookkeeping without unpickling.
+    """
+    __slots__ = ('fullname', 'output_dir', 'payload')
+
+    def __init__(self, node):
+        self.fullname = node.fullname
+        self.output_dir = node.output_dir()
+        self.payload = pickle.dumps(node, pickle.HIGHEST_PROTOCOL)
+
+    def load(self):
+        """Rebuild the node to be run"""
+        node = pickle.loads(self.payload)
+        # Don't allow streaming outputs
+        if getattr(node.interface, 'terminal_output', '') == 'stream':
+            node.interface.terminal_output = 'allatonce'
+        return node
+
+
 # Run node
 def run_node(node, updatehash, taskid):
     """Function to execute node.run(), catch and log any errors and
@@ -48,7 +77,7 @@ def run_node(node, updatehash, taskid):
 
     Parameters
     ----------
-    node : nipype Node instance
+    node : nipype Node instance or NodeTask
         the node to run
     updatehash : boolean
         flag for updating hash
@@ -63,6 +92,8 @@ def run_node(node, updatehash, taskid):
 
     # Init variables
     result = dict(result=None, traceback=None, taskid=taskid)
+    if isinstance(node, NodeTask):
+        node = node.load()
 
     # Try and execute the node via node.run()
     try:
@@ -71,10 +102,36 @@ def run_node(node, updatehash, taskid):
         result['traceback'] = format_exception(*sys.exc_info())
         result['result'] = node.result
 
+    # Report the memory held by this worker after the task
+    result['worker_rss_gb'] = get_process_rss_gb()
+
     # Return the result dictionary
     return result
 
 
+def run_nodes(nodes, updatehash, taskids):
+    """Run a batch of nodes one after the other in the same worker
+
+    Returns the list of result dictionaries of :py:func:`run_node`,
+    one per node.
+    """
+    return [run_node(node, updatehash, taskid)
+            for node, taskid in zip(nodes, taskids)]
+
+
+def init_worker(cwd, preload=None):
+    """Set up a new worker process: change to the working directory
+    of the master process and import the ``preload`` modules, which then
+    stay loaded for all the tasks the worker runs"""
+    os.chdir(cwd)
+    for module in preload or []:
+        try:
+            importlib.import_module(module)
+        except ImportError as exc:
+            logger.warning('[MultiProc] Could not preload module %s: %s',
+                           module, exc)
+
+
 class MultiProcPlugin(DistributedPluginBase):
     """
     Execute workflow with multiprocessing, not sending more jobs at once
@@ -101,10 +158,38 @@ class MultiProcPlugin(DistributedPluginBase):
     - raise_insufficient: raise error if the requested resources for
         a node over the maximum `n_procs` and/or `memory_gb`
         (default is ``True``).
-    - scheduler: sort jobs topologically (``'tsort'``, default value)
-        or prioritize jobs by, first, memory consumption and, second,
-        number of threads (``'mem_thread'`` option).
+    - scheduler: sort jobs topologically (``'tsort'``, default value),
+        prioritize jobs by, first, memory consumption and, second,
+        number of threads (``'mem_thread'`` option), or start first the
+        jobs at the head of the longest chains of dependent jobs
+        (``'critical_path'`` option). Jobs that do not fit in the free
+        resources are skipped, letting smaller ones use them.
+    - runtime_profile: runtime estimates of nodes, used to weigh chains
+        with the ``'critical_path'`` scheduler. Either a dictionary
+        mapping node or interface names to seconds, or the path to
+        the callback log or the ``resource_monitor.json`` file of a
+        previous run (see
+        :py:func:`~nipype.pipeline.plugins.tools.load_runtime_profile`).
     - mp_context: name of multiprocessing context to use
+    - preload: list of modules (e.g., ``['nibabel', 'scipy.ndimage']``)
+        imported by each worker at startup. Workers are kept alive across
+        tasks, so short Python nodes do not pay those imports every time.
+    - worker_rss_gb: memory ceiling of the workers. When a worker holds
+        more than ``worker_rss_gb`` after a task, no new tasks are
+        submitted until the running ones finish, and then the pool of
+        workers is replaced with fresh ones (default is ``None``, disabled).
+    - batch_max_runtime, batch_size: run jobs expected to take less than
+        ``batch_max_runtime`` seconds in batches of up to ``batch_size``
+        jobs per worker task (see
+        :py:class:`~nipype.pipeline.plugins.base.DistributedPluginBase`).
+        A new batch is only started while there are free resources for it;
+        otherwise, short jobs are appended to the open batches.
+    - gc_interval: run the garbage collector of the master process every
+        ``gc_interval`` submitted or locally run nodes (default is 100,
+        ``0`` or ``None`` disable it).
+    - gc_rss_gb: also run the garbage collector after new submissions when
+        the resident memory of the master process exceeds ``gc_rss_gb``
+        (default is ``None``, disabled).
 
     """
 
@@ -132,24 +217,57 @@ class MultiProcPlugin(DistributedPluginBase):
                      'mem_gb=%0.2f, cwd=%s)',
                      self.processors, self.memory_gb, self._cwd)
 
+        self._preload = self.plugin_args.get('preload', [])
+        self._worker_rss_gb = self.plugin_args.get('worker_rss_gb')
+        self._recycle = False
+        self._pool_recycles = 0
+        self.pool = self._create_pool()
+
+        self._stats = None
+        self._gc_interval = self.plugin_args.get('gc_interval', 100)
+        self._gc_rss_gb = self.plugin_args.get('gc_rss_gb')
+        self._gc_submissions = 0
+        self._gc_forced = 0
+        self._gc_monitor = GCMonitor()
+
+    def _create_pool(self):
         try:
-            mp_context = mp.context.get_context(
+            mp_context = mp.get_context(
                 self.plugin_args.get('mp_context'))
-            self.pool = ProcessPoolExecutor(max_workers=self.processors,
-                                            initializer=os.chdir,
-                                            initargs=(self._cwd,),
-                                            mp_context=mp_context)
+            return ProcessPoolExecutor(max_workers=self.processors,
+                                       initializer=init_worker,
+                                       initargs=(self._cwd, self._preload),
+                                       mp_context=mp_context)
         except (AttributeError, TypeError):
             # Python < 3.7 does not support initialization or contexts
-            self.pool = ProcessPoolExecutor(max_workers=self.processors)
-
-        self._stats = None
+            if self._preload:
+                logger.warning('[MultiProc] Preloading modules requires '
+                               'Python >= 3.7.')
+            return ProcessPoolExecutor(max_workers=self.processors)
+
+    def _recycle_pool(self):
+        """Replace the (idle) pool of workers with a new one"""
+        logger.info('[MultiProc] Recycling workers (memory ceiling of '
+                    '%0.2fGB exceeded).', self._worker_rss_gb)
+        self._recycle = False
+        self._pool_recycles += 1
+        self.pool.shutdown()
+        self.pool = self._create_pool()
 
     def _async_callback(self, args):
         # Make sure runtime is not left at a dubious working directory
         os.chdir(self._cwd)
-        result = args.result()
-        self._taskresult[result['taskid']] = result
+        results = args.result()
+        # Batches of nodes return a list of results
+        if not isinstance(results, list):
+            results = [results]
+        for result in results:
+            self._taskresult[result['taskid']] = result
+            if self._worker_rss_gb and \
+                    (result.get('worker_rss_gb') or 0) > self._worker_rss_gb:
+                self._recycle = True
+        # Wake up the scheduler to collect the result
+        self._notify()
 
     def _get_result(self, taskid):
         return self._taskresult.get(taskid)
@@ -159,12 +277,8 @@ class MultiProcPlugin(DistributedPluginBase):
 
     def _submit_job(self, node, updatehash=False):
         self._taskid += 1
-
-        # Don't allow streaming outputs
-        if getattr(node.interface, 'terminal_output', '') == 'stream':
-            node.interface.terminal_output = 'allatonce'
-
-        result_future = self.pool.submit(run_node, node, updatehash, self._taskid)
+        task = NodeTask(node)
+        result_future = self.pool.submit(run_node, task, updatehash, self._taskid)
         result_future.add_done_callback(self._async_callback)
         self._task_obj[self._taskid] = result_future
 
@@ -172,8 +286,26 @@ class MultiProcPlugin(DistributedPluginBase):
                      node.fullname, self._taskid)
         return self._taskid
 
+    def _submit_batch(self, nodes, updatehash=False):
+        taskids = list(range(self._taskid + 1, self._taskid + len(nodes) + 1))
+        self._taskid = taskids[-1]
+        tasks = [NodeTask(node) for node in nodes]
+        result_future = self.pool.submit(run_nodes, tasks, updatehash, taskids)
+        result_future.add_done_callback(self._async_callback)
+        # All the tasks of the batch share the same future
+        for taskid in taskids:
+            self._task_obj[taskid] = result_future
+
+        logger.debug('[MultiProc] Submitted batch of %d tasks %s (taskids=%d-%d).',
+                     len(nodes), ', '.join(node.fullname for node in nodes),
+                     taskids[0], taskids[-1])
+        return taskids
+
     def _prerun_check(self, graph):
         """Check if any node exeeds the available resources"""
+        if self.pool is None:
+            # The plugin is run again (e.g. streaming execution)
+            self.pool = self._create_pool()
         tasks_mem_gb = []
         tasks_num_th = []
         for node in graph.nodes():
@@ -194,8 +326,34 @@ class MultiProcPlugin(DistributedPluginBase):
             if self.raise_insufficient:
                 raise RuntimeError('Insufficient resources available for job')
 
+        self._gc_monitor.start()
+
     def _postrun_check(self):
         self.pool.shutdown()
+        self.pool = None
+        self._gc_monitor.stop()
+        logger.info('[MultiProc] Garbage collection: %d collections (%d '
+                    'forced) took %0.3fs of the master process.',
+                    self._gc_monitor.collections, self._gc_forced,
+                    self._gc_monitor.elapsed)
+
+    def _collect_garbage(self):
+        """Run the garbage collector when due by the number of submissions
+        or by the memory usage of the master process"""
+        if not self._gc_submissions:
+            return
+        due = bool(self._gc_interval) and \
+            self._gc_submissions >= self._gc_interval
+        if not due and self._gc_rss_gb:
+            rss_gb = get_process_rss_gb()
+            due = rss_gb is not None and rss_gb > self._gc_rss_gb
+        if due:
+            tic = time()
+            gc.collect()
+            logger.debug('[MultiProc] Garbage collected in %0.3fs after %d '
+                         'submissions.', time() - tic, self._gc_submissions)
+            self._gc_submissions = 0
+            self._gc_forced += 1
 
     def _check_resources(self, running_tasks):
         """
@@ -203,22 +361,49 @@ class MultiProcPlugin(DistributedPluginBase):
         """
         free_memory_gb = self.memory_gb
         free_processors = self.processors
-        for _, jobid in running_tasks:
-            free_memory_gb -= min(self.procs[jobid].mem_gb, free_memory_gb)
-            free_processors -= min(self.procs[jobid].n_procs, free_processors)
+        # Jobs batched in the same task (future) run one after the other
+        tasks = {}
+        for taskid, jobid in running_tasks:
+            key = id(self._task_obj.get(taskid, taskid))
+            mem_gb, n_procs = tasks.get(key, (0, 0))
+            tasks[key] = (max(mem_gb, self.procs[jobid].mem_gb),
+                          max(n_procs, self.procs[jobid].n_procs))
+        for mem_gb, n_procs in tasks.values():
+            free_memory_gb -= min(mem_gb, free_memory_gb)
+            free_processors -= min(n_procs, free_processors)
 
         return free_memory_gb, free_processors
 
+    def _find_batch(self, batches, job_gb, job_th, free_memory_gb,
+                    free_processors):
+        """Pick the batch a short job should join (or None if it does not fit)
+
+        A new batch is started while there are resources to run it in
+        parallel with the others; otherwise, the job is appended to the
+        shortest open batch that can accommodate it.
+        """
+        if job_gb <= free_memory_gb and job_th <= free_processors:
+            batch = dict(jobids=[], mem_gb=0, n_procs=0)
+            batches.append(batch)
+            return batch
+        candidates = [
+            batch for batch in batches
+            if len(batch['jobids']) < self._batch_size and
+            job_gb - batch['mem_gb'] <= free_memory_gb and
+            job_th - batch['n_procs'] <= free_processors]
+        if not candidates:
+            return None
+        # Balance the batches
+        return min(candidates, key=lambda batch: len(batch['jobids']))
+
     def _send_procs_to_workers(self, updatehash=False, graph=None):
         """
         Sends jobs to workers when system resources are available.
         """
 
         # Check to see if a job is available (jobs with all dependencies run)
-        # See https://github.com/nipy/nipype/pull/2200#discussion_r141605722
         # See also https://github.com/nipy/nipype/issues/2372
-        jobids = np.flatnonzero(~self.proc_done &
-                                (self.depidx.sum(axis=0) == 0).__array__())
+        jobids = self._ready_jobs()
 
         # Check available resources by summing all threads and memory used
         free_memory_gb, free_processors = self._check_resources(
@@ -259,9 +444,18 @@ class MultiProcPlugin(DistributedPluginBase):
             jobids, scheduler=self.plugin_args.get('scheduler'))
 
         # Run garbage collector before potentially submitting jobs
-        gc.collect()
+        self._collect_garbage()
+
+        if self._recycle:
+            # Let running tasks finish before replacing the workers
+            if self.pending_tasks:
+                logger.debug('[MultiProc] Waiting for running tasks to '
+                             'finish before recycling workers.')
+                return
+            self._recycle_pool()
 
         # Submit jobs
+        batches = []
         for jobid in jobids:
             # First expand mapnodes
             if isinstance(self.procs[jobid], MapNode):
@@ -286,6 +480,14 @@ class MultiProcPlugin(DistributedPluginBase):
             # Check requirements of this job
             next_job_gb = min(self.procs[jobid].mem_gb, self.memory_gb)
             next_job_th = min(self.procs[jobid].n_procs, self.processors)
+            batch = None
+            if not updatehash and self._batchable(jobid):
+                batch = self._find_batch(batches, next_job_gb, next_job_th,
+                                         free_memory_gb, free_processors)
+                if batch is not None:
+                    # Only reserve the resources exceeding those of the batch
+                    next_job_gb = max(0, next_job_gb - batch['mem_gb'])
+                    next_job_th = max(0, next_job_th - batch['n_procs'])
 
             # If node does not fit, skip at this moment
             if next_job_th > free_processors or next_job_gb > free_memory_gb:
@@ -313,7 +515,8 @@ class MultiProcPlugin(DistributedPluginBase):
                 logger.debug('Running node %s on master thread',
                              self.procs[jobid])
                 try:
-                    self.procs[jobid].run(updatehash=updatehash)
+                    result = self.procs[jobid].run(updatehash=updatehash)
+                    self._record_runtime(jobid, result)
                 except Exception:
                     traceback = format_exception(*sys.exc_info())
                     self._clean_queue(
@@ -331,29 +534,41 @@ class MultiProcPlugin(DistributedPluginBase):
                 free_processors += next_job_th
                 # Display stats next loop
                 self._stats = None
-
-                # Clean up any debris from running node in main process
-                gc.collect()
+                self._gc_submissions += 1
                 continue
 
             # Task should be submitted to workers
             # Send job to task manager and add to pending tasks
             if self._status_callback:
                 self._status_callback(self.procs[jobid], 'start')
-            tid = self._submit_job(
-                deepcopy(self.procs[jobid]), updatehash=updatehash)
-            if tid is None:
-                self.proc_done[jobid] = False
-                self.proc_pending[jobid] = False
-            else:
-                self.pending_tasks.insert(0, (tid, jobid))
+            if batch is not None:
+                # Submitted once all the ready jobs have been allocated
+                batch['jobids'].append(jobid)
+                batch['mem_gb'] += next_job_gb
+                batch['n_procs'] += next_job_th
+                continue
+            self._dispatch([jobid], updatehash=updatehash)
+            self._gc_submissions += 1
             # Display stats next loop
             self._stats = None
 
+        for batch in batches:
+            if batch['jobids']:
+                self._dispatch(batch['jobids'], updatehash=updatehash)
+                self._gc_submissions += len(batch['jobids'])
+                self._stats = None
+
     def _sort_jobs(self, jobids, scheduler='tsort'):
         if scheduler == 'mem_thread':
             return sorted(
                 jobids,
                 key=lambda item: (self.procs[item].mem_gb, self.procs[item].n_procs)
             )
+        if scheduler == 'critical_path':
+            return sorted(
+                jobids,
+                key=lambda item: (-self._job_priority(item),
+                                  self.procs[item].n_procs,
+                                  self.procs[item].mem_gb)
+            )
         return jobids
@@ -8,7 +8,6 @@ from builtins import str, open
 import os
 import stat
 from time import sleep
-import subprocess
 import simplejson as json
 
 from ... import logging
@@ -27,12 +26,16 @@ class OARPlugin(SGELikeBatchManagerBase):
     - oarsub_args : arguments to be prepended to the job execution
                     script in the oarsub call
     - max_jobname_len: maximum length of the job name.  Default 15.
+    - status_refresh: minimum time (in seconds) between two listings of
+                      the jobs with ``oarstat`` (default: 1)
 
     """
 
     # Addtional class variables
     _max_jobname_len = 15
     _oarsub_args = ''
+    _status_command = 'oarstat -J -u {user}'
+    _done_states = ('error', 'terminated')
 
     def __init__(self, **kwargs):
         template = """
@@ -53,17 +56,13 @@ class OARPlugin(SGELikeBatchManagerBase):
                     kwargs['plugin_args']['max_jobname_len']
         super(OARPlugin, self).__init__(template, **kwargs)
 
-    def _is_pending(self, taskid):
-        #  subprocess.Popen requires taskid to be a string
-        proc = subprocess.Popen(
-            ['oarstat', '-J', '-s', '-j', taskid],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE)
-        o, e = proc.communicate()
-        parsed_result = json.loads(o)[taskid].lower()
-        is_pending = (('error' not in parsed_result)
-                      and ('terminated' not in parsed_result))
-        return is_pending
+    @staticmethod
+    def _parse_job_states(stdout):
+        """Parse the JSON output of ``oarstat``"""
+        for jobid, info in json.loads(stdout or '{}').items():
+            if isinstance(info, dict):
+                info = info.get('state', '')
+            yield jobid, info.lower()
 
     def _submit_batchtask(self, scriptfile, node):
         cmd = CommandLine(
@@ -25,11 +25,18 @@ class PBSPlugin(SGELikeBatchManagerBase):
     - qsub_args : arguments to be prepended to the job execution script in the
                   qsub call
     - max_jobname_len: maximum length of the job name.  Default 15.
+    - status_refresh: minimum time (in seconds) between two listings of
+                      the jobs with ``qstat`` (default: 1)
+    - job_arrays: submit homogeneous ready nodes (e.g., the subnodes of a
+                  MapNode) as a single array job (Torque's ``qsub -t``)
 
     """
 
     # Addtional class variables
     _max_jobname_len = 15
+    _array_index_var = 'PBS_ARRAYID'
+    _status_command = 'qstat -u {user}'
+    _done_states = ('C', 'F')
 
     def __init__(self, **kwargs):
         template = """
@@ -48,23 +55,16 @@ class PBSPlugin(SGELikeBatchManagerBase):
                     'max_jobname_len']
         super(PBSPlugin, self).__init__(template, **kwargs)
 
-    def _is_pending(self, taskid):
-        result = CommandLine('qstat -f {}'.format(taskid),
-                             environ=dict(os.environ),
-                             terminal_output='file_split',
-                             resource_monitor=False,
-                             ignore_exception=True).run()
-
-        stdout = result.runtime.stdout
-        stderr = result.runtime.stderr
-        errmsg = 'Unknown Job Id'
-        success = 'Job has finished'
-        if (success in stderr) or ('job_state = C' in stdout):
-            return False
-        else:
-            return errmsg not in stderr
+    @staticmethod
+    def _parse_job_states(stdout):
+        """Parse ``qstat -u`` (the state is always the next to last column)
+        """
+        for line in stdout.splitlines():
+            fields = line.split()
+            if len(fields) > 2 and fields[0][:1].isdigit():
+                yield fields[0].split('.')[0], fields[-2]
 
-    def _submit_batchtask(self, scriptfile, node):
+    def _submit_batchtask(self, scriptfile, node, array_size=None):
         cmd = CommandLine(
             'qsub',
             environ=dict(os.environ),
@@ -93,6 +93,8 @@ class PBSPlugin(SGELikeBatchManagerBase):
         jobnameitems.reverse()
         jobname = '.'.join(jobnameitems)
         jobname = jobname[0:self._max_jobname_len]
+        if array_size:
+            qsubargs = '%s -t 1-%d' % (qsubargs, array_size)
         cmd.inputs.args = '%s -N %s %s' % (qsubargs, jobname, scriptfile)
 
         oldlevel = iflogger.level
@@ -359,9 +359,13 @@ class SGEPlugin(SGELikeBatchManagerBase):
     - template : template to use for batch job submission
     - qsub_args : arguments to be prepended to the job execution script in the
                   qsub call
+    - job_arrays : submit homogeneous ready nodes (e.g., the subnodes of a
+                   MapNode) as a single array job (``qsub -t``)
 
     """
 
+    _array_index_var = 'SGE_TASK_ID'
+
     def __init__(self, **kwargs):
         template = """
 #$ -V
@@ -388,7 +392,7 @@ class SGEPlugin(SGELikeBatchManagerBase):
     def _is_pending(self, taskid):
         return self._refQstatSubstitute.is_job_pending(int(taskid))
 
-    def _submit_batchtask(self, scriptfile, node):
+    def _submit_batchtask(self, scriptfile, node, array_size=None):
         cmd = CommandLine(
             'qsub',
             environ=dict(os.environ),
@@ -417,6 +421,8 @@ class SGEPlugin(SGELikeBatchManagerBase):
         jobnameitems.reverse()
         jobname = '.'.join(jobnameitems)
         jobname = qsub_sanitize_job_name(jobname)
+        if array_size:
+            qsubargs = '%s -t 1-%d' % (qsubargs, array_size)
         cmd.inputs.args = '%s -N %s %s' % (qsubargs, jobname, scriptfile)
         oldlevel = iflogger.level
         iflogger.setLevel(logging.getLevelName('CRITICAL'))
@@ -441,7 +447,7 @@ class SGEPlugin(SGELikeBatchManagerBase):
         # retrieve sge taskid
         lines = [line for line in result.runtime.stdout.split('\n') if line]
         taskid = int(
-            re.match("Your job ([0-9]*) .* has been submitted",
+            re.match("Your job(?:-array)? ([0-9]+).* has been submitted",
                      lines[-1]).groups()[0])
         self._pending[taskid] = node.output_dir()
         self._refQstatSubstitute.add_startup_job(taskid, cmd.cmdline)
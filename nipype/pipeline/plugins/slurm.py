@@ -31,9 +31,20 @@ class SLURMPlugin(SGELikeBatchManagerBase):
 
     - sbatch_args: arguments to pass prepend to the sbatch call
 
+    - status_refresh: minimum time (in seconds) between two listings of
+      the jobs with ``squeue`` (default: 1)
+
+    - job_arrays: submit homogeneous ready nodes (e.g., the subnodes of a
+      MapNode) as a single job array (``sbatch --array``)
+
 
     '''
 
+    _array_index_var = 'SLURM_ARRAY_TASK_ID'
+    _status_command = "squeue -h -u {user} -o '%i %t'"
+    # Completing (CG) jobs may still be writing their results
+    _done_states = ('CD', 'CA', 'F', 'TO', 'NF', 'OOM', 'BF', 'DL', 'PR')
+
     def __init__(self, **kwargs):
 
         template = "#!/bin/bash"
@@ -61,28 +72,17 @@ class SLURMPlugin(SGELikeBatchManagerBase):
         self._pending = {}
         super(SLURMPlugin, self).__init__(self._template, **kwargs)
 
-    def _is_pending(self, taskid):
-        try:
-            res = CommandLine(
-                'squeue',
-                args=' '.join(['-j', '%s' % taskid]),
-                resource_monitor=False,
-                terminal_output='allatonce').run()
-            return res.runtime.stdout.find(str(taskid)) > -1
-        except RuntimeError as e:
-            if any(ss in str(e) for ss
-                   in ['Socket timed out', 'not available at the moment']):
-                # do not raise error and allow recheck
-                logger.warning(
-                    "SLURM timeout encountered while checking job status,"
-                    " treating job %d as pending", taskid
-                )
-                return True
-            if 'Invalid job id' not in str(e):
-                raise(e)
-            return False
-
-    def _submit_batchtask(self, scriptfile, node):
+    @staticmethod
+    def _parse_job_states(stdout):
+        """Parse ``squeue -o '%i %t'`` (array tasks are listed as
+        ``<jobid>_<index>``)"""
+        for line in stdout.splitlines():
+            fields = line.split()
+            match = re.match('([0-9]+)', fields[0]) if fields else None
+            if match and len(fields) > 1:
+                yield match.group(1), fields[1]
+
+    def _submit_batchtask(self, scriptfile, node, array_size=None):
         """
         This is more or less the _submit_batchtask from sge.py with flipped
         variable names, different command line switches, and different output
@@ -118,6 +118,8 @@ class SLURMPlugin(SGELikeBatchManagerBase):
         jobnameitems = jobname.split('.')
         jobnameitems.reverse()
         jobname = '.'.join(jobnameitems)
+        if array_size:
+            sbatch_args = '%s --array=1-%d' % (sbatch_args, array_size)
         cmd.inputs.args = '%s -J %s %s' % (sbatch_args, jobname, scriptfile)
         oldlevel = iflogger.level
         iflogger.setLevel(logging.getLevelName('CRITICAL'))
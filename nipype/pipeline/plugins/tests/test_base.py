@@ -39,3 +39,79 @@ wf.base_dir = '/tmp'
 
 wf.run(plugin='MultiProc')
 '''
+
+
+def test_ready_set_tracking():
+    import networkx as nx
+    from nipype.pipeline.plugins.base import DistributedPluginBase
+
+    graph = nx.DiGraph()
+    graph.add_edges_from([('a', 'c'), ('b', 'c'), ('c', 'd')])
+    plugin = DistributedPluginBase()
+    plugin.mapnodesubids = {}
+    plugin._generate_dependency_list(graph)
+    jobids = dict((node, i) for i, node in enumerate(plugin.procs))
+
+    assert sorted(plugin.procs[i] for i in plugin._ready_jobs()) == ['a', 'b']
+    plugin.proc_done[jobids['a']] = True
+    assert list(plugin._ready_jobs()) == [jobids['b']]
+    plugin.proc_done[jobids['b']] = True
+    plugin._task_finished_cb(jobids['a'])
+    assert list(plugin._ready_jobs()) == []
+    plugin._task_finished_cb(jobids['b'])
+    assert list(plugin._ready_jobs()) == [jobids['c']]
+    # a and b have no consumers left once c has run
+    plugin.proc_done[jobids['c']] = True
+    plugin._task_finished_cb(jobids['c'])
+    assert sorted(plugin._removable) == sorted([jobids['a'], jobids['b']])
+    assert list(plugin._ready_jobs()) == [jobids['d']]
+
+
+def test_remove_node_deps():
+    import networkx as nx
+    from nipype.pipeline.plugins.base import DistributedPluginBase
+
+    graph = nx.DiGraph()
+    graph.add_edges_from([('a', 'b'), ('b', 'c'), ('a', 'd'), ('e', 'f')])
+    plugin = DistributedPluginBase()
+    plugin.mapnodesubids = {}
+    plugin._generate_dependency_list(graph)
+    jobid = plugin._jobids['b']
+    plugin.proc_pending[jobid] = True
+
+    info = plugin._remove_node_deps(jobid, 'crash.pklz', graph)
+    assert info['node'] == 'b'
+    assert info['dependents'] == ['b', 'c']
+    assert sorted(plugin.procs[i] for i in np.flatnonzero(
+        plugin.proc_done)) == ['b', 'c']
+    assert not plugin.proc_pending.any()
+
+
+def test_nonblocking_results(tmpdir):
+    from time import sleep
+    from nipype.pipeline.plugins.base import SGELikeBatchManagerBase
+    from nipype.utils.filemanip import savepkl
+
+    class FinishedJobsPlugin(SGELikeBatchManagerBase):
+        def _is_pending(self, taskid):
+            return False
+
+    plugin = FinishedJobsPlugin('', plugin_args={'result_watcher': True})
+    plugin._config = {'execution': {'job_finished_timeout': 0.5}}
+    plugin._pending = {1: tmpdir.mkdir('late').strpath,
+                       2: tmpdir.mkdir('missing').strpath}
+
+    # Jobs are finished, but their results are not there yet
+    assert plugin._get_result(1) is None
+    assert plugin._get_result(2) is None
+
+    savepkl(tmpdir.join('late', 'result_late.pklz').strpath, 'done')
+    # The watcher wakes up the scheduling loop
+    assert plugin._wakeup.wait(5)
+    assert plugin._get_result(1)['result'] == 'done'
+    plugin._clear_task(1)
+
+    sleep(0.5)
+    assert 'results file does not exist' in plugin._get_result(2)['traceback']
+    plugin._clear_task(2)
+    plugin._postrun_check()
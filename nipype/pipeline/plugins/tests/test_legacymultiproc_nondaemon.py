@@ -121,24 +121,28 @@ def run_multiproc_nondaemon_with_flag(nondaemon_flag):
     f1.inputs.insum = 0
 
     pipe.config['execution']['stop_on_first_crash'] = True
+    pipe.config['execution']['crashdump_dir'] = temp_dir
 
     # execute the pipe using the LegacyMultiProc plugin with 2 processes and the
     # non_daemon flag to enable child processes which start other
     # multiprocessing jobs
-    execgraph = pipe.run(
-        plugin="LegacyMultiProc",
-        plugin_args={
-            'n_procs': 2,
-            'non_daemon': nondaemon_flag
-        })
-
-    names = [
-        '.'.join((node._hierarchy, node.name)) for node in execgraph.nodes()
-    ]
-    node = list(execgraph.nodes())[names.index('pipe.f2')]
-    result = node.get_output('sum_out')
-    os.chdir(cur_dir)
-    rmtree(temp_dir)
+    try:
+        execgraph = pipe.run(
+            plugin="LegacyMultiProc",
+            plugin_args={
+                'n_procs': 2,
+                'non_daemon': nondaemon_flag
+            })
+
+        names = [
+            '.'.join((node._hierarchy, node.name))
+            for node in execgraph.nodes()
+        ]
+        node = list(execgraph.nodes())[names.index('pipe.f2')]
+        result = node.get_output('sum_out')
+    finally:
+        os.chdir(cur_dir)
+        rmtree(temp_dir)
     return result
 
 
@@ -135,3 +135,231 @@ def test_hold_job_until_procs_available(tmpdir):
 
     max_threads = 2
     pipe.run(plugin='MultiProc', plugin_args={'n_procs': max_threads})
+
+
+def test_wakeup_on_task_completion(tmpdir):
+    """Finished tasks wake the scheduler up before the polling period ends"""
+    from time import time
+    tmpdir.chdir()
+
+    pipe = pe.Workflow(name='pipe')
+    nodes = [pe.Node(SingleNodeTestInterface(), name='n%d' % i)
+             for i in range(4)]
+    for src, dst in zip(nodes[:-1], nodes[1:]):
+        pipe.connect(src, 'output1', dst, 'input1')
+    nodes[0].inputs.input1 = 1
+    pipe.config['execution']['poll_sleep_duration'] = 30
+
+    tic = time()
+    pipe.run(plugin='MultiProc', plugin_args={'n_procs': 2})
+    # A chain of four nodes would take at least 90s if polling
+    assert time() - tic < 30
+
+
+def test_remove_node_directories(tmpdir):
+    tmpdir.chdir()
+
+    pipe = pe.Workflow(name='pipe', base_dir=tmpdir.strpath)
+    n1 = pe.Node(MultiprocTestInterface(), name='n1')
+    n2 = pe.MapNode(SingleNodeTestInterface(), iterfield=['input1'],
+                    name='n2')
+    n3 = pe.Node(SingleNodeTestInterface(), name='n3')
+    n1.inputs.input1 = 1
+    n3.inputs.input1 = 1
+    pipe.connect(n1, 'output1', n2, 'input1')
+    pipe.config['execution']['remove_node_directories'] = True
+    pipe.config['execution']['remove_unnecessary_outputs'] = False
+    pipe.run(plugin='MultiProc', plugin_args={'n_procs': 2})
+    for name in ('n1', 'n2', 'n3'):
+        assert not tmpdir.join('pipe', name).check()
+
+
+def test_critical_path_scheduler(tmpdir):
+    import networkx as nx
+    from nipype.pipeline.plugins.multiproc import MultiProcPlugin
+    tmpdir.chdir()
+
+    chain = [pe.Node(SingleNodeTestInterface(), name='chain%d' % i)
+             for i in range(3)]
+    single = pe.Node(SingleNodeTestInterface(), name='single')
+    graph = nx.DiGraph()
+    graph.add_node(single)
+    graph.add_edges_from(zip(chain[:-1], chain[1:]))
+
+    def first_job(plugin_args):
+        plugin_args.update({'n_procs': 1, 'scheduler': 'critical_path'})
+        plugin = MultiProcPlugin(plugin_args=plugin_args)
+        plugin.mapnodesubids = {}
+        plugin._generate_dependency_list(graph)
+        jobids = plugin._sort_jobs(plugin._ready_jobs(), 'critical_path')
+        plugin._postrun_check()
+        return plugin.procs[jobids[0]].name
+
+    # Unknown runtimes: the longest chain goes first
+    assert first_job({}) == 'chain0'
+    profile = {'single': 100, 'SingleNodeTestInterface': 1}
+    assert first_job({'runtime_profile': profile}) == 'single'
+
+
+def test_run_critical_path(tmpdir):
+    tmpdir.chdir()
+
+    pipe = pe.Workflow(name='pipe', base_dir=tmpdir.strpath)
+    mod1 = pe.Node(MultiprocTestInterface(), name='mod1')
+    mod2 = pe.MapNode(
+        MultiprocTestInterface(), iterfield=['input1'], name='mod2')
+    mod3 = pe.Node(SingleNodeTestInterface(), name='mod3')
+    pipe.connect([(mod1, mod2, [('output1', 'input1')])])
+    mod1.inputs.input1 = 1
+    mod3.inputs.input1 = 2
+    execgraph = pipe.run(plugin='MultiProc',
+                         plugin_args={'n_procs': 2,
+                                      'scheduler': 'critical_path'})
+    names = [node.fullname for node in execgraph.nodes()]
+    node = list(execgraph.nodes())[names.index('pipe.mod2')]
+    assert node.get_output('output1') == [[1, 1], [1, 1]]
+
+
+def test_node_task(tmpdir):
+    from nipype.interfaces.utility import Function
+    from nipype.pipeline.plugins.multiproc import NodeTask, run_node
+    tmpdir.chdir()
+
+    def double(x):
+        return 2 * x
+
+    node = pe.Node(Function(function=double, input_names=['x'],
+                            output_names=['y']),
+                   name='double', base_dir=tmpdir.strpath)
+    node.inputs.x = 2
+    node.interface.terminal_output = 'stream'
+    task = NodeTask(node)
+    assert task.fullname == node.fullname
+    assert task.output_dir == node.output_dir()
+
+    loaded = task.load()
+    assert loaded.inputs.x == 2
+    assert loaded.interface.terminal_output == 'allatonce'
+    assert node.interface.terminal_output == 'stream'
+
+    result = run_node(task, False, 1)
+    assert result['traceback'] is None
+    assert result['result'].outputs.y == 4
+
+
+@pytest.mark.parametrize('plugin_args, forced', [
+    ({'gc_interval': 1}, 3),
+    ({'gc_interval': 0, 'gc_rss_gb': 1e-6}, 3),
+    ({'gc_interval': 0}, 0),
+])
+def test_garbage_collection_policy(tmpdir, plugin_args, forced):
+    from nipype.pipeline.plugins.multiproc import MultiProcPlugin
+    tmpdir.chdir()
+
+    pipe = pe.Workflow(name='pipe', base_dir=tmpdir.strpath)
+    nodes = [pe.Node(SingleNodeTestInterface(), name='n%d' % i)
+             for i in range(4)]
+    for src, dst in zip(nodes[:-1], nodes[1:]):
+        pipe.connect(src, 'output1', dst, 'input1')
+    nodes[0].inputs.input1 = 1
+
+    plugin_args['n_procs'] = 1
+    plugin = MultiProcPlugin(plugin_args=plugin_args)
+    pipe.run(plugin=plugin)
+    # One collection before submitting each node but the first
+    assert plugin._gc_forced == forced
+
+
+def _imported_colorsys():
+    import sys
+    return 'colorsys' in sys.modules
+
+
+def test_preload_modules(tmpdir):
+    import sys
+    from nipype.interfaces.utility import Function
+    if 'colorsys' in sys.modules:
+        pytest.skip('colorsys module already imported')
+    tmpdir.chdir()
+
+    pipe = pe.Workflow(name='pipe', base_dir=tmpdir.strpath)
+    pipe.add_nodes([pe.Node(Function(function=_imported_colorsys,
+                                     input_names=[], output_names=['out']),
+                            name='check')])
+    execgraph = pipe.run(plugin='MultiProc',
+                         plugin_args={'n_procs': 1, 'preload': ['colorsys']})
+    assert list(execgraph.nodes())[0].get_output('out') is True
+    assert 'colorsys' not in sys.modules
+
+
+def test_recycle_workers(tmpdir):
+    from nipype.pipeline.plugins.multiproc import MultiProcPlugin
+    tmpdir.chdir()
+
+    pipe = pe.Workflow(name='pipe', base_dir=tmpdir.strpath)
+    nodes = [pe.Node(SingleNodeTestInterface(), name='n%d' % i)
+             for i in range(3)]
+    for src, dst in zip(nodes[:-1], nodes[1:]):
+        pipe.connect(src, 'output1', dst, 'input1')
+    nodes[0].inputs.input1 = 1
+
+    plugin = MultiProcPlugin(plugin_args={'n_procs': 1,
+                                          'worker_rss_gb': 1e-6})
+    execgraph = pipe.run(plugin=plugin)
+    assert plugin._pool_recycles == 2
+    names = [node.name for node in execgraph.nodes()]
+    assert list(execgraph.nodes())[names.index('n2')].get_output(
+        'output1') == 1
+
+
+def test_batch_short_jobs(tmpdir):
+    from nipype.pipeline.plugins.multiproc import MultiProcPlugin
+    tmpdir.chdir()
+
+    class BatchingPlugin(MultiProcPlugin):
+        def _submit_batch(self, nodes, updatehash=False):
+            self.batches.append(sorted(node.name for node in nodes))
+            return super(BatchingPlugin, self)._submit_batch(
+                nodes, updatehash=updatehash)
+
+    pipe = pe.Workflow(name='pipe', base_dir=tmpdir.strpath)
+    for i in range(6):
+        node = pe.Node(SingleNodeTestInterface(), name='n%d' % i)
+        node.inputs.input1 = i
+        pipe.add_nodes([node])
+
+    plugin = BatchingPlugin(plugin_args={
+        'n_procs': 2,
+        'runtime_profile': {'SingleNodeTestInterface': 0.01},
+        'batch_max_runtime': 1})
+    plugin.batches = []
+    execgraph = pipe.run(plugin=plugin)
+    # Two batches (one per processor) of three jobs each
+    assert sorted(len(batch) for batch in plugin.batches) == [3, 3]
+    assert sorted(node.get_output('output1')
+                  for node in execgraph.nodes()) == list(range(6))
+
+
+def test_critical_path_new_graph(tmpdir):
+    import networkx as nx
+    from nipype.pipeline.plugins.multiproc import MultiProcPlugin
+    tmpdir.chdir()
+
+    def chain_graph(length, prefix):
+        nodes = [pe.Node(SingleNodeTestInterface(), name='%s%d' % (prefix, i))
+                 for i in range(length)]
+        graph = nx.DiGraph()
+        graph.add_nodes_from(nodes)
+        graph.add_edges_from(zip(nodes[:-1], nodes[1:]))
+        return graph
+
+    plugin = MultiProcPlugin(plugin_args={'n_procs': 1,
+                                          'scheduler': 'critical_path'})
+    plugin.mapnodesubids = {}
+    # One instance scheduling a small graph, then a larger one
+    for length in (2, 5):
+        plugin._generate_dependency_list(chain_graph(length, 'c%d_' % length))
+        priorities = [plugin._job_priority(jobid)
+                      for jobid in range(len(plugin.procs))]
+        assert sorted(priorities) == [float(i + 1) for i in range(length)]
+    plugin._postrun_check()
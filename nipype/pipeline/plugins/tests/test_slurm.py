@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import os
+import stat
+
+import nipype
+import nipype.interfaces.base as nib
+import nipype.pipeline.engine as pe
+
+# Minimal sbatch running the (array) job synchronously
+SBATCH = """#!/bin/bash
+array=""
+for arg in "$@"; do
+    case "$arg" in --array=1-*) array="${arg#--array=1-}";; esac
+    script="$arg"
+done
+echo "$*" >> "$(dirname "$0")/submissions.log"
+jobid=$(wc -l < "$(dirname "$0")/submissions.log")
+if [ -n "$array" ]; then
+    for idx in $(seq 1 "$array"); do
+        SLURM_ARRAY_TASK_ID=$idx bash "$script" > /dev/null 2>&1
+    done
+else
+    bash "$script" > /dev/null 2>&1
+fi
+echo "Submitted batch job $jobid"
+"""
+
+SQUEUE = """#!/bin/bash
+echo "JOBID PARTITION NAME USER ST TIME NODES NODELIST(REASON)"
+"""
+
+
+class InputSpec(nib.TraitedSpec):
+    input1 = nib.traits.Int(desc='a random int')
+
+
+class OutputSpec(nib.TraitedSpec):
+    output1 = nib.traits.Int(desc='a random int')
+
+
+class SlurmTestInterface(nib.BaseInterface):
+    input_spec = InputSpec
+    output_spec = OutputSpec
+
+    def _run_interface(self, runtime):
+        runtime.returncode = 0
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs['output1'] = 2 * self.inputs.input1
+        return outputs
+
+
+def _install_shims(tmpdir, monkeypatch):
+    bindir = tmpdir.mkdir('bin')
+    for name, content in (('sbatch', SBATCH), ('squeue', SQUEUE)):
+        shim = bindir.join(name)
+        shim.write(content)
+        shim.chmod(shim.stat().mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', os.pathsep.join(
+        (bindir.strpath, os.getenv('PATH', ''))))
+    monkeypatch.setenv('PYTHONPATH', os.pathsep.join(
+        (os.path.dirname(os.path.dirname(nipype.__file__)),
+         os.getenv('PYTHONPATH', ''))))
+    monkeypatch.setenv('LOGNAME', 'nipype')
+    return bindir.join('submissions.log')
+
+
+def test_slurm_job_arrays(tmpdir, monkeypatch):
+    submissions = _install_shims(tmpdir, monkeypatch)
+    tmpdir.chdir()
+
+    pipe = pe.Workflow(name='pipe', base_dir=tmpdir.strpath)
+    pipe.config['execution']['poll_sleep_duration'] = 0.1
+    mod1 = pe.MapNode(SlurmTestInterface(), iterfield=['input1'],
+                      name='mod1')
+    mod1.inputs.input1 = [1, 2, 3, 4]
+    mod2 = pe.Node(SlurmTestInterface(), name='mod2')
+    mod2.inputs.input1 = 5
+    pipe.add_nodes([mod1, mod2])
+    # Jobs run synchronously, so they are never listed by squeue
+    execgraph = pipe.run(plugin='SLURM', plugin_args={'job_arrays': True,
+                                                      'status_grace': 0})
+
+    # One array for the subnodes, one job for mod2 and one for the mapnode
+    jobs = submissions.readlines()
+    assert len(jobs) == 3
+    assert sum('--array=1-4' in job for job in jobs) == 1
+    names = [node.name for node in execgraph.nodes()]
+    nodes = list(execgraph.nodes())
+    assert nodes[names.index('mod1')].get_output('output1') == [2, 4, 6, 8]
+    assert nodes[names.index('mod2')].get_output('output1') == 10
@@ -8,6 +8,7 @@ import scipy.sparse as ssp
 import re
 
 import mock
+import pytest
 
 from nipype.pipeline.plugins.tools import report_crash
 
@@ -61,3 +62,113 @@ wf.base_dir = '/tmp'
 
 wf.run(plugin='MultiProc')
 '''
+
+
+def test_load_runtime_profile(tmpdir):
+    import json
+    from nipype.pipeline.plugins.tools import load_runtime_profile
+
+    callback_log = tmpdir.join('callback.log')
+    callback_log.write('\n'.join([
+        json.dumps({'name': 'bet', 'duration': 10.0}),
+        json.dumps({'name': 'bet', 'duration': 20.0}),
+        json.dumps({'name': 'failed', 'duration': None, 'error': True}),
+    ]))
+    assert load_runtime_profile(callback_log.strpath) == ({'bet': 15.0}, {})
+
+    monitor = tmpdir.join('resource_monitor.json')
+    monitor.write(json.dumps({
+        'time': [0.0, 4.0, 1.0, 3.0],
+        'name': ['wf.reg', 'wf.reg', 'wf.smooth', 'wf.smooth'],
+        'interface': ['Registration', 'Registration', 'Smooth', 'Smooth'],
+        'mapnode': [0, 0, 0, 0],
+        'params': ['', '', '', ''],
+    }))
+    by_name, by_interface = load_runtime_profile(monitor.strpath)
+    assert by_name == {'wf.reg': 4.0, 'wf.smooth': 2.0}
+    assert by_interface == {'Registration': 4.0, 'Smooth': 2.0}
+
+    assert load_runtime_profile([{'a': 1}, callback_log.strpath])[0] == {
+        'a': 1.0, 'bet': 15.0}
+
+
+SQUEUE_OUTPUT = """1001 R
+1002 PD
+1003_[3-4] PD
+1003_1 R
+1003_2 CD
+1004 CD
+"""
+
+QSTAT_OUTPUT = """
+server:
+                                                        Req'd  Req'd   Elap
+Job ID          Username Queue Jobname SessID NDS TSK Memory Time  S Time
+--------------- -------- ----- ------- ------ --- --- ------ ----- - -----
+1001.server     user     batch STDIN    12345   1   1     --  1:00 R 00:01
+1002[].server   user     batch STDIN       --   1   1     --  1:00 Q    --
+1004.server     user     batch STDIN    12346   1   1     --  1:00 C 00:02
+"""
+
+BJOBS_OUTPUT = """JOBID   USER    STAT  QUEUE   FROM_HOST  EXEC_HOST  JOB_NAME  SUBMIT_TIME
+1001    user    RUN   normal  host1      host2      job1      Oct 18 10:00
+1002    user    PEND  normal  host1                 job2      Oct 18 10:00
+1004    user    DONE  normal  host1      host2      job4      Oct 18 10:00
+"""
+
+OARSTAT_OUTPUT = """{
+   "1001" : {"state" : "Running", "owner" : "user"},
+   "1002" : {"state" : "Waiting", "owner" : "user"},
+   "1004" : {"state" : "Terminated", "owner" : "user"}
+}
+"""
+
+CONDOR_Q_OUTPUT = """1001 2
+1002 1
+1004 4
+"""
+
+
+@pytest.mark.parametrize('plugin, output, pending', [
+    ('slurm.SLURMPlugin', SQUEUE_OUTPUT, ['1001', '1002', '1003']),
+    ('pbs.PBSPlugin', QSTAT_OUTPUT, ['1001', '1002[]']),
+    ('lsf.LSFPlugin', BJOBS_OUTPUT, ['1001', '1002']),
+    ('oar.OARPlugin', OARSTAT_OUTPUT, ['1001', '1002']),
+    ('condor.CondorPlugin', CONDOR_Q_OUTPUT, ['1001', '1002']),
+])
+def test_job_status_cache(plugin, output, pending):
+    from importlib import import_module
+    from nipype.pipeline.plugins.tools import JobStatusCache
+
+    module, name = plugin.split('.')
+    plugin = getattr(import_module('nipype.pipeline.plugins.' + module), name)
+    cache = JobStatusCache(plugin._status_command, plugin._parse_job_states,
+                           refresh_secs=60, done_states=plugin._done_states)
+    cache._query = lambda: output
+
+    for jobid in pending:
+        assert cache.is_pending(jobid)
+    # Finished jobs, and jobs no longer listed
+    assert not cache.is_pending('1004')
+    assert not cache.is_pending(1005)
+    # A single listing for all the checks
+    assert cache.queries == 1
+
+    # Submitted jobs force a refresh, and are pending until listed
+    cache.add(1006)
+    assert cache.is_pending(1006)
+    assert cache.queries == 2
+    cache.grace_secs = 0
+    assert not cache.is_pending(1006)
+
+
+def test_job_status_cache_failure():
+    from nipype.pipeline.plugins.tools import JobStatusCache
+
+    def query():
+        raise RuntimeError('Socket timed out')
+
+    cache = JobStatusCache('squeue', None)
+    cache._query = query
+    # Jobs cannot be considered finished if their state is unknown
+    assert cache.is_pending(1001)
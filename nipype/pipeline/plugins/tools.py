@@ -9,10 +9,12 @@ from builtins import open
 
 import os
 import getpass
+from glob import glob
+import threading
 from socket import gethostname
 import sys
 import uuid
-from time import strftime
+from time import strftime, time
 from traceback import format_exception
 
 from ... import logging
@@ -158,8 +160,250 @@ except Exception as e:
         report_crash(info['node'], traceback, gethostname())
     raise Exception(e)
 """
-    cmdstr = cmdstr % (mpl_backend, pkl_file, batch_dir, node.config, suffix)
+    # resolve the (possibly layered) node configuration into a dict literal
+    node_config = dict((section, dict(values.items()))
+                       for section, values in node.config.items())
+    cmdstr = cmdstr % (mpl_backend, pkl_file, batch_dir, node_config, suffix)
     pyscript = os.path.join(batch_dir, 'pyscript_%s.py' % suffix)
     with open(pyscript, 'wt') as fp:
         fp.writelines(cmdstr)
     return pyscript
+
+
+def load_runtime_profile(profile):
+    """Read per-node runtime estimates (in seconds) from previous runs
+
+    ``profile`` can be a dictionary mapping node or interface names to
+    runtimes, or the path to a JSON file containing either such a
+    dictionary, the log written by
+    :py:func:`nipype.utils.profiler.log_nodes_cb`, or the
+    ``resource_monitor.json`` summary written by the resource monitor.
+    A list of any of those is also accepted.
+
+    Returns two dictionaries with the average runtime by node name (full
+    and short) and by interface class name, respectively.
+    """
+    import json
+    from collections import defaultdict
+
+    if isinstance(profile, (list, tuple)):
+        by_name, by_interface = {}, {}
+        for item in profile:
+            names, interfaces = load_runtime_profile(item)
+            by_name.update(names)
+            by_interface.update(interfaces)
+        return by_name, by_interface
+
+    if isinstance(profile, dict):
+        runtimes = dict((k, float(v)) for k, v in profile.items())
+        return runtimes, dict(runtimes)
+
+    with open(profile) as fp:
+        content = fp.read()
+    try:
+        data = json.loads(content)
+    except ValueError:
+        # Callback log: one JSON dictionary per line
+        data = []
+        for line in content.splitlines():
+            try:
+                data.append(json.loads(line[line.index('{'):]))
+            except ValueError:
+                continue
+
+    samples = defaultdict(list)
+    if isinstance(data, dict) and 'time' in data and 'name' in data:
+        # resource_monitor.json: one entry per sample
+        spans = {}
+        for stamp, name, interface, subidx, params in zip(
+                data['time'], data['name'], data['interface'],
+                data.get('mapnode', [None] * len(data['time'])),
+                data.get('params', [None] * len(data['time']))):
+            key = (name, interface, subidx, params)
+            start, end = spans.get(key, (stamp, stamp))
+            spans[key] = (min(start, stamp), max(end, stamp))
+        for (name, interface, _, _), (start, end) in spans.items():
+            samples[('name', name)].append(end - start)
+            samples[('interface', interface)].append(end - start)
+    elif isinstance(data, dict):
+        return load_runtime_profile(data)
+    else:
+        for entry in data:
+            if entry.get('error') or entry.get('duration') is None:
+                continue
+            samples[('name', entry['name'])].append(float(entry['duration']))
+
+    by_name, by_interface = {}, {}
+    for (kind, key), values in samples.items():
+        target = by_name if kind == 'name' else by_interface
+        target[key] = sum(values) / len(values)
+    return by_name, by_interface
+
+
+class JobStatusCache(object):
+    """Table of the states of all the jobs of a batch system, refreshed in bulk
+
+    Instead of querying the batch system for each pending task at every
+    poll, a single ``command`` listing all the jobs of the user is run at
+    most every ``refresh_secs`` seconds (or as soon as new jobs have been
+    submitted), and all the status checks read from the resulting table.
+
+    ``parser`` receives the standard output of ``command`` and returns
+    ``(jobid, state)`` pairs. Jobs not listed, or listed with one of the
+    ``done_states``, are finished. A job with several entries (e.g., the
+    tasks of a job array) is pending as long as any of them is. Jobs not
+    listed yet are considered pending during ``grace_secs`` after their
+    submission (see :py:meth:`add`), in case the batch system is slow to
+    report them.
+    """
+
+    def __init__(self, command, parser, refresh_secs=1.0, done_states=(),
+                 grace_secs=10.0):
+        self.command = command
+        self.parser = parser
+        self.refresh_secs = float(refresh_secs)
+        self.done_states = set(done_states)
+        self.grace_secs = float(grace_secs)
+        self.queries = 0
+        self._table = None
+        self._refreshed = None
+        self._stale = True
+        self._submitted = {}
+
+    def _query(self):
+        """Run the listing command and return its standard output"""
+        from ...interfaces.base import CommandLine
+        iflogger = logging.getLogger('nipype.interface')
+        cmd = CommandLine(
+            self.command,
+            environ=dict(os.environ),
+            resource_monitor=False,
+            terminal_output='allatonce')
+        oldlevel = iflogger.level
+        iflogger.setLevel(logging.getLevelName('CRITICAL'))
+        try:
+            result = cmd.run()
+        finally:
+            iflogger.setLevel(oldlevel)
+        return result.runtime.stdout
+
+    def refresh(self):
+        """Query the batch system and rebuild the table of job states"""
+        self.queries += 1
+        self._refreshed = time()
+        self._stale = False
+        try:
+            stdout = self._query()
+            table = {}
+            for jobid, state in self.parser(stdout):
+                jobid = str(jobid)
+                if table.get(jobid) in (None, ) + tuple(self.done_states):
+                    table[jobid] = state
+        except Exception as e:
+            logger.warning('Could not list the jobs of the batch system, '
+                           'treating them as pending: %s', e)
+            self._table = None
+        else:
+            self._table = table
+
+    def add(self, jobid):
+        """Register a newly submitted job"""
+        self._submitted[str(jobid)] = time()
+        self._stale = True
+
+    def is_pending(self, jobid):
+        """Whether the job is still queued or running"""
+        jobid = str(jobid)
+        if self._stale or self._refreshed is None or \
+                time() - self._refreshed >= self.refresh_secs:
+            self.refresh()
+        if self._table is None:
+            return True
+        if jobid in self._table:
+            self._submitted.pop(jobid, None)
+            return self._table[jobid] not in self.done_states
+        submitted = self._submitted.get(jobid)
+        if submitted is not None and time() - submitted < self.grace_secs:
+            return True
+        self._submitted.pop(jobid, None)
+        return False
+
+
+class ResultWatcher(object):
+    """Background thread calling ``callback`` when result files appear
+
+    Directories registered with :py:meth:`watch` are scanned for
+    ``result_*.pklz`` files every ``interval`` seconds. When the optional
+    ``inotify_simple`` package is installed, files written from this host
+    are also noticed right away (inotify does not report changes made by
+    other hosts of network file systems, hence the scans).
+    """
+
+    def __init__(self, callback, interval=0.5):
+        self.callback = callback
+        self.interval = interval
+        self._dirs = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watch(self, node_dir):
+        """Start watching a node directory (and the watching thread)"""
+        with self._lock:
+            self._dirs.add(node_dir)
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='nipype-result-watcher')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def unwatch(self, node_dir):
+        with self._lock:
+            self._dirs.discard(node_dir)
+
+    def stop(self):
+        """Stop the watching thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _scan(self, dirs):
+        for node_dir in dirs:
+            if glob(os.path.join(node_dir, 'result_*.pklz')):
+                with self._lock:
+                    self._dirs.discard(node_dir)
+                self.callback()
+
+    def _run(self):
+        try:
+            from inotify_simple import INotify, flags
+        except ImportError:
+            inotify = None
+        else:
+            inotify = INotify()
+            mask = flags.CLOSE_WRITE | flags.MOVED_TO
+        watches = {}
+        while not self._stop.is_set():
+            with self._lock:
+                dirs = set(self._dirs)
+            if inotify is None:
+                self._stop.wait(self.interval)
+            else:
+                for node_dir in dirs - set(watches):
+                    try:
+                        watches[node_dir] = inotify.add_watch(node_dir, mask)
+                    except OSError:
+                        pass
+                for node_dir in set(watches) - dirs:
+                    try:
+                        inotify.rm_watch(watches.pop(node_dir))
+                    except OSError:
+                        pass
+                events = inotify.read(timeout=int(self.interval * 1000))
+                if any(event.name.startswith('result_') for event in events):
+                    self.callback()
+            self._scan(dirs)
+        if inotify is not None:
+            inotify.close()
@@ -50,9 +50,15 @@ log_rotate = 4
 create_report = true
 crashdump_dir = {crashdump_dir}
 hash_method = timestamp
+hash_algorithm = md5
+hash_threads = 1
+persistent_hashes = false
+hash_cache_dir =
+shared_cache_dir =
 job_finished_timeout = 5
 keep_inputs = false
 local_hash_check = true
+cache_status_index = false
 matplotlib_backend = Agg
 plugin = Linear
 remove_node_directories = false
@@ -60,6 +66,11 @@ remove_unnecessary_outputs = true
 try_hard_link_datasink = true
 single_thread_matlab = true
 crashfile_format = pklz
+result_compression = gzip
+outputs_cache_size = 256
+lazy_mapnode_results = false
+stream_chunk_size = 0
+graph_cache = false
 stop_on_first_crash = false
 stop_on_first_rerun = false
 use_relative_paths = false
@@ -19,6 +19,7 @@ import os.path as op
 import re
 import shutil
 import contextlib
+import threading
 import posixpath
 import simplejson as json
 import numpy as np
@@ -26,6 +27,7 @@ import numpy as np
 from builtins import str, bytes, open
 
 from .. import logging, config
+from ..external import portalocker
 from .misc import is_container
 from future import standard_library
 standard_library.install_aliases()
@@ -40,6 +42,14 @@ related_filetype_sets = [
 
 PY3 = sys.version_info[0] >= 3
 
+# Memo of file hashes (see hash_infile)
+_FILE_HASHES = {}
+_FILE_HASHES_MAX = 100000
+# Persistent hash indexes (see hash_index)
+_HASH_INDEX = None
+_HASH_INDEXES = {}
+_READ_BUFFERS = threading.local()
+
 class FileNotFoundError(Exception):
     pass
 
@@ -224,11 +234,42 @@ def check_forhash(filename):
         return False, None
 
 
-def hash_infile(afile, chunk_len=8192, crypto=hashlib.md5,
-                raise_notfound=False):
+def get_hash_function(algorithm):
+    """Return the constructor of hash objects for ``algorithm``
+
+    Any algorithm of :mod:`hashlib` (e.g., ``'md5'``, ``'sha256'`` or,
+    with Python >= 3.6, the faster ``'blake2b'``) is supported, as well as
+    ``'xxhash'`` (64 bits) if the optional ``xxhash`` package is installed.
+
+    >>> get_hash_function('md5')().hexdigest()
+    'd41d8cd98f00b204e9800998ecf8427e'
+    """
+    if algorithm in ('xxhash', 'xxh64'):
+        try:
+            import xxhash
+        except ImportError:
+            raise ImportError('The xxhash hash algorithm requires the '
+                              'xxhash package.')
+        return xxhash.xxh64
+    try:
+        return getattr(hashlib, algorithm)
+    except (AttributeError, TypeError):
+        raise ValueError('Unknown hash algorithm: %s' % algorithm)
+
+
+def hash_infile(afile, chunk_len=1048576, crypto=hashlib.md5,
+                raise_notfound=False, sample_len=None):
     """
     Computes hash of a file using 'crypto' module
 
+    ``crypto`` is a hash object constructor (e.g., ``hashlib.sha256``) or
+    the name of an algorithm (see :func:`get_hash_function`). Files are
+    read in chunks of ``chunk_len`` bytes into a reusable buffer.
+
+    With ``sample_len``, only the size of the file and its first and last
+    ``sample_len`` bytes are hashed (sampled hashing): much faster for very
+    large files, but blind to changes in the middle of the file.
+
     >>> hash_infile('smri_ants_registration_settings.json')
     'f225785dfb0db9032aa5a0e4f2c730ad'
 
@@ -241,6 +282,8 @@ def hash_infile(afile, chunk_len=8192, crypto=hashlib.md5,
     >>> hash_infile('fsl_motion_outliers_fd.txt')
     'defd1812c22405b1ee4431aac5bbdd73'
 
+    >>> hash_infile('fsl_motion_outliers_fd.txt', crypto='sha1')
+    'a2a077ba28a2dd6da55a4df39c74e50bed04edec'
 
     """
     if not op.isfile(afile):
@@ -248,14 +291,242 @@ def hash_infile(afile, chunk_len=8192, crypto=hashlib.md5,
             raise RuntimeError('File "%s" not found.' % afile)
         return None
 
-    crypto_obj = crypto()
-    with open(afile, 'rb') as fp:
-        while True:
-            data = fp.read(chunk_len)
-            if not data:
-                break
-            crypto_obj.update(data)
-    return crypto_obj.hexdigest()
+    crypto, crypto_name, stat, sample_len = _hash_params(
+        afile, crypto, sample_len)
+
+    # Files consumed by several nodes are only read once
+    key = _file_hash_key(afile, stat, crypto_name)
+    if key in _FILE_HASHES:
+        return _FILE_HASHES[key]
+
+    digest = None
+    if _HASH_INDEX is not None:
+        digest = _HASH_INDEX.get(stat, crypto_name)
+    if digest is None:
+        crypto_obj = crypto()
+        with open(afile, 'rb') as fp:
+            if sample_len:
+                crypto_obj.update(str(stat.st_size).encode())
+                crypto_obj.update(fp.read(sample_len))
+                fp.seek(-sample_len, os.SEEK_END)
+                crypto_obj.update(fp.read(sample_len))
+            else:
+                buf = _read_buffer(chunk_len)
+                view = memoryview(buf)
+                while True:
+                    nbytes = fp.readinto(buf)
+                    if not nbytes:
+                        break
+                    crypto_obj.update(view[:nbytes])
+        digest = crypto_obj.hexdigest()
+        if _HASH_INDEX is not None:
+            _HASH_INDEX.add(stat, crypto_name, digest)
+    if len(_FILE_HASHES) >= _FILE_HASHES_MAX:
+        _FILE_HASHES.clear()
+    _FILE_HASHES[key] = digest
+    return digest
+
+
+def _hash_params(afile, crypto, sample_len):
+    """Return the hash constructor and its name, the stat info and the
+    sample length (None if the whole file is hashed) of a file"""
+    if not callable(crypto):
+        crypto = get_hash_function(crypto)
+    crypto_name = getattr(crypto(), 'name', None) or crypto.__name__
+    stat = os.stat(afile)
+    if sample_len and stat.st_size > 2 * sample_len:
+        crypto_name = '%s:sampled%d' % (crypto_name, sample_len)
+    else:
+        sample_len = None
+    return crypto, crypto_name, stat, sample_len
+
+
+def file_hash_known(afile, crypto=hashlib.md5, sample_len=None):
+    """Whether :func:`hash_infile` can return the hash of a file without
+    reading it (memoized, or found in the persistent index)"""
+    if not op.isfile(afile):
+        return True
+    _, crypto_name, stat, _ = _hash_params(afile, crypto, sample_len)
+    if _file_hash_key(afile, stat, crypto_name) in _FILE_HASHES:
+        return True
+    return (_HASH_INDEX is not None and
+            _HASH_INDEX.get(stat, crypto_name) is not None)
+
+
+def _read_buffer(size):
+    """Return a buffer of ``size`` bytes, reused by the calls of a thread"""
+    buf = getattr(_READ_BUFFERS, 'buf', None)
+    if buf is None or len(buf) != size:
+        buf = _READ_BUFFERS.buf = bytearray(size)
+    return buf
+
+
+def _file_hash_key(afile, stat, crypto_name):
+    """Identify a file, and the version of its contents, by its stat info"""
+    mtime = getattr(stat, 'st_mtime_ns', stat.st_mtime)
+    return (op.abspath(afile), stat.st_ino, stat.st_size, mtime, crypto_name)
+
+
+def clear_file_hashes():
+    """Forget the file hashes memoized by :func:`hash_infile`
+
+    Hashes are kept, for the current process, as long as the path, inode,
+    size and modification time (in ns) of the file do not change.
+    ``Workflow.run`` clears them before execution.
+    """
+    _FILE_HASHES.clear()
+
+
+class FileHashIndex(object):
+    """Persistent index of file content hashes
+
+    Maps the device, inode, size and modification time (in ns) of files
+    to their digest, so that files unchanged since a previous run are not
+    read again (see :func:`hash_index`). The index is an append-only file
+    of JSON lines, ``file_hashes.jsonl`` in ``directory``, which can be
+    shared by concurrent processes (e.g., MultiProc workers or batch jobs
+    on shared storage): appends are serialized with a lock, and entries
+    added by other processes are read when a file is not found. When most
+    of the lines read are superseded (files hashed again after a change),
+    the file is replaced with one line per entry.
+    """
+
+    filename = 'file_hashes.jsonl'
+    # Lines read before the index may be compacted
+    compact_min_lines = 1000
+
+    def __init__(self, directory):
+        self.path = op.join(directory, self.filename)
+        self._entries = {}
+        self._ino = None
+        self._offset = 0
+        self._lines = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(stat, crypto_name):
+        mtime = getattr(stat, 'st_mtime_ns', stat.st_mtime)
+        return '%d:%d:%d:%s:%s' % (stat.st_dev, stat.st_ino, stat.st_size,
+                                   mtime, crypto_name)
+
+    def _load(self):
+        """Read the entries appended since the last read"""
+        if not op.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as fp:
+                portalocker.lock(fp, portalocker.LOCK_SH)
+                try:
+                    self._read(fp)
+                finally:
+                    portalocker.unlock(fp)
+        except (IOError, OSError, portalocker.LockException) as e:
+            fmlogger.warning('Could not read the hash index %s: %s',
+                             self.path, e)
+            return
+        if self._lines > max(2 * len(self._entries), self.compact_min_lines):
+            self._compact()
+
+    def _read(self, fp):
+        """Read the entries of a (locked) index file from the last offset"""
+        ino = os.fstat(fp.fileno()).st_ino
+        if ino != self._ino:
+            # New, or compacted by another process
+            self._ino = ino
+            self._offset = self._lines = 0
+        fp.seek(self._offset)
+        data = fp.read()
+        # Only consume complete lines
+        end = data.rfind(b'\n') + 1
+        self._offset += end
+        for line in data[:end].splitlines():
+            try:
+                key, digest = json.loads(line.decode())
+            except ValueError:
+                continue
+            self._lines += 1
+            self._entries[key] = digest
+
+    def _compact(self):
+        """Replace the index file with one line per entry"""
+        tmpfile = '%s.%d.tmp' % (self.path, os.getpid())
+        try:
+            with open(self.path, 'ab') as fp:
+                portalocker.lock(fp, portalocker.LOCK_EX)
+                try:
+                    if os.stat(self.path).st_ino != \
+                            os.fstat(fp.fileno()).st_ino:
+                        return  # Compacted by another process
+                    with open(self.path, 'rb') as infp:
+                        self._read(infp)
+                    with open(tmpfile, 'wb') as out:
+                        for key, digest in sorted(self._entries.items()):
+                            out.write(
+                                (json.dumps([key, digest]) + '\n').encode())
+                        size = out.tell()
+                    os.rename(tmpfile, self.path)
+                    self._ino = os.stat(self.path).st_ino
+                    self._offset = size
+                    self._lines = len(self._entries)
+                finally:
+                    portalocker.unlock(fp)
+        except (IOError, OSError, portalocker.LockException) as e:
+            fmlogger.warning('Could not compact the hash index %s: %s',
+                             self.path, e)
+            if op.exists(tmpfile):
+                os.remove(tmpfile)
+
+    def get(self, stat, crypto_name):
+        """Return the digest of a file, or None if not indexed"""
+        key = self._key(stat, crypto_name)
+        if key not in self._entries:
+            with self._lock:
+                self._load()
+        return self._entries.get(key)
+
+    def add(self, stat, crypto_name, digest):
+        """Record the digest of a file"""
+        key = self._key(stat, crypto_name)
+        self._entries[key] = digest
+        line = (json.dumps([key, digest]) + '\n').encode()
+        try:
+            makedirs(op.dirname(self.path), exist_ok=True)
+            while True:
+                with open(self.path, 'ab') as fp:
+                    portalocker.lock(fp, portalocker.LOCK_EX)
+                    try:
+                        # Compacted while waiting for the lock: reopen
+                        if os.stat(self.path).st_ino != \
+                                os.fstat(fp.fileno()).st_ino:
+                            continue
+                        fp.write(line)
+                        fp.flush()
+                        break
+                    finally:
+                        portalocker.unlock(fp)
+        except (IOError, OSError, portalocker.LockException) as e:
+            fmlogger.warning('Could not update the hash index %s: %s',
+                             self.path, e)
+
+
+@contextlib.contextmanager
+def hash_index(directory):
+    """Use the persistent :class:`FileHashIndex` in ``directory`` to look up
+    and store the hashes computed by :func:`hash_infile` (no index if
+    ``directory`` is empty)"""
+    global _HASH_INDEX
+    previous = _HASH_INDEX
+    if directory:
+        directory = op.abspath(directory)
+        if directory not in _HASH_INDEXES:
+            _HASH_INDEXES[directory] = FileHashIndex(directory)
+        _HASH_INDEX = _HASH_INDEXES[directory]
+    else:
+        _HASH_INDEX = None
+    try:
+        yield _HASH_INDEX
+    finally:
+        _HASH_INDEX = previous
 
 
 def hash_timestamp(afile):
@@ -634,14 +905,39 @@ def loadcrash(infile, *args):
         raise ValueError('Only pickled crashfiles are supported')
 
 
+# Leading bytes of the compressed formats supported by savepkl
+_GZIP_MAGIC = b'\x1f\x8b'
+_LZ4_MAGIC = b'\x04\x22\x4d\x18'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def _open_pkl(infile):
+    """Open a pickle file for reading, sniffing its compression format"""
+    with open(infile, 'rb') as fp:
+        magic = fp.read(4)
+        if magic.startswith(_GZIP_MAGIC):
+            return gzip.open(infile, 'rb')
+        if magic == _LZ4_MAGIC:
+            import lz4.frame
+            return lz4.frame.open(infile, 'rb')
+        if magic == _ZSTD_MAGIC:
+            import io
+            import zstandard
+            fp.seek(0)
+            return io.BytesIO(
+                zstandard.ZstdDecompressor().decompressobj().decompress(
+                    fp.read()))
+    return open(infile, 'rb')
+
+
 def loadpkl(infile, versioning=False):
-    """Load a zipped or plain cPickled file
+    """Load a cPickled file, plain or compressed with gzip, lz4 or zstd
+
+    The format is identified by the contents of the file, whatever its
+    extension.
     """
     fmlogger.debug('Loading pkl: %s', infile)
-    if infile.endswith('pklz'):
-        pkl_file = gzip.open(infile, 'rb')
-    else:
-        pkl_file = open(infile, 'rb')
+    pkl_file = _open_pkl(infile)
 
     if versioning:
         pkl_metadata = {}
@@ -715,21 +1011,61 @@ def read_stream(stream, logger=None, encoding=None):
     return out.splitlines()
 
 
-def savepkl(filename, record, versioning=False):
-    if filename.endswith('pklz'):
+def savepkl(filename, record, versioning=False, compression=None):
+    """Save a cPickled file
+
+    Parameters
+    ----------
+    filename : str
+        path of the file. Unless ``compression`` is given, files with a
+        ``pklz`` extension are compressed with gzip.
+    record : object
+        object to pickle
+    versioning : bool
+        write a first line with the version of nipype
+    compression : str
+        ``'gzip'``, ``'lz4'``, ``'zstd'`` (faster, but require the lz4 and
+        zstandard packages, respectively) or ``'none'``.
+        :func:`loadpkl` reads all formats.
+    """
+    if compression is None:
+        compression = 'gzip' if filename.endswith('pklz') else 'none'
+    compression = compression.lower()
+    if compression in ('lz4', 'zstd'):
+        try:
+            if compression == 'lz4':
+                import lz4.frame as compressor
+            else:
+                import zstandard as compressor
+        except ImportError:
+            fmlogger.warning('Python package for %s compression not found, '
+                             'using gzip instead.', compression)
+            compression = 'gzip'
+    elif compression not in ('gzip', 'none'):
+        raise ValueError('Unknown compression: %s' % compression)
+
+    raw_file = None
+    if compression == 'gzip':
         pkl_file = gzip.open(filename, 'wb')
+    elif compression == 'lz4':
+        pkl_file = compressor.open(filename, 'wb')
+    elif compression == 'zstd':
+        raw_file = open(filename, 'wb')
+        pkl_file = compressor.ZstdCompressor().stream_writer(raw_file)
     else:
         pkl_file = open(filename, 'wb')
 
-    if versioning:
-        from nipype import __version__ as version
-        metadata = json.dumps({'version': version})
+    with pkl_file:
+        if versioning:
+            from nipype import __version__ as version
+            metadata = json.dumps({'version': version})
 
-        pkl_file.write(metadata.encode('utf-8'))
-        pkl_file.write('\n'.encode('utf-8'))
+            pkl_file.write(metadata.encode('utf-8'))
+            pkl_file.write('\n'.encode('utf-8'))
 
-    pickle.dump(record, pkl_file)
-    pkl_file.close()
+        pickle.dump(record, pkl_file)
+    if raw_file is not None:
+        raw_file.close()
 
 
 rst_levels = ['=', '-', '~', '+']
@@ -7,6 +7,7 @@ Utilities to keep track of performance
 from __future__ import (print_function, division, unicode_literals,
                         absolute_import)
 
+import gc
 import os
 import threading
 from time import time
@@ -112,6 +113,39 @@ class ResourceMonitor(threading.Thread):
             self._event.wait(max(0, wait_til - time()))
 
 
+class GCMonitor(object):
+    """
+    Accumulate the time the garbage collector pauses the current process
+    while the monitor is started (requires Python >= 3.3, where
+    ``gc.callbacks`` is available; otherwise nothing is measured)
+    """
+
+    def __init__(self):
+        self.collections = 0
+        self.elapsed = 0.0
+        self._tic = None
+
+    def _callback(self, phase, info):
+        if phase == 'start':
+            self._tic = time()
+        elif self._tic is not None:
+            self.collections += 1
+            self.elapsed += time() - self._tic
+            self._tic = None
+
+    def start(self):
+        """Start timing collections"""
+        callbacks = getattr(gc, 'callbacks', None)
+        if callbacks is not None and self._callback not in callbacks:
+            callbacks.append(self._callback)
+
+    def stop(self):
+        """Stop timing collections"""
+        callbacks = getattr(gc, 'callbacks', None)
+        if callbacks is not None and self._callback in callbacks:
+            callbacks.remove(self._callback)
+
+
 # Log node stats function
 def log_nodes_cb(node, status):
     """Function to record node run statistics to a log file as json
@@ -189,6 +223,27 @@ def get_system_total_memory_gb():
     return memory_gb
 
 
+# Get resident memory of a process
+def get_process_rss_gb(pid=None):
+    """
+    Function to get the resident set size (in GB) of a process (the
+    current process by default). Returns ``None`` if it cannot be measured.
+    """
+    if pid is None:
+        pid = os.getpid()
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss / (1024.0**3)
+        except psutil.Error:
+            return None
+    try:
+        with open('/proc/%d/statm' % pid) as f_in:
+            pages = int(f_in.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024.0**3)
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
 # Get max resources used for process
 def get_max_resources_used(pid, mem_mb, num_threads, pyfunc=False):
     """
@@ -16,7 +16,8 @@ from ...utils.filemanip import (
     check_forhash, _parse_mount_table, _cifs_table, on_cifs, copyfile,
     copyfiles, ensure_list, simplify_list, check_depends,
     split_filename, get_related_files, indirectory,
-    loadpkl, loadcrash, savepkl)
+    loadpkl, loadcrash, savepkl, hash_infile, clear_file_hashes,
+    hash_index, FileHashIndex, get_hash_function)
 
 
 def _ignore_atime(stat):
@@ -63,6 +64,105 @@ def test_hash_rename(filename, newname):
     assert new_name == newname
 
 
+def test_hash_infile_memo(tmpdir):
+    afile = tmpdir.join('data.txt')
+    afile.write('some data')
+    clear_file_hashes()
+    digest = hash_infile(afile.strpath)
+    with mock.patch('nipype.utils.filemanip.open') as mock_open:
+        assert hash_infile(afile.strpath) == digest
+    # The file is not read again
+    assert not mock_open.called
+
+    # Changes to the file are noticed
+    afile.write('some other data')
+    assert hash_infile(afile.strpath) != digest
+    clear_file_hashes()
+
+
+def test_hash_index(tmpdir):
+    afile = tmpdir.join('data.txt')
+    afile.write('some data')
+    indexdir = tmpdir.join('index').strpath
+    clear_file_hashes()
+    with hash_index(indexdir):
+        digest = hash_infile(afile.strpath)
+    assert tmpdir.join('index', FileHashIndex.filename).check()
+
+    # A new run (or another process) does not read the file again
+    clear_file_hashes()
+    with hash_index(indexdir) as index:
+        index._entries.clear()
+        index._offset = 0
+        with mock.patch('nipype.utils.filemanip.open',
+                        wraps=open) as mock_open:
+            assert hash_infile(afile.strpath) == digest
+        assert [call[0][0] for call in mock_open.call_args_list] == [
+            index.path]
+
+    # Entries appended concurrently are picked up
+    stat = os.stat(afile.strpath)
+    FileHashIndex(indexdir).add(stat, 'sha1', 'abc')
+    assert index.get(stat, 'sha1') == 'abc'
+    clear_file_hashes()
+
+
+def test_hash_index_compaction(tmpdir, monkeypatch):
+    monkeypatch.setattr(FileHashIndex, 'compact_min_lines', 10)
+    afile = tmpdir.join('data.txt')
+    afile.write('some data')
+    stat = os.stat(afile.strpath)
+    indexdir = tmpdir.join('index').strpath
+    writer = FileHashIndex(indexdir)
+    # The file is hashed again after each change
+    for i in range(20):
+        writer.add(stat, 'md5:%d' % (i % 2), 'digest%d' % i)
+    path = tmpdir.join('index', FileHashIndex.filename)
+    assert len(path.readlines()) == 20
+
+    # Superseded lines are dropped when the index is loaded
+    reader = FileHashIndex(indexdir)
+    assert reader.get(stat, 'md5:0') == 'digest18'
+    assert len(path.readlines()) == 2
+    # Other processes keep reading (and appending to) the compacted index
+    writer.add(stat, 'sha1', 'abc')
+    assert reader.get(stat, 'sha1') == 'abc'
+    assert len(path.readlines()) == 3
+
+
+@pytest.mark.parametrize("algorithm", ['md5', 'sha256', 'blake2b'])
+def test_hash_infile_algorithm(tmpdir, algorithm):
+    import hashlib
+    afile = tmpdir.join('data.bin')
+    afile.write_binary(os.urandom(3000))
+    clear_file_hashes()
+    expected = hashlib.new(algorithm, afile.read_binary()).hexdigest()
+    # Small read buffers exercise reading in several chunks
+    assert hash_infile(afile.strpath, chunk_len=1024,
+                       crypto=algorithm) == expected
+    assert get_hash_function(algorithm)().name == algorithm
+    with pytest.raises(ValueError):
+        get_hash_function('nohash')
+    clear_file_hashes()
+
+
+def test_hash_infile_sampled(tmpdir):
+    afile = tmpdir.join('data.bin')
+    afile.write_binary(b'a' * 100 + b'b' * 100 + b'c' * 100)
+    clear_file_hashes()
+    digest = hash_infile(afile.strpath, sample_len=100)
+    assert digest != hash_infile(afile.strpath)
+    # Only the head and tail of the file are hashed
+    afile.write_binary(b'a' * 100 + b'x' * 100 + b'c' * 100)
+    assert hash_infile(afile.strpath, sample_len=100) == digest
+    afile.write_binary(b'a' * 100 + b'x' * 100 + b'd' * 100)
+    assert hash_infile(afile.strpath, sample_len=100) != digest
+    # Files smaller than the samples are hashed entirely
+    assert (hash_infile(afile.strpath, sample_len=200) ==
+            hash_infile(afile.strpath))
+    clear_file_hashes()
+
+
 def test_check_forhash():
     fname = 'foobar'
     orig_hash = '_0x4323dbcefdc51906decd8edcb3327943'
@@ -536,6 +636,25 @@ def test_pklization(tmpdir):
     assert os.getcwd() == tmpdir.strpath
 
 
+@pytest.mark.parametrize("compression", ['gzip', 'none', 'lz4', 'zstd'])
+def test_pklization_compression(tmpdir, compression):
+    if compression == 'lz4':
+        pytest.importorskip('lz4')
+    elif compression == 'zstd':
+        pytest.importorskip('zstandard')
+    tmpdir.chdir()
+
+    record = {'a': list(range(100)), 'b': 'text'}
+    savepkl('./record.pklz', record, compression=compression)
+    # The format is found from the contents of the file
+    assert loadpkl('./record.pklz') == record
+    savepkl('./record.pklz', record, versioning=True,
+            compression=compression)
+    assert loadpkl('./record.pklz', versioning=True) == record
+    with pytest.raises(ValueError):
+        savepkl('./record.pklz', record, compression='zip')
+
+
 class Pickled:
 
     def __getstate__(self):
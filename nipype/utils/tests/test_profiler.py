@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+import gc
+import sys
+
+import pytest
+
+from nipype.utils.profiler import GCMonitor, get_process_rss_gb
+
+
+@pytest.mark.skipif(sys.version_info < (3, 3),
+                    reason='gc.callbacks requires Python 3.3')
+def test_gc_monitor():
+    monitor = GCMonitor()
+    monitor.start()
+    gc.collect()
+    gc.collect()
+    monitor.stop()
+    assert monitor.collections >= 2
+    assert monitor.elapsed > 0
+
+    collections = monitor.collections
+    gc.collect()
+    assert monitor._callback not in gc.callbacks
+    assert monitor.collections == collections
+
+
+def test_get_process_rss_gb():
+    rss_gb = get_process_rss_gb()
+    assert rss_gb is None or 0 < rss_gb < 1024
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+Micro-benchmarks of the workflow engine and the execution plugins.
+
+Each subcommand times one of the operations that dominate the overhead of
+very large workflows, and prints one line per problem size::
+
+    python tools/benchmark_engine.py scheduler --sizes 1000 10000 100000
+
+"""
+from __future__ import print_function, division, absolute_import
+import argparse
+from time import time
+
+
+class FakeNode(object):
+    """Cheap stand-in for a node, for benchmarks that do not run anything"""
+
+    def __init__(self, name):
+        self.name = name
+        self.fullname = name
+
+    def __repr__(self):
+        return self.name
+
+
+def quiet_logging():
+    from nipype import logging
+    logging.getLogger('nipype.workflow').setLevel('WARNING')
+
+
+def chains_graph(size, depth):
+    """Build ``size // depth`` independent chains of ``depth`` nodes"""
+    import networkx as nx
+    graph = nx.DiGraph()
+    for chain in range(size // depth):
+        nodes = [FakeNode('c%d_n%d' % (chain, i)) for i in range(depth)]
+        graph.add_nodes_from(nodes)
+        graph.add_edges_from(zip(nodes[:-1], nodes[1:]))
+    return graph
+
+
+def bench_scheduler(args):
+    """Scheduling overhead: dependency bookkeeping for a whole run
+
+    Emulates a plugin that completes ``--per-tick`` jobs on each iteration
+    of the scheduling loop, without actually running any node.
+    """
+    from nipype.pipeline.plugins.base import DistributedPluginBase
+
+    quiet_logging()
+    print('%10s %10s %10s %12s %12s' % ('nodes', 'ticks', 'setup (s)',
+                                        'run (s)', 'per tick (ms)'))
+    for size in args.sizes:
+        graph = chains_graph(size, args.depth)
+        plugin = DistributedPluginBase()
+        plugin.mapnodesubids = {}
+
+        tic = time()
+        plugin._generate_dependency_list(graph)
+        setup = time() - tic
+
+        ticks = 0
+        tic = time()
+        while not plugin.proc_done.all():
+            jobids = plugin._ready_jobs()[:args.per_tick]
+            plugin.proc_done[jobids] = True
+            for jobid in jobids:
+                plugin._task_finished_cb(jobid)
+            ticks += 1
+        elapsed = time() - tic
+        print('%10d %10d %10.3f %12.3f %12.3f' % (
+            size, ticks, setup, elapsed, 1e3 * elapsed / ticks))
+
+
+def bench_submission(args):
+    """Master-side cost of submitting one node to the MultiProc workers
+
+    Compares the former deep copy (then pickled by the executor) with the
+    task descriptor, for nodes with a list of ``--sizes`` input files.
+    """
+    import pickle
+    from copy import deepcopy
+    from nipype.interfaces import utility as niu
+    from nipype.pipeline import engine as pe
+    from nipype.pipeline.plugins.multiproc import NodeTask
+
+    print('%10s %18s %18s' % ('files', 'deepcopy (ms)', 'NodeTask (ms)'))
+    for size in args.sizes:
+        node = pe.Node(niu.Merge(1), name='merge')
+        node.inputs.in1 = ['/data/sub-%06d_T1w.nii.gz' % i
+                           for i in range(size)]
+        timings = []
+        for submit in (lambda: pickle.dumps(deepcopy(node)),
+                       lambda: NodeTask(node)):
+            tic = time()
+            for _ in range(args.repeat):
+                submit()
+            timings.append(1e3 * (time() - tic) / args.repeat)
+        print('%10d %18.3f %18.3f' % ((size, ) + tuple(timings)))
+
+
+def bench_cache_status(args):
+    """Cache status of the nodes of a (synthetic) working directory
+
+    Compares the filesystem queries formerly made by ``Node.is_cached``
+    for each node with one scan of the tree by ``CacheStatusIndex``.
+    """
+    import os
+    import os.path as op
+    import shutil
+    from glob import glob
+    from tempfile import mkdtemp
+    from nipype.pipeline.engine.utils import CacheStatusIndex
+
+    print('%10s %15s %15s %15s' % ('nodes', 'queries (s)', 'scan (s)',
+                                   'lookups (s)'))
+    for size in args.sizes:
+        root = mkdtemp(dir=args.tmpdir)
+        outdirs = []
+        for i in range(size):
+            outdir = op.join(root, '_subject_id_%d' % (i // args.per_dir),
+                             'node%d' % (i % args.per_dir))
+            os.makedirs(op.join(outdir, '_report'))
+            for name in ('_0x%032x.json' % i, '_inputs.pklz', '_node.pklz',
+                         'result_node.pklz', '_report/report.rst'):
+                open(op.join(outdir, name), 'w').close()
+            outdirs.append((outdir, op.join(outdir, '_0x%032x.json' % i)))
+
+        tic = time()
+        for outdir, hashfile in outdirs:
+            assert op.exists(outdir)
+            assert op.exists(hashfile)
+            assert glob(op.join(outdir, '_0x*.json')) == [hashfile]
+        queries = time() - tic
+
+        tic = time()
+        index = CacheStatusIndex(root)
+        scan = time() - tic
+        tic = time()
+        for outdir, hashfile in outdirs:
+            assert index.hashfiles(outdir) == [hashfile]
+        lookups = time() - tic
+        print('%10d %15.3f %15.3f %15.3f' % (size, queries, scan, lookups))
+        shutil.rmtree(root)
+
+
+def bench_crash(args):
+    """Depth-first sort of the graph, and crash of the root of all nodes
+
+    Times ``topological_sort(depth_first=True)`` (used by the Linear
+    plugin and the workflow reports) on independent chains, and the
+    removal of the dependents of a crashed node by the distributed
+    plugins when the crash is upstream of every other node.
+    """
+    from nipype.pipeline.engine.utils import topological_sort
+    from nipype.pipeline.plugins.base import DistributedPluginBase
+
+    quiet_logging()
+    print('%10s %12s %18s %18s' % ('nodes', 'chains', 'depth-first (s)',
+                                   'remove deps (s)'))
+    for size in args.sizes:
+        graph = chains_graph(size, args.depth)
+        tic = time()
+        topological_sort(graph, depth_first=True)
+        sort = time() - tic
+
+        root = FakeNode('root')
+        graph.add_edges_from((root, node) for node in list(graph.nodes())
+                             if not graph.in_degree(node))
+        plugin = DistributedPluginBase()
+        plugin.mapnodesubids = {}
+        plugin._generate_dependency_list(graph)
+        tic = time()
+        plugin._remove_node_deps(plugin.procs.index(root), None, graph)
+        remove = time() - tic
+        assert plugin.proc_done.all()
+        print('%10d %12d %18.3f %18.3f' % (size, size // args.depth, sort,
+                                           remove))
+
+
+def iterables_workflow(subjects, runs, sessions, depth):
+    """Build a workflow iterating over subjects, their runs (itersource)
+    and sessions, with a chain of ``depth`` nodes for each combination"""
+    import nipype.pipeline.engine as pe
+    import nipype.interfaces.utility as niu
+
+    wf = pe.Workflow(name='bench')
+    subject = pe.Node(niu.IdentityInterface(['subject']), name='subject')
+    subject.iterables = ('subject', list(range(subjects)))
+    run = pe.Node(niu.IdentityInterface(['subject', 'run']), name='run')
+    run.itersource = ('subject', 'subject')
+    run.iterables = [('run', dict((i, list(range(runs)))
+                                  for i in range(subjects)))]
+    session = pe.Node(niu.IdentityInterface(['session']), name='session')
+    session.iterables = ('session', list(range(sessions)))
+    wf.connect(subject, 'subject', run, 'subject')
+    chain = [pe.Node(niu.Merge(3), name='step%d' % i) for i in range(depth)]
+    wf.connect([(run, chain[0], [('subject', 'in1'), ('run', 'in2')]),
+                (session, chain[0], [('session', 'in3')])])
+    for src, dest in zip(chain[:-1], chain[1:]):
+        wf.connect(src, 'out', dest, 'in1')
+    return wf
+
+
+def bench_expansion(args):
+    """Expansion of the iterables of a workflow into its execution graph
+
+    Times ``generate_expanded_graph`` on the flat graph of a workflow with
+    nested iterables; the sizes are the numbers of expanded nodes.
+    """
+    from nipype.pipeline.engine.utils import generate_expanded_graph
+
+    quiet_logging()
+    print('%10s %10s %15s %15s' % ('nodes', 'subjects', 'flat (s)',
+                                   'expansion (s)'))
+    per_subject = args.runs * args.sessions * args.depth
+    for size in args.sizes:
+        subjects = max(1, size // per_subject)
+        wf = iterables_workflow(subjects, args.runs, args.sessions,
+                                args.depth)
+        tic = time()
+        flatgraph = wf._create_flat_graph()
+        flat = time() - tic
+        tic = time()
+        execgraph = generate_expanded_graph(flatgraph)
+        elapsed = time() - tic
+        print('%10d %10d %15.3f %15.3f' % (len(execgraph), subjects, flat,
+                                           elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    sched = subparsers.add_parser('scheduler', help=bench_scheduler.__doc__)
+    sched.add_argument('--sizes', type=int, nargs='+',
+                       default=[1000, 10000, 100000])
+    sched.add_argument('--depth', type=int, default=10,
+                       help='length of each chain of nodes')
+    sched.add_argument('--per-tick', type=int, default=64,
+                       help='jobs completed by each scheduler iteration')
+    sched.set_defaults(func=bench_scheduler)
+
+    submit = subparsers.add_parser('submission', help=bench_submission.__doc__)
+    submit.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 1000, 10000])
+    submit.add_argument('--repeat', type=int, default=20)
+    submit.set_defaults(func=bench_submission)
+
+    status = subparsers.add_parser('cache_status',
+                                   help=bench_cache_status.__doc__)
+    status.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    status.add_argument('--per-dir', type=int, default=20,
+                        help='nodes in each (iterable) directory')
+    status.add_argument('--tmpdir', help='where to create the trees, '
+                        'e.g. on the shared filesystem')
+    status.set_defaults(func=bench_cache_status)
+
+    crash = subparsers.add_parser('crash', help=bench_crash.__doc__)
+    crash.add_argument('--sizes', type=int, nargs='+',
+                       default=[1000, 10000, 100000])
+    crash.add_argument('--depth', type=int, default=10,
+                       help='length of each chain of nodes')
+    crash.set_defaults(func=bench_crash)
+
+    expansion = subparsers.add_parser('expansion',
+                                      help=bench_expansion.__doc__)
+    expansion.add_argument('--sizes', type=int, nargs='+',
+                           default=[1000, 10000, 100000])
+    expansion.add_argument('--runs', type=int, default=2,
+                           help='runs of each subject (itersource)')
+    expansion.add_argument('--sessions', type=int, default=2)
+    expansion.add_argument('--depth', type=int, default=5,
+                           help='nodes processing each run and session')
+    expansion.set_defaults(func=bench_expansion)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()